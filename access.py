@@ -0,0 +1,140 @@
+"""
+Отсев обновлений до постановки в очередь: список блокировки и ограничение частоты.
+
+Проверка выполняется в LaneDispatcher.submit, то есть раньше очереди полосы,
+чтения состояния FSM, запросов к базе и генерации QR-кода: флудящий или
+заблокированный пользователь не занимает места в полосе, общей с другими
+пользователями. Проверка синхронная и обходится без ввода-вывода. Заблокированные
+пользователи ищутся в множестве в памяти, которое загружается из таблицы
+blocked_users при запуске и меняется вместе с ней. Частота ограничивается
+token bucket на пару (пользователь, маршрут): у кнопок и команд со своим
+правилом — отдельный bucket, остальные сообщения делят общий. Администраторы
+не блокируются и не ограничиваются.
+"""
+import asyncio
+import os
+import time
+
+from aiogram import Bot, types
+
+from database import Database
+from lanes import update_owner
+from metrics import UPDATES_REJECTED
+from router import TextRouter
+
+DEFAULT_ROUTE = '*'
+
+
+def parse_rate(text: str):
+    """'3/60' -> (3, 60.0): не больше 3 запросов за 60 секунд"""
+    count, seconds = text.split('/')
+    return int(count), float(seconds)
+
+
+class TokenBuckets:
+    """Token bucket на каждый ключ; полные buckets не хранятся"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        # ключ -> [токены, время обновления, предупреждение отправлено]
+        self.buckets = {}
+        self.longest_period = 0
+
+    def allow(self, key, limit: int, period: float, now: float = None):
+        """(разрешено, нужно ли предупредить): предупреждение — один раз за серию отказов"""
+        now = time.monotonic() if now is None else now
+        self.longest_period = max(self.longest_period, period)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_size:
+                self._prune(now)
+            bucket = self.buckets[key] = [limit, now, False]
+        else:
+            bucket[0] = min(limit, bucket[0] + (now - bucket[1]) * limit / period)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True, False
+        warn = not bucket[2]
+        bucket[2] = True
+        return False, warn
+
+    def _prune(self, now: float):
+        # За самый длинный период любой bucket снова полон и ничем не отличается от отсутствующего
+        horizon = now - self.longest_period
+        self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[1] > horizon}
+
+
+class Blocklist:
+    """Заблокированные пользователи: множество в памяти, синхронное с таблицей blocked_users"""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.user_ids = set()
+
+    async def load(self):
+        """Загружает список из базы; вызывается при запуске бота"""
+        self.user_ids = set(await self.db.blocked_user_ids())
+
+    async def block(self, user_id: int, admin_id: int, reason: str = None):
+        await self.db.block_user(user_id, admin_id, reason)
+        self.user_ids.add(user_id)
+
+    async def unblock(self, user_id: int) -> bool:
+        """False, если пользователь не был заблокирован"""
+        removed = await self.db.unblock_user(user_id)
+        self.user_ids.discard(user_id)
+        return removed
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self.user_ids
+
+    def __len__(self):
+        return len(self.user_ids)
+
+
+class AccessControl:
+    """Отбрасывает обновления заблокированных пользователей и превысивших лимит запросов"""
+
+    def __init__(self, bot: Bot, router: TextRouter, blocklist: Blocklist, admin_ids):
+        self.bot = bot
+        self.router = router
+        self.blocklist = blocklist
+        self.admin_ids = set(admin_ids)
+        # Общий лимит для сообщений без своего правила, inline-запросов и нажатий кнопок
+        self.default_rate = parse_rate(os.getenv('THROTTLE_DEFAULT', '30/60'))
+        self.buckets = TokenBuckets(int(os.getenv('THROTTLE_MAX_USERS', '10000')))
+        self.warnings = set()
+
+    def admit(self, update: types.Update) -> bool:
+        """True, если обновление можно ставить в очередь"""
+        user_id = update_owner(update)
+        if user_id in self.admin_ids:
+            return True
+        if user_id in self.blocklist:
+            UPDATES_REJECTED.inc('blocked')
+            return False
+
+        key, (limit, period) = DEFAULT_ROUTE, self.default_rate
+        if update.message is not None:
+            # Кнопка считается по тексту и внутри сценария: так не нужно читать состояние FSM
+            route = self.router.throttled_route(update.message)
+            if route is not None:
+                key, (limit, period) = route.key, route.throttle
+        allowed, warn = self.buckets.allow((user_id, key), limit, period)
+        if allowed:
+            return True
+        UPDATES_REJECTED.inc('throttled')
+        if warn and update.message is not None:
+            # Предупреждение уходит в фоне: submit не ждет Bot API
+            task = asyncio.ensure_future(self._warn(update.message.chat.id))
+            self.warnings.add(task)
+            task.add_done_callback(self.warnings.discard)
+        return False
+
+    async def _warn(self, chat_id: int):
+        try:
+            await self.bot.send_message(chat_id, "⏳ Слишком много запросов. Подождите немного и попробуйте снова.")
+        except Exception as e:
+            print(f"Error: {e}")
@@ -0,0 +1,188 @@
+"""
+Бенчмарк распознавания QR-кодов на синтетическом корпусе фотографий.
+
+QR-коды рисуются теми же настройками, что и в боте (qr_cache.render_qr_png),
+и переносятся на «снимок» с поворотом, перспективой, размытием, бликом,
+плохим освещением и JPEG-сжатием в разрешениях от 0.3 до 12 Мп.
+Результат — JSON с перцентилями задержек по стадиям, пиком памяти и
+долей успешных распознаваний; файлы разных версий удобно сравнивать diff-ом.
+
+    python bench_qr.py --samples 10 --output bench.json
+    python bench_qr.py --samples 10 --baseline bench.json
+"""
+import argparse
+from collections import defaultdict
+import json
+import math
+import random
+import resource
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from qr_cache import qr_payload, render_qr_png
+from qr_decode import STAGES, decode_photo
+
+RESOLUTIONS_MP = (0.3, 1, 3, 8, 12)
+DISTORTIONS = ('clean', 'rotation', 'perspective', 'blur', 'glare', 'low_light', 'jpeg')
+
+
+def percentile(values, q):
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+def make_photo(user_id: int, megapixels: float, distortion: str, rng: random.Random) -> bytes:
+    """Синтетический снимок экрана телефона с QR-кодом пользователя, JPEG"""
+    qr = cv2.imdecode(np.frombuffer(render_qr_png(qr_payload(user_id)), np.uint8), cv2.IMREAD_COLOR)
+
+    width = int(math.sqrt(megapixels * 1e6 * 4 / 3))
+    height = int(width * 3 / 4)
+    # Фон: неравномерно освещенная стойка администратора
+    gradient = np.linspace(60, 140, width, dtype=np.float32)
+    background = np.tile(gradient, (height, 1))
+    background += np.random.default_rng(rng.randrange(2 ** 32)).normal(0, 8, (height, width))
+    photo = cv2.cvtColor(np.clip(background, 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+
+    # QR-код занимает примерно треть меньшей стороны кадра
+    side = max(qr.shape[0], int(min(width, height) * rng.uniform(0.25, 0.45)))
+    qr = cv2.resize(qr, (side, side), interpolation=cv2.INTER_NEAREST)
+    x = rng.randrange(0, width - side)
+    y = rng.randrange(0, height - side)
+    src = np.float32([[0, 0], [side, 0], [side, side], [0, side]])
+    dst = src + np.float32([x, y])
+
+    if distortion == 'rotation':
+        center = (x + side / 2, y + side / 2)
+        matrix = cv2.getRotationMatrix2D(center, rng.uniform(-45, 45), 1.0)
+        dst = cv2.transform(dst[None], matrix)[0].astype(np.float32)
+    elif distortion == 'perspective':
+        jitter = side * 0.12
+        dst = dst + np.float32([[rng.uniform(-jitter, jitter), rng.uniform(-jitter, jitter)] for _ in range(4)])
+
+    matrix = cv2.getPerspectiveTransform(src, dst)
+    warped = cv2.warpPerspective(qr, matrix, (width, height))
+    mask = cv2.warpPerspective(np.full((side, side), 255, np.uint8), matrix, (width, height))
+    photo[mask > 0] = warped[mask > 0]
+
+    if distortion == 'blur':
+        k = max(3, int(side / 60) | 1)
+        photo = cv2.GaussianBlur(photo, (k, k), 0)
+    elif distortion == 'glare':
+        glare = np.zeros((height, width), np.float32)
+        cv2.circle(glare, (int(x + side * rng.random()), int(y + side * rng.random())), int(side * 0.3), 1.0, -1)
+        glare = cv2.GaussianBlur(glare, (0, 0), side * 0.1)
+        photo = np.clip(photo + glare[..., None] * 160, 0, 255).astype(np.uint8)
+    elif distortion == 'low_light':
+        dark = photo.astype(np.float32) * 0.3
+        dark += np.random.default_rng(rng.randrange(2 ** 32)).normal(0, 6, dark.shape)
+        photo = np.clip(dark, 0, 255).astype(np.uint8)
+
+    quality = rng.randint(20, 45) if distortion == 'jpeg' else 90
+    return cv2.imencode('.jpg', photo, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def run(samples: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    timings = defaultdict(list)
+    totals = []
+    wins = defaultdict(int)
+    by_resolution = defaultdict(lambda: [0, 0])
+    by_distortion = defaultdict(lambda: [0, 0])
+    peak = 0
+
+    for megapixels in RESOLUTIONS_MP:
+        for i in range(samples):
+            distortion = DISTORTIONS[i % len(DISTORTIONS)]
+            user_id = rng.randrange(10 ** 8, 10 ** 10)
+            data = make_photo(user_id, megapixels, distortion, rng)
+
+            stage_timings = {}
+            started = time.perf_counter()
+            try:
+                result = decode_photo(data, stage_timings)
+            except ValueError:
+                result = None
+            totals.append(time.perf_counter() - started)
+
+            # Память — отдельным проходом: трассировка tracemalloc замедляет каждое выделение
+            # и исказила бы задержки стадий
+            tracemalloc.start()
+            try:
+                decode_photo(data, {})
+            except ValueError:
+                pass
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+            for stage, seconds in stage_timings.items():
+                timings[stage].append(seconds)
+            ok = result is not None and result.data == qr_payload(user_id)
+            if ok:
+                wins[result.stage] += 1
+            for bucket in (by_resolution[str(megapixels)], by_distortion[distortion]):
+                bucket[0] += ok
+                bucket[1] += 1
+
+    def latency(values):
+        return {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 50) * 1000, 2) if values else None,
+            'p90_ms': round(percentile(values, 90) * 1000, 2) if values else None,
+            'p99_ms': round(percentile(values, 99) * 1000, 2) if values else None,
+        }
+
+    total = sum(count for _, count in by_resolution.values())
+    return {
+        'samples': total,
+        'seed': seed,
+        'success_rate': round(sum(ok for ok, _ in by_resolution.values()) / total, 4),
+        'latency': {'total': latency(totals), **{
+            stage: latency(timings[stage]) for stage in ('imdecode',) + STAGES
+        }},
+        'stage_wins': {stage: wins[stage] for stage in STAGES},
+        'success_by_resolution_mp': {k: round(ok / n, 4) for k, (ok, n) in by_resolution.items()},
+        'success_by_distortion': {k: round(ok / n, 4) for k, (ok, n) in by_distortion.items()},
+        'memory': {
+            'python_peak_mb': round(peak / 2 ** 20, 1),
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+    }
+
+
+def compare(report: dict, baseline: dict):
+    """Печатает изменение ключевых метрик относительно прошлого прогона"""
+    print(f"success_rate: {baseline['success_rate']} -> {report['success_rate']}")
+    for stage, values in report['latency'].items():
+        old = baseline['latency'].get(stage, {})
+        for key in ('p50_ms', 'p99_ms'):
+            if values.get(key) is not None and old.get(key):
+                change = (values[key] - old[key]) / old[key] * 100
+                print(f"{stage}.{key}: {old[key]} -> {values[key]} ({change:+.1f}%)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарк распознавания QR-кодов')
+    parser.add_argument('--samples', type=int, default=14, help='снимков на каждое разрешение')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='куда записать JSON (по умолчанию stdout)')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    report = run(args.samples, args.seed)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+        sys.stdout.flush()
@@ -0,0 +1,133 @@
+"""
+Бенчмарк запуска бота: время импорта и занимаемая память.
+
+Каждый замер — отдельный чистый процесс Python, поэтому кэш импортов
+предыдущих замеров не влияет на результат. Сценарии:
+
+    import   — import bot
+    startup  — import bot и создание SolariumBot с новой базой
+    imaging  — startup плюс загрузка OpenCV, zbar и Pillow (как после прогрева)
+    decode   — startup и одно распознавание QR-кода в пуле воркеров
+
+Результат — JSON с медианой и максимумом времени, памятью процесса и
+списком загруженных библиотек изображений. После decode библиотеки должны
+остаться только в воркерах: если они оказались в основном процессе,
+бенчмарк завершается с кодом 1.
+
+    python bench_startup.py --repeat 5 --output startup.json
+    python bench_startup.py --repeat 5 --baseline startup.json
+"""
+import argparse
+import json
+import os
+from statistics import median
+import subprocess
+import sys
+import tempfile
+
+IMAGING_MODULES = ('cv2', 'numpy', 'PIL', 'pyzbar', 'qrcode')
+
+# Код замера выполняется в дочернем процессе; каталог бота передается через sys.path
+PROBE = '''
+import json, os, resource, sys, time
+started = time.perf_counter()
+import bot
+if SCENARIO in ('startup', 'imaging', 'decode'):
+    solarium_bot = bot.SolariumBot('123456:startup-bench')
+if SCENARIO == 'imaging':
+    import qr_decode
+    from qr_cache import qr_payload, render_qr_png
+    render_qr_png(qr_payload(0))
+decoded = None
+if SCENARIO == 'decode':
+    import asyncio
+    with open('qr.png', 'rb') as f:
+        result = asyncio.run(solarium_bot.qr_service.decode(f.read()))
+    decoded = result is not None
+    solarium_bot.qr_service.close()
+elapsed = time.perf_counter() - started
+rss_kb = None
+try:
+    with open('/proc/self/status') as f:
+        rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+except OSError:
+    pass
+if SCENARIO in ('startup', 'imaging', 'decode'):
+    solarium_bot.db.close()
+print(json.dumps({
+    'seconds': elapsed,
+    'rss_kb': rss_kb,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'imaging_loaded': sorted(name for name in IMAGING_MODULES if name in sys.modules),
+    'decoded': decoded,
+}))
+'''
+
+SCENARIOS = ('import', 'startup', 'imaging', 'decode')
+
+
+def probe(scenario: str, photo: bytes) -> dict:
+    """Один замер в новом процессе"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    code = f'import sys; sys.path.insert(0, {root!r})\n' \
+           f'SCENARIO = {scenario!r}\nIMAGING_MODULES = {IMAGING_MODULES!r}\n' + PROBE
+    with tempfile.TemporaryDirectory(prefix='solarium-startup-') as workdir:
+        # Отдельный каталог: бот создает базу и кэш QR-кодов в текущем каталоге
+        with open(os.path.join(workdir, 'qr.png'), 'wb') as f:
+            f.write(photo)
+        env = {**os.environ, 'ADMIN_IDS': '1'}
+        output = subprocess.run([sys.executable, '-c', code], cwd=workdir, env=env,
+                                capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(repeat: int) -> dict:
+    # Снимок для сценария decode рисуется здесь, в процессе бенчмарка, а не в замеряемом
+    from qr_cache import qr_payload, render_qr_png
+    photo = render_qr_png(qr_payload(123456789))
+    report = {}
+    for scenario in SCENARIOS:
+        samples = [probe(scenario, photo) for _ in range(repeat)]
+        seconds = [sample['seconds'] for sample in samples]
+        rss = [sample['rss_kb'] or sample['max_rss_kb'] for sample in samples]
+        report[scenario] = {
+            'repeat': repeat,
+            'p50_ms': round(median(seconds) * 1000, 1),
+            'max_ms': round(max(seconds) * 1000, 1),
+            'rss_mb': round(median(rss) / 1024, 1),
+            'imaging_loaded': samples[-1]['imaging_loaded'],
+        }
+    report['decode']['decoded'] = all(sample['decoded'] for sample in samples)
+    return report
+
+
+def compare(report: dict, baseline: dict):
+    """Печатает изменение времени и памяти относительно прошлого прогона"""
+    for scenario, values in report.items():
+        old = baseline.get(scenario, {})
+        for key in ('p50_ms', 'rss_mb'):
+            if old.get(key):
+                change = (values[key] - old[key]) / old[key] * 100
+                print(f"{scenario}.{key}: {old[key]} -> {values[key]} ({change:+.1f}%)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарк запуска бота')
+    parser.add_argument('--repeat', type=int, default=5, help='замеров на каждый сценарий')
+    parser.add_argument('--output', help='куда записать JSON (по умолчанию stdout)')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    report = run(args.repeat)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+    if report['decode']['imaging_loaded']:
+        print(f"Основной процесс загрузил после распознавания: {', '.join(report['decode']['imaging_loaded'])}")
+        sys.exit(1)
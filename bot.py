@@ -1,728 +1,1042 @@
-from aiogram import Bot, Dispatcher, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.dispatcher import FSMContext
-from aiogram.dispatcher.filters import CommandStart, Command
-from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InputFile, ContentType
-import asyncio
-import cv2
-from datetime import datetime
-from dotenv import load_dotenv
-import numpy as np
-from io import BytesIO
-import os
-from PIL import Image
-from pyzbar.pyzbar import decode, ZBarSymbol
-import qrcode
-import sqlite3
-
-# Загрузка переменных окружения
-load_dotenv()
-
-SOLARIUM_ADDRESS = os.getenv('SOLARIUM_ADDRESS')
-SOLARIUM_PHONE = os.getenv('SOLARIUM_PHONE')
-SOLARIUM_SOCIAL = os.getenv('SOLARIUM_SOCIAL')
-
-class RegistrationStates(StatesGroup):
-    waiting_for_fullname = State()
-    waiting_for_birthdate = State()
-    waiting_for_phone = State()
-
-class DetectQR(StatesGroup):
-    waiting_for_id = State()
-    waiting_for_minutes = State()
-
-class MinDetectQR(StatesGroup):
-    waiting_for_id = State()
-    waiting_for_minutes = State()
-
-class allSpam(StatesGroup):
-    waiting_for_spam = State()
-    waiting_for_compl = State()
-
-class SolariumBot:
-    def __init__(self, token: str):
-        self.storage = MemoryStorage()
-        self.bot = Bot(token=token)
-        self.dp = Dispatcher(self.bot, storage=self.storage)
-        self.admin_ids = list(map(int, os.getenv('ADMIN_IDS', '').split(','))) if os.getenv('ADMIN_IDS') else []
-        self.pending_birth_date = {}
-        
-        # Инициализация базы данных
-        self.init_db()
-        
-        # Регистрация обработчиков для aiogram 3.20
-        self.dp.register_message_handler(self.start_handler, CommandStart())
-        self.dp.register_message_handler(self.main_menu_handler, lambda message: message.text == "🔙 Вернуться в главное меню")
-        self.dp.register_message_handler(self.registration_handler, lambda message: message.text == "📝 Регистрация")
-        self.dp.register_message_handler(self.user_menu_handler, lambda message: message.text == "👤 Пользователь")
-        self.dp.register_message_handler(self.admin_menu_handler, lambda message: message.text == "⚙️ Панель администратора")
-        
-        # Обработчики панели пользователя
-        self.dp.register_message_handler(self.profile_handler, lambda message: message.text == "👤 Профиль")
-        self.dp.register_message_handler(self.qr_handler, lambda message: message.text == "📱 QR-код")
-        self.dp.register_message_handler(self.contact_handler, lambda message: message.text == "📞 Контакты")
-        self.dp.register_message_handler(self.recommendations_handler, lambda message: message.text == "💡 Советы")
-        self.dp.register_message_handler(self.help_user_handler, lambda message: message.text == "❓ Помощь")
-
-        # Обработчики панели администратора
-        self.dp.register_message_handler(self.add_minutes_handler, lambda message: message.text == "➕ Добавить минуты")
-        self.dp.register_message_handler(self.minus_minutes_handler, lambda message: message.text == "➖ Списать минуты")
-        #self.dp.register_message_handler(self.contact_handler, lambda message: message.text == "📊 Статистика")
-        self.dp.register_message_handler(self.spam_handler, lambda message: message.text == "📢 Рассылка")
-        #self.dp.register_message_handler(self.help_user_handler, lambda message: message.text == "🔒 Блокировка пользователя")
-        #self.dp.register_message_handler(self.help_user_handler, lambda message: message.text == "🔓 Разблокировка пользователя")
-        #self.dp.register_message_handler(self.help_user_handler, lambda message: message.text == "👤 Информация о пользователе")
-        # Обработчики добавления минут
-        self.dp.register_message_handler(self.add_detect, state=DetectQR.waiting_for_id, content_types=[ContentType.TEXT, ContentType.PHOTO])
-        self.dp.register_message_handler(self.num_minutes, state=DetectQR.waiting_for_minutes)
-        # Обработчики списания минут
-        self.dp.register_message_handler(self.minus_detect, state=MinDetectQR.waiting_for_id, content_types=[ContentType.TEXT, ContentType.PHOTO])
-        self.dp.register_message_handler(self.minus_num_minutes, state=MinDetectQR.waiting_for_minutes)
-        # Обработчик рассылки минут
-        self.dp.register_message_handler(self.spam, state=allSpam.waiting_for_spam)
-        
-        # Обработчики регистрации
-        self.dp.register_message_handler(self.process_fullname, state=RegistrationStates.waiting_for_fullname)
-        self.dp.register_message_handler(self.process_birthdate, state=RegistrationStates.waiting_for_birthdate)
-        self.dp.register_message_handler(self.process_phone, state=RegistrationStates.waiting_for_phone)
-    
-    def init_db(self):
-        """Инициализация базы данных SQLite"""
-        self.conn = sqlite3.connect('solarium_bot.db')
-        self.cursor = self.conn.cursor()
-        
-        # Создание таблицы пользователей, если она не существует
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            fullname TEXT,
-            birthdate TEXT,
-            phone TEXT,
-            registration_date TEXT,
-            number_minutes INT,
-            total_minutes INT
-                            
-        )
-        ''')
-        self.conn.commit()
-    
-    async def close_db(self):
-        """Закрытие соединения с базой данных"""
-        self.conn.close()
-    
-    def user_exists(self, user_id: int) -> bool:
-        """Проверяет, существует ли пользователь в базе данных"""
-        self.cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
-        return self.cursor.fetchone() is not None
-    
-    def add_user(self, user_id: int, username: str, fullname: str, birthdate: str, phone: str):
-        """Добавляет пользователя в базу данных"""
-        registration_date = datetime.now().strftime('%d-%m-%Y %H:%M:%S')
-        self.cursor.execute('''
-        INSERT INTO users (user_id, username, fullname, birthdate, phone, registration_date, number_minutes, total_minutes)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, username, fullname, birthdate, phone, registration_date, 0, 0))
-        self.conn.commit()
-
-    def find_white_square(self, image):
-        """Находит белый квадрат на изображении и возвращает его ROI"""
-        # Преобразуем в HSV для лучшего выделения белого
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        
-        # Диапазон белого цвета в HSV
-        lower_white = np.array([0, 0, 200])
-        upper_white = np.array([180, 30, 255])
-        mask = cv2.inRange(hsv, lower_white, upper_white)
-        
-        # Морфологические операции
-        kernel = np.ones((5,5), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        
-        # Находим контуры
-        contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # Ищем квадратные контуры
-        squares = []
-        for cnt in contours:
-            # Аппроксимируем контур
-            epsilon = 0.1 * cv2.arcLength(cnt, True)
-            approx = cv2.approxPolyDP(cnt, epsilon, True)
-            
-            # Ищем четырехугольники
-            if len(approx) == 4:
-                # Проверяем на квадратность
-                area = cv2.contourArea(approx)
-                x,y,w,h = cv2.boundingRect(approx)
-                aspect_ratio = float(w)/h
-                
-                if 0.8 < aspect_ratio < 1.2 and area > 1000:  # Фильтр по размеру и форме
-                    squares.append(approx)
-        
-        # Если нашли квадраты, берем самый большой
-        if squares:
-            largest_square = max(squares, key=cv2.contourArea)
-            
-            # Получаем повернутый прямоугольник
-            rect = cv2.minAreaRect(largest_square)
-            box = cv2.boxPoints(rect)
-            box = box.astype(np.int32)
-            
-            # Вычисляем ширину и высоту ROI
-            width = int(rect[1][0])
-            height = int(rect[1][1])
-            
-            # Точки для перспективного преобразования
-            src_pts = box.astype("float32")
-            dst_pts = np.array([[0, height-1],
-                            [0, 0],
-                            [width-1, 0],
-                            [width-1, height-1]], dtype="float32")
-            
-            # Перспективное преобразование
-            M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-            warped = cv2.warpPerspective(image, M, (width, height))
-            return warped
-        
-        return None  
-
-    def decode_qr_from_roi(self, roi):
-        """Декодирует QR-код из выделенной области"""
-        # Улучшаем изображение
-        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        # Декодируем QR
-        decoded = decode(thresh, symbols=[ZBarSymbol.QRCODE])
-        if decoded:
-            return decoded[0].data.decode('ascii')
-        return None
-
-    def get_main_keyboard(self, is_admin: bool = False):
-        """Создание главной клавиатуры"""
-        if is_admin:
-            keyboard = [
-                [KeyboardButton(text="👤 Пользователь")],
-                [KeyboardButton(text="⚙️ Панель администратора")]
-            ]
-        else:
-            keyboard = [
-            [KeyboardButton(text="👤 Профиль")],
-            [KeyboardButton(text="📱 QR-код")],
-            [KeyboardButton(text="📞 Контакты")],
-            [KeyboardButton(text="💡 Советы")],
-            [KeyboardButton(text="❓ Помощь")],
-        ]
-        return ReplyKeyboardMarkup(
-            keyboard=keyboard,
-            resize_keyboard=True
-        )
-
-    def get_user_keyboard(self, is_admin: bool = False):
-        """Создание клавиатуры обычного пользователя"""
-        if is_admin:
-            keyboard = [
-                [KeyboardButton(text="👤 Профиль")],
-                [KeyboardButton(text="📱 QR-код")],
-                [KeyboardButton(text="📞 Контакты")],
-                [KeyboardButton(text="💡 Советы")],
-                [KeyboardButton(text="❓ Помощь")],
-                [KeyboardButton(text="🔙 Вернуться в главное меню")]
-            ]
-            return ReplyKeyboardMarkup(
-                keyboard=keyboard,
-                resize_keyboard=True
-            )
-        else:
-            keyboard = [
-                [KeyboardButton(text="👤 Профиль")],
-                [KeyboardButton(text="📱 QR-код")],
-                [KeyboardButton(text="📞 Контакты")],
-                [KeyboardButton(text="💡 Советы")],
-                [KeyboardButton(text="❓ Помощь")],
-            ]
-            return ReplyKeyboardMarkup(
-                keyboard=keyboard,
-                resize_keyboard=True
-            )
-    
-    
-
-    def get_admin_keyboard(self):
-        """Создание клавиатуры панели администратора"""
-        keyboard = [
-            [KeyboardButton(text="➕ Добавить минуты")],
-            [KeyboardButton(text="➖ Списать минуты")],
-            #[KeyboardButton(text="📊 Статистика")],
-            [KeyboardButton(text="📢 Рассылка")],
-            #[KeyboardButton(text="🔒 Блокировка пользователя")],
-            #[KeyboardButton(text="🔓 Разблокировка пользователя")],
-            #[KeyboardButton(text="👤 Информация о пользователе")],
-            [KeyboardButton(text="🔙 Вернуться в главное меню")]
-        ]
-        return ReplyKeyboardMarkup(
-            keyboard=keyboard,
-            resize_keyboard=True
-        )
-    
-    async def start_handler(self, message: types.Message):
-        """Обработчик команды /start"""
-        is_admin = message.from_user.id in self.admin_ids
-        
-        if self.user_exists(message.from_user.id):
-            await message.answer(
-                "С возвращением!",
-                reply_markup=self.get_main_keyboard(is_admin)
-            )
-        else:
-            await message.answer(
-                "Добро пожаловать в бот солярия!",
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[[KeyboardButton(text="📝 Регистрация")]],
-                    resize_keyboard=True
-                    )
-            )
-    
-    async def main_menu_handler(self, message: types.Message):
-        """Обработчик возврата в главное меню"""
-        is_admin = message.from_user.id in self.admin_ids
-        await message.answer(
-            "Главное меню:",
-            reply_markup=self.get_main_keyboard(is_admin)
-        )
-    
-    async def registration_handler(self, message: types.Message):
-        """Обработчик начала регистрации"""
-        if self.user_exists(message.from_user.id):
-            await message.answer("Вы уже зарегистрированы!")
-            return
-        
-        await message.answer(
-            "Давайте начнем регистрацию. Введите ваше ФИО:",
-            reply_markup=types.ReplyKeyboardRemove()
-        )
-        await RegistrationStates.waiting_for_fullname.set()
-    
-    async def process_fullname(self, message: types.Message, state: FSMContext):
-        """Обработчик ввода ФИО"""
-        if len(message.text.split()) >= 2:
-            async with state.proxy() as data:
-                data['fullname'] = message.text
-            
-            await message.answer("Отлично! Теперь введите вашу дату рождения в формате ДД.ММ.ГГГГ:")
-            await RegistrationStates.next()
-        else:
-            await message.answer("Неверный формат. Пожалуйста, ФИО:")
-            return
-    
-    async def process_birthdate(self, message: types.Message, state: FSMContext):
-        """Обработчик ввода даты рождения"""
-        try:
-            birthdate = datetime.strptime(message.text, '%d.%m.%Y').date()
-            async with state.proxy() as data:
-                data['birthdate'] = birthdate.strftime('%d-%m-%Y')
-            
-            await message.answer("Отлично! Теперь отправьте ваш номер телефона:")
-            await RegistrationStates.next()
-        except ValueError:
-            await message.answer("Неверный формат даты. Пожалуйста, введите дату в формате ДД.ММ.ГГГГ:")
-    
-    async def process_phone(self, message: types.Message, state: FSMContext):
-        """Обработчик ввода телефона и завершение регистрации"""
-        phone = message.text
-        cleaned = ''.join(c for c in phone if c.isdigit() or c == '+')
-        if len(cleaned) == 12 and cleaned.startswith('+7'):
-            async with state.proxy() as data:
-                fullname = data['fullname']
-                birthdate = data['birthdate']
-            
-            # Сохраняем пользователя в базу данных
-            self.add_user(
-                user_id=message.from_user.id,
-                username=message.from_user.username,
-                fullname=fullname,
-                birthdate=birthdate,
-                phone=phone
-            )
-            
-            await message.answer(
-                "Регистрация завершена успешно!",
-                reply_markup=self.get_main_keyboard(message.from_user.id in self.admin_ids)
-            )
-            await state.finish()
-        else:
-            await message.answer("Неверный формат телефона. Пожалуйста, введите номер телефона:")
-            return
-            
-    
-    async def user_menu_handler(self, message: types.Message):
-        is_admin = message.from_user.id in self.admin_ids
-        """Обработчик меню пользователя"""
-        if not self.user_exists(message.from_user.id):
-            await message.answer("Пожалуйста, сначала зарегистрируйтесь!")
-            return
-        
-        await message.answer(
-            "Меню пользователя:",
-            reply_markup=self.get_user_keyboard(is_admin)
-        )
-    
-    async def admin_menu_handler(self, message: types.Message):
-        """Обработчик админского меню"""
-        if message.from_user.id in self.admin_ids:
-            await message.answer(
-                "Панель администратора:",
-                reply_markup=self.get_admin_keyboard()
-            )
-        else:
-            await message.answer("У вас нет прав администратора!")
-
-    async def profile_handler(self, message: types.Message):
-        """Обработчик профиля пользователя"""
-        is_admin = message.from_user.id in self.admin_ids
-        self.cursor.execute('SELECT fullname, birthdate, phone, number_minutes, total_minutes FROM users WHERE user_id = ?', (message.from_user.id,))
-        result = self.cursor.fetchone()
-        profile_text = (
-            f"👤 Профиль\n\n"
-            f"ФИО: {result[0]}\n"
-            f"Телефон: {result[2]}\n"
-            f"Дата рождения: {result[1]}\n"
-            f"Осталось минут: {result[3]} минут\n"
-            f"Всего использовано минут: {result[4]} минут"
-        )
-        await message.answer(
-                profile_text,
-                reply_markup=self.get_user_keyboard(is_admin)
-            )
-        
-    async def qr_handler(self, message: types.Message):
-        is_admin = message.from_user.id in self.admin_ids
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(message.from_user.id)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        bio = BytesIO()
-        bio.name = 'qr.png'
-        img.save(bio, 'PNG')
-        bio.seek(0)
-        photo = InputFile(bio, filename='qr.png')
-
-        # Отправляем QR-код
-        await message.reply_photo(
-            photo=photo,
-            caption=f"Ваш QR-код для идентификации в солярии",
-            reply_markup=self.get_user_keyboard(is_admin)
-        )
-
-    async def contact_handler(self, message: types.Message):
-        """Показ контактной информации"""
-        is_admin = message.from_user.id in self.admin_ids
-        contact_text = (
-            f"📞 Контактная информация\n\n"
-            f"Адрес: {SOLARIUM_ADDRESS}\n"
-            f"Телефон: {SOLARIUM_PHONE}\n"
-            f"Социальные сети: {SOLARIUM_SOCIAL}"
-        )
-        await message.answer(
-                contact_text,
-                reply_markup=self.get_user_keyboard(is_admin)
-            )
-
-    async def recommendations_handler(self, message: types.Message):
-        """Показ контактной информации"""
-        is_admin = message.from_user.id in self.admin_ids
-        recommendations_text = (
-            "1. Начните с минимального времени (3-5 минут)\n"
-            "2. Используйте специальные средства для загара\n"
-            "3. Не загорайте чаще 2-3 раз в неделю\n"
-            "4. Пейте больше воды до и после сеанса\n"
-            "5. Используйте защитные очки\n"
-            "6. Не загорайте натощак\n"
-            "7. После сеанса нанесите увлажняющий крем"
-        )
-        await message.answer(
-                recommendations_text,
-                reply_markup=self.get_user_keyboard(is_admin)
-            )
-        
-    async def help_user_handler(self, message: types.Message):
-        """Показ контактной информации"""
-        is_admin = message.from_user.id in self.admin_ids
-        help_user_text = (
-            "❓ Помощь по использованию бота\n\n"
-            "1. Профиль - информация о вашем аккаунте\n"
-            "2. QR-код - ваш идентификатор в солярии, его нужно показать администратору при посещении\n"
-            "3. Контакты - информация о солярии\n"
-            "4. Советы - рекомендации по загару\n"
-        )
-        await message.answer(
-                help_user_text,
-                reply_markup=self.get_user_keyboard(is_admin)
-            )  
-
-    async def add_minutes_handler(self, message: types.Message):
-
-        await message.answer(
-                "Введите ID Telegram или отправьте QR-код пользователя",
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
-                    resize_keyboard=True
-                    )
-            ) 
-        await DetectQR.waiting_for_id.set()
-    async def add_detect(self, message: types.Message, state: FSMContext):
-        if message.text == "🔙 Вернуться в главное меню":
-            await state.finish()  # Сбрасываем состояние, если было
-            await message.answer("Панель администратора:",
-                            reply_markup=self.get_admin_keyboard()
-                            )
-        else:
-            
-            if message.text:
-                try:
-                    async with state.proxy() as data:
-                        data['photo'] = message.text
-                    if not self.user_exists(data["photo"]):
-                        raise
-                    await message.answer(
-                        "Введите Количество минут, которое хотите добавить",
-                        reply_markup=ReplyKeyboardMarkup(
-                            keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
-                            resize_keyboard=True
-                            )
-                    )
-                    await DetectQR.next()
-                except Exception as e:
-                    await message.answer("Неверный ID")
-            elif message.photo:
-                
-                # Получаем фото
-                photo = message.photo[-1]
-                file = await message.bot.get_file(photo.file_id)
-                downloaded_file = await message.bot.download_file(file.file_path)
-                
-                # Конвертируем в numpy array
-                img_array = np.frombuffer(downloaded_file.read(), dtype=np.uint8)
-                image = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-                try:
-                    # Читаем изображение
-                    if image is None:
-                        await message.answer("❌ Не удалось прочитать изображение. Попробуйте отправить фото еще раз.")
-                        return
-                    roi = self.find_white_square(image)
-                    # Декодируем QR-код
-                    telegram_id = self.decode_qr_from_roi(roi)
-                    
-                    if not telegram_id:
-                        await message.answer("❌ QR-код не найден или нечитаем. Попробуйте отправить фото еще раз.")
-                        return
-                    
-    
-                    # Находим пользователя по Telegram ID
-                    async with state.proxy() as data:
-                        data['photo'] = telegram_id
-                    if not self.user_exists(data["photo"]):
-                        raise
-                    await message.answer(
-                        "Введите Количество минут, которое хотите добавить",
-                        reply_markup=ReplyKeyboardMarkup(
-                            keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
-                            resize_keyboard=True
-                            )
-                    )
-                    await DetectQR.next()
-                except Exception as e:
-                    print(f"Error: {e}")
-                    await message.answer("❌ Произошла ошибка при обработке QR-кода. Попробуйте еще раз.")
-
-    async def num_minutes(self, message: types.Message, state: FSMContext):
-        try:
-            if message.text == "🔙 Вернуться в главное меню":
-                await state.finish()  # Сбрасываем состояние, если было
-                await message.answer("Панель администратора:",
-                                reply_markup=self.get_admin_keyboard()
-                                )
-            else:
-                async with state.proxy() as data:
-                    photo = data['photo']
-                if self.user_exists(photo):
-                    self.cursor.execute('''
-                    SELECT number_minutes FROM users WHERE user_id = ? 
-                    ''', (photo,))
-                    result = self.cursor.fetchone()
-                    self.cursor.execute('''
-                    UPDATE users SET number_minutes = ? WHERE user_id = ? 
-                    ''', (result[0]+int(message.text), int(photo)))
-                    self.conn.commit()
-                    await message.answer(
-                        "Минуты добавлены",
-                        reply_markup=self.get_admin_keyboard()
-                    )
-                    await state.finish()
-                else:
-                    raise
-        except Exception as e:
-            print(f"Error: {e}")
-            await message.answer("Введите число", reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
-                    resize_keyboard=True
-                    )
-                )
-    async def minus_minutes_handler(self, message: types.Message):
-
-        await message.answer(
-                "Введите ID Telegram или отправьте QR-код пользователя",
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
-                    resize_keyboard=True
-                    )
-            ) 
-        await MinDetectQR.waiting_for_id.set()
-    async def minus_detect(self, message: types.Message, state: FSMContext):
-        if message.text == "🔙 Вернуться в главное меню":
-            await state.finish()  # Сбрасываем состояние, если было
-            await message.answer("Панель администратора:",
-                            reply_markup=self.get_admin_keyboard()
-                            )
-        else:
-            if message.text:
-                try:
-                    async with state.proxy() as data:
-                        data['photo'] = message.text
-                    if not self.user_exists(data["photo"]):
-                        raise
-                    await message.answer(
-                        "Введите Количество минут, которое хотите списать",
-                        reply_markup=ReplyKeyboardMarkup(
-                            keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
-                            resize_keyboard=True
-                            )
-                    )
-                    await MinDetectQR.next()
-                except Exception as e:
-                    await message.answer("Неверный ID")
-            elif message.photo:
-                
-                # Получаем фото
-                photo = message.photo[-1]
-                file = await message.bot.get_file(photo.file_id)
-                downloaded_file = await message.bot.download_file(file.file_path)
-                
-                # Конвертируем в numpy array
-                img_array = np.frombuffer(downloaded_file.read(), dtype=np.uint8)
-                image = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-                try:
-                    # Читаем изображение
-                    if image is None:
-                        await message.answer("❌ Не удалось прочитать изображение. Попробуйте отправить фото еще раз.")
-                        return
-                    roi = self.find_white_square(image)
-                    # Декодируем QR-код
-                    telegram_id = self.decode_qr_from_roi(roi)
-                    
-                    if not telegram_id:
-                        await message.answer("❌ QR-код не найден или нечитаем. Попробуйте отправить фото еще раз.")
-                        return
-                    
-    
-                    # Находим пользователя по Telegram ID
-                    async with state.proxy() as data:
-                        data['photo'] = telegram_id
-                    if not self.user_exists(data["photo"]):
-                        raise
-                    await message.answer(
-                        "Введите Количество минут, которое хотите списать",
-                        reply_markup=ReplyKeyboardMarkup(
-                            keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
-                            resize_keyboard=True
-                            )
-                    )
-                    await MinDetectQR.next()
-                except Exception as e:
-                    print(f"Error: {e}")
-                    await message.answer("❌ Произошла ошибка при обработке QR-кода. Попробуйте еще раз.")
-
-    async def minus_num_minutes(self, message: types.Message, state: FSMContext):
-        try:
-            if message.text == "🔙 Вернуться в главное меню":
-                await state.finish()  # Сбрасываем состояние, если было
-                await message.answer("Панель администратора",
-                                reply_markup=self.get_admin_keyboard()
-                                )
-            else:
-                async with state.proxy() as data:
-                    photo = data['photo']
-                if self.user_exists(photo):
-                    self.cursor.execute('''
-                    SELECT number_minutes, total_minutes FROM users WHERE user_id = ? 
-                    ''', (photo,))
-                    result = self.cursor.fetchone()
-                    if result[0]>=int(message.text):
-                        self.cursor.execute('''
-                        UPDATE users SET number_minutes = ?, total_minutes = ? WHERE user_id = ? 
-                        ''', (result[0]-int(message.text),result[1]+int(message.text), int(photo)))
-                        self.conn.commit()
-                        await message.answer(
-                            "Минуты списаны",
-                            reply_markup=self.get_admin_keyboard()
-                        )
-                        await state.finish()
-                    else: 
-                        await message.answer("Недостаточно минут")
-                        return
-                else:
-                    raise
-        except Exception as e:
-            await message.answer("Введите число", reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
-                    resize_keyboard=True
-                    )
-                )
-    async def spam_handler(self, message: types.Message):
-        
-        await message.answer(
-                "Введите сообщение для рассылки",
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
-                    resize_keyboard=True
-                    )
-            ) 
-        await allSpam.waiting_for_spam.set()
-
-    async def spam(self, message: types.Message, state: FSMContext):
-        if message.text == "🔙 Вернуться в главное меню":
-            await state.finish()  # Сбрасываем состояние, если было
-            await message.answer("Рассылка отменена",
-                            reply_markup=self.get_admin_keyboard()
-                            )
-        else:
-            self.cursor.execute("SELECT user_id FROM users")
-            result = self.cursor.fetchone()
-            for id in result:
-                await self.bot.send_message(
-                            chat_id=id,
-                            text=message.text
-                        )
-            await message.answer("Рассылка отправлена",
-                                reply_markup=self.get_admin_keyboard()
-                                )
-            await state.finish() 
-async def main():
-    # Инициализация бота
-    token = os.getenv('TELEGRAM_BOT_TOKEN')
-    if not token:
-        raise ValueError("Не указан TELEGRAM_BOT_TOKEN в .env файле")
-    
-    solarium_bot = SolariumBot(token)
-    
-    try:
-        # Запуск бота
-        await solarium_bot.dp.start_polling()
-    finally:
-        # Закрытие соединения с базой данных при завершении работы
-        await solarium_bot.close_db()
-
-if __name__ == '__main__':
-    asyncio.run(main())
+from aiogram import types
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InputFile, ContentType
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultArticle, InputTextMessageContent
+from aiogram.utils.exceptions import TelegramAPIError
+import asyncio
+from access import AccessControl, Blocklist, parse_rate
+from broadcast import Broadcaster
+from database import Database
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from fsm_storage import SQLiteStorage
+from io import BytesIO
+from lanes import LaneDispatcher
+from metrics import Gauge, InstrumentedBot, register_gauge, start_metrics_server
+import os
+from qr_cache import QRCache
+from qr_scanner import QRScanner
+from qr_service import QRDecodeService, QRServiceBusy
+from router import TextRouter
+from scheduler import Scheduler
+import tempfile
+import time
+from user_search import UserSearch
+from webhook import start_webhook
+
+# Загрузка переменных окружения
+load_dotenv()
+
+SOLARIUM_ADDRESS = os.getenv('SOLARIUM_ADDRESS')
+SOLARIUM_PHONE = os.getenv('SOLARIUM_PHONE')
+SOLARIUM_SOCIAL = os.getenv('SOLARIUM_SOCIAL')
+
+class RegistrationStates(StatesGroup):
+    waiting_for_fullname = State()
+    waiting_for_birthdate = State()
+    waiting_for_phone = State()
+
+class DetectQR(StatesGroup):
+    waiting_for_id = State()
+    waiting_for_minutes = State()
+
+class MinDetectQR(StatesGroup):
+    waiting_for_id = State()
+    waiting_for_minutes = State()
+
+class allSpam(StatesGroup):
+    waiting_for_spam = State()
+    waiting_for_compl = State()
+
+class UserInfo(StatesGroup):
+    waiting_for_query = State()
+
+class StatsExport(StatesGroup):
+    waiting_for_range = State()
+
+class BatchQR(StatesGroup):
+    waiting_for_photo = State()
+    waiting_for_minutes = State()
+    waiting_for_confirm = State()
+
+class BlockUser(StatesGroup):
+    waiting_for_id = State()
+
+class UnblockUser(StatesGroup):
+    waiting_for_id = State()
+
+class SolariumBot:
+    def __init__(self, token: str):
+        # Инициализация базы данных
+        self.db = Database()
+        # Состояния диалогов хранятся в базе и переживают перезапуск
+        self.storage = SQLiteStorage(self.db)
+        # TELEGRAM_API_URL позволяет направить бота на локальный Bot API сервер
+        api_url = os.getenv('TELEGRAM_API_URL')
+        if api_url:
+            self.bot = InstrumentedBot(token=token, server=TelegramAPIServer.from_base(api_url))
+        else:
+            self.bot = InstrumentedBot(token=token)
+        # Обновления разных пользователей обрабатываются параллельно, одного — по порядку
+        self.dp = LaneDispatcher(self.bot, storage=self.storage)
+        self.admin_ids = list(map(int, os.getenv('ADMIN_IDS', '').split(','))) if os.getenv('ADMIN_IDS') else []
+        register_gauge(Gauge('solarium_fsm_states', 'Незавершенные диалоги по состояниям FSM', ['state'],
+                             collect=self._fsm_state_counts))
+        
+        # Распознавание QR-кодов выполняется в отдельных процессах
+        self.qr_service = QRDecodeService()
+        self.qr_scanner = QRScanner(self.bot, self.qr_service)
+        self.broadcaster = Broadcaster(self.bot, self.db)
+        # Поздравления и напоминания идут через тот же ограничитель скорости, что и рассылки
+        self.scheduler = Scheduler(self.db, self.broadcaster)
+        # Кэш готовых QR-кодов пользователей
+        self.qr_cache = QRCache(self.db)
+        # Поиск клиентов по телефону, ФИО и username для администраторов
+        self.user_search = UserSearch(self.db)
+        # Заблокированные администратором пользователи, проверяются до обработчиков
+        self.blocklist = Blocklist(self.db)
+        
+        # Таблица маршрутов: один обработчик aiogram и поиск по словарю вместо цепочки фильтров
+        self.router = TextRouter()
+        # throttle: не больше N запросов за M секунд на пользователя, лишние отбрасываются до обработчика
+        self.router.text("/start", self.start_handler, throttle=parse_rate(os.getenv('THROTTLE_START', '5/60')))
+        self.router.text("🔙 Вернуться в главное меню", self.main_menu_handler)
+        self.router.text("📝 Регистрация", self.registration_handler)
+        self.router.text("👤 Пользователь", self.user_menu_handler)
+        self.router.text("⚙️ Панель администратора", self.admin_menu_handler)
+        
+        # Обработчики панели пользователя
+        self.router.text("👤 Профиль", self.profile_handler)
+        self.router.text("📱 QR-код", self.qr_handler, throttle=parse_rate(os.getenv('THROTTLE_QR', '3/60')))
+        self.router.text("📞 Контакты", self.contact_handler)
+        self.router.text("💡 Советы", self.recommendations_handler)
+        self.router.text("❓ Помощь", self.help_user_handler)
+
+        # Обработчики панели администратора
+        self.router.text("➕ Добавить минуты", self.add_minutes_handler)
+        self.router.text("➖ Списать минуты", self.minus_minutes_handler)
+        self.router.text("👥 Групповое начисление", self.batch_add_handler)
+        self.router.text("👥 Групповое списание", self.batch_minus_handler)
+        self.router.text("📊 Статистика", self.stats_handler)
+        self.router.text("📢 Рассылка", self.spam_handler)
+        self.router.text("🔒 Блокировка пользователя", self.block_handler)
+        self.router.text("🔓 Разблокировка пользователя", self.unblock_handler)
+        self.router.text("👤 Информация о пользователе", self.user_info_handler)
+        # Обработчики добавления минут
+        self.router.state(DetectQR.waiting_for_id, self.add_detect, content_types=[ContentType.TEXT, ContentType.PHOTO])
+        self.router.state(DetectQR.waiting_for_minutes, self.num_minutes)
+        # Обработчики списания минут
+        self.router.state(MinDetectQR.waiting_for_id, self.minus_detect, content_types=[ContentType.TEXT, ContentType.PHOTO])
+        self.router.state(MinDetectQR.waiting_for_minutes, self.minus_num_minutes)
+        # Обработчики начисления и списания группе клиентов по одному фото
+        self.router.state(BatchQR.waiting_for_photo, self.batch_collect, content_types=[ContentType.TEXT, ContentType.PHOTO])
+        self.router.state(BatchQR.waiting_for_minutes, self.batch_minutes)
+        self.router.state(BatchQR.waiting_for_confirm, self.batch_confirm)
+        # Обработчик рассылки минут
+        self.router.state(allSpam.waiting_for_spam, self.spam)
+        # Обработчик выгрузки операций в CSV
+        self.router.state(StatsExport.waiting_for_range, self.stats_export)
+        # Обработчик поиска клиента
+        self.router.state(UserInfo.waiting_for_query, self.user_info_search)
+        # Обработчики блокировки и разблокировки
+        self.router.state(BlockUser.waiting_for_id, self.block_user)
+        self.router.state(UnblockUser.waiting_for_id, self.unblock_user)
+        
+        # Обработчики регистрации
+        self.router.state(RegistrationStates.waiting_for_fullname, self.process_fullname)
+        self.router.state(RegistrationStates.waiting_for_birthdate, self.process_birthdate)
+        self.router.state(RegistrationStates.waiting_for_phone, self.process_phone)
+        self.router.register(self.dp)
+        # Блокировка и ограничение частоты срабатывают до постановки обновления в полосу
+        self.dp.access = AccessControl(self.bot, self.router, self.blocklist, self.admin_ids)
+        # Подсказки клиентов в inline-режиме
+        self.dp.register_inline_handler(self.inline_user_search, state="*")
+    
+    async def prewarm(self):
+        """Фоновая загрузка библиотек изображений, чтобы первый QR-код не ждал импорта"""
+        # Сначала бот начинает принимать обновления, прогрев идет следом
+        await asyncio.sleep(float(os.getenv('IMAGING_PREWARM_DELAY', '5')))
+        started = time.perf_counter()
+        try:
+            await self.qr_cache.prewarm()
+            workers = await self.qr_service.prewarm()
+            print(f"Библиотеки изображений загружены за {time.perf_counter() - started:.1f} с, "
+                  f"воркеров распознавания: {workers}")
+        except Exception as e:
+            print(f"Error: {e}")
+
+    async def _fsm_state_counts(self):
+        return {(state,): count for state, count in (await self.storage.state_counts()).items()}
+
+    async def close_db(self):
+        """Закрытие соединения с базой данных"""
+        await self.dp.drain()
+        await self.scheduler.stop()
+        await self.storage.close()
+        self.db.close()
+        self.qr_service.close()
+
+    def get_main_keyboard(self, is_admin: bool = False):
+        """Создание главной клавиатуры"""
+        if is_admin:
+            keyboard = [
+                [KeyboardButton(text="👤 Пользователь")],
+                [KeyboardButton(text="⚙️ Панель администратора")]
+            ]
+        else:
+            keyboard = [
+            [KeyboardButton(text="👤 Профиль")],
+            [KeyboardButton(text="📱 QR-код")],
+            [KeyboardButton(text="📞 Контакты")],
+            [KeyboardButton(text="💡 Советы")],
+            [KeyboardButton(text="❓ Помощь")],
+        ]
+        return ReplyKeyboardMarkup(
+            keyboard=keyboard,
+            resize_keyboard=True
+        )
+
+    def get_user_keyboard(self, is_admin: bool = False):
+        """Создание клавиатуры обычного пользователя"""
+        if is_admin:
+            keyboard = [
+                [KeyboardButton(text="👤 Профиль")],
+                [KeyboardButton(text="📱 QR-код")],
+                [KeyboardButton(text="📞 Контакты")],
+                [KeyboardButton(text="💡 Советы")],
+                [KeyboardButton(text="❓ Помощь")],
+                [KeyboardButton(text="🔙 Вернуться в главное меню")]
+            ]
+            return ReplyKeyboardMarkup(
+                keyboard=keyboard,
+                resize_keyboard=True
+            )
+        else:
+            keyboard = [
+                [KeyboardButton(text="👤 Профиль")],
+                [KeyboardButton(text="📱 QR-код")],
+                [KeyboardButton(text="📞 Контакты")],
+                [KeyboardButton(text="💡 Советы")],
+                [KeyboardButton(text="❓ Помощь")],
+            ]
+            return ReplyKeyboardMarkup(
+                keyboard=keyboard,
+                resize_keyboard=True
+            )
+    
+    
+
+    def get_admin_keyboard(self):
+        """Создание клавиатуры панели администратора"""
+        keyboard = [
+            [KeyboardButton(text="➕ Добавить минуты")],
+            [KeyboardButton(text="➖ Списать минуты")],
+            [KeyboardButton(text="👥 Групповое начисление"), KeyboardButton(text="👥 Групповое списание")],
+            [KeyboardButton(text="📊 Статистика")],
+            [KeyboardButton(text="📢 Рассылка")],
+            [KeyboardButton(text="🔒 Блокировка пользователя")],
+            [KeyboardButton(text="🔓 Разблокировка пользователя")],
+            [KeyboardButton(text="👤 Информация о пользователе")],
+            [KeyboardButton(text="🔙 Вернуться в главное меню")]
+        ]
+        return ReplyKeyboardMarkup(
+            keyboard=keyboard,
+            resize_keyboard=True
+        )
+    
+    async def start_handler(self, message: types.Message):
+        """Обработчик команды /start"""
+        is_admin = message.from_user.id in self.admin_ids
+        
+        if await self.db.user_exists(message.from_user.id):
+            await message.answer(
+                "С возвращением!",
+                reply_markup=self.get_main_keyboard(is_admin)
+            )
+        else:
+            await message.answer(
+                "Добро пожаловать в бот солярия!",
+                reply_markup=ReplyKeyboardMarkup(
+                    keyboard=[[KeyboardButton(text="📝 Регистрация")]],
+                    resize_keyboard=True
+                    )
+            )
+    
+    async def main_menu_handler(self, message: types.Message):
+        """Обработчик возврата в главное меню"""
+        is_admin = message.from_user.id in self.admin_ids
+        await message.answer(
+            "Главное меню:",
+            reply_markup=self.get_main_keyboard(is_admin)
+        )
+    
+    async def registration_handler(self, message: types.Message):
+        """Обработчик начала регистрации"""
+        if await self.db.user_exists(message.from_user.id):
+            await message.answer("Вы уже зарегистрированы!")
+            return
+        
+        await message.answer(
+            "Давайте начнем регистрацию. Введите ваше ФИО:",
+            reply_markup=types.ReplyKeyboardRemove()
+        )
+        await RegistrationStates.waiting_for_fullname.set()
+    
+    async def process_fullname(self, message: types.Message, state: FSMContext):
+        """Обработчик ввода ФИО"""
+        if len(message.text.split()) >= 2:
+            async with state.proxy() as data:
+                data['fullname'] = message.text
+            
+            await message.answer("Отлично! Теперь введите вашу дату рождения в формате ДД.ММ.ГГГГ:")
+            await RegistrationStates.next()
+        else:
+            await message.answer("Неверный формат. Пожалуйста, ФИО:")
+            return
+    
+    async def process_birthdate(self, message: types.Message, state: FSMContext):
+        """Обработчик ввода даты рождения"""
+        try:
+            birthdate = datetime.strptime(message.text, '%d.%m.%Y').date()
+            async with state.proxy() as data:
+                data['birthdate'] = birthdate.strftime('%d-%m-%Y')
+            
+            await message.answer("Отлично! Теперь отправьте ваш номер телефона:")
+            await RegistrationStates.next()
+        except ValueError:
+            await message.answer("Неверный формат даты. Пожалуйста, введите дату в формате ДД.ММ.ГГГГ:")
+    
+    async def process_phone(self, message: types.Message, state: FSMContext):
+        """Обработчик ввода телефона и завершение регистрации"""
+        phone = message.text
+        cleaned = ''.join(c for c in phone if c.isdigit() or c == '+')
+        if len(cleaned) == 12 and cleaned.startswith('+7'):
+            async with state.proxy() as data:
+                fullname = data['fullname']
+                birthdate = data['birthdate']
+            
+            # Сохраняем пользователя в базу данных
+            await self.db.add_user(
+                user_id=message.from_user.id,
+                username=message.from_user.username,
+                fullname=fullname,
+                birthdate=birthdate,
+                phone=phone
+            )
+            self.user_search.add(message.from_user.id, phone)
+            
+            await message.answer(
+                "Регистрация завершена успешно!",
+                reply_markup=self.get_main_keyboard(message.from_user.id in self.admin_ids)
+            )
+            await state.finish()
+        else:
+            await message.answer("Неверный формат телефона. Пожалуйста, введите номер телефона:")
+            return
+            
+    
+    async def user_menu_handler(self, message: types.Message):
+        is_admin = message.from_user.id in self.admin_ids
+        """Обработчик меню пользователя"""
+        if not await self.db.user_exists(message.from_user.id):
+            await message.answer("Пожалуйста, сначала зарегистрируйтесь!")
+            return
+        
+        await message.answer(
+            "Меню пользователя:",
+            reply_markup=self.get_user_keyboard(is_admin)
+        )
+    
+    async def admin_menu_handler(self, message: types.Message):
+        """Обработчик админского меню"""
+        if message.from_user.id in self.admin_ids:
+            await message.answer(
+                "Панель администратора:",
+                reply_markup=self.get_admin_keyboard()
+            )
+        else:
+            await message.answer("У вас нет прав администратора!")
+
+    async def profile_handler(self, message: types.Message):
+        """Обработчик профиля пользователя"""
+        is_admin = message.from_user.id in self.admin_ids
+        result = await self.db.get_profile(message.from_user.id)
+        profile_text = (
+            f"👤 Профиль\n\n"
+            f"ФИО: {result[0]}\n"
+            f"Телефон: {result[2]}\n"
+            f"Дата рождения: {result[1]}\n"
+            f"Осталось минут: {result[3]} минут\n"
+            f"Всего использовано минут: {result[4]} минут"
+        )
+        await message.answer(
+                profile_text,
+                reply_markup=self.get_user_keyboard(is_admin)
+            )
+        
+    async def qr_handler(self, message: types.Message):
+        is_admin = message.from_user.id in self.admin_ids
+        user_id = message.from_user.id
+        caption = "Ваш QR-код для идентификации в солярии"
+
+        # Повторная отправка по file_id: без отрисовки и загрузки файла
+        file_id = await self.qr_cache.get_file_id(user_id)
+        if file_id:
+            try:
+                await message.reply_photo(
+                    photo=file_id,
+                    caption=caption,
+                    reply_markup=self.get_user_keyboard(is_admin)
+                )
+                return
+            except TelegramAPIError:
+                await self.qr_cache.invalidate(user_id)
+
+        png = await self.qr_cache.get_png(user_id)
+        photo = InputFile(BytesIO(png), filename='qr.png')
+
+        # Отправляем QR-код
+        sent = await message.reply_photo(
+            photo=photo,
+            caption=caption,
+            reply_markup=self.get_user_keyboard(is_admin)
+        )
+        await self.qr_cache.save_file_id(user_id, sent.photo[-1].file_id)
+
+    async def contact_handler(self, message: types.Message):
+        """Показ контактной информации"""
+        is_admin = message.from_user.id in self.admin_ids
+        contact_text = (
+            f"📞 Контактная информация\n\n"
+            f"Адрес: {SOLARIUM_ADDRESS}\n"
+            f"Телефон: {SOLARIUM_PHONE}\n"
+            f"Социальные сети: {SOLARIUM_SOCIAL}"
+        )
+        await message.answer(
+                contact_text,
+                reply_markup=self.get_user_keyboard(is_admin)
+            )
+
+    async def recommendations_handler(self, message: types.Message):
+        """Показ контактной информации"""
+        is_admin = message.from_user.id in self.admin_ids
+        recommendations_text = (
+            "1. Начните с минимального времени (3-5 минут)\n"
+            "2. Используйте специальные средства для загара\n"
+            "3. Не загорайте чаще 2-3 раз в неделю\n"
+            "4. Пейте больше воды до и после сеанса\n"
+            "5. Используйте защитные очки\n"
+            "6. Не загорайте натощак\n"
+            "7. После сеанса нанесите увлажняющий крем"
+        )
+        await message.answer(
+                recommendations_text,
+                reply_markup=self.get_user_keyboard(is_admin)
+            )
+        
+    async def help_user_handler(self, message: types.Message):
+        """Показ контактной информации"""
+        is_admin = message.from_user.id in self.admin_ids
+        help_user_text = (
+            "❓ Помощь по использованию бота\n\n"
+            "1. Профиль - информация о вашем аккаунте\n"
+            "2. QR-код - ваш идентификатор в солярии, его нужно показать администратору при посещении\n"
+            "3. Контакты - информация о солярии\n"
+            "4. Советы - рекомендации по загару\n"
+        )
+        await message.answer(
+                help_user_text,
+                reply_markup=self.get_user_keyboard(is_admin)
+            )  
+
+    async def add_minutes_handler(self, message: types.Message):
+
+        await message.answer(
+                "Введите ID Telegram или отправьте QR-код пользователя",
+                reply_markup=ReplyKeyboardMarkup(
+                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                    resize_keyboard=True
+                    )
+            ) 
+        await DetectQR.waiting_for_id.set()
+    async def detect_user(self, message: types.Message, state: FSMContext, action: str, states):
+        """Первый шаг начисления и списания: ID Telegram текстом или фото QR-кода"""
+        if message.text == "🔙 Вернуться в главное меню":
+            await state.finish()  # Сбрасываем состояние, если было
+            await message.answer("Панель администратора:",
+                            reply_markup=self.get_admin_keyboard()
+                            )
+        else:
+            
+            if message.text:
+                try:
+                    async with state.proxy() as data:
+                        data['photo'] = message.text
+                    if not await self.db.user_exists(data["photo"]):
+                        raise
+                    await message.answer(
+                        f"Введите Количество минут, которое хотите {action}",
+                        reply_markup=ReplyKeyboardMarkup(
+                            keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                            resize_keyboard=True
+                            )
+                    )
+                    await states.next()
+                except Exception as e:
+                    await message.answer("Неверный ID")
+            elif message.photo:
+                
+                try:
+                    # Декодируем QR-код в пуле процессов
+                    try:
+                        result = await self.qr_scanner.scan(message.photo)
+                    except QRServiceBusy:
+                        await message.answer("⏳ Сканер QR-кодов занят. Повторите попытку через несколько секунд.")
+                        return
+                    except asyncio.TimeoutError:
+                        await message.answer("⏳ Распознавание QR-кода заняло слишком много времени. Попробуйте еще раз.")
+                        return
+                    except ValueError:
+                        await message.answer("❌ Не удалось прочитать изображение. Попробуйте отправить фото еще раз.")
+                        return
+                    telegram_id = result.data if result else None
+                    
+                    if not telegram_id:
+                        await message.answer("❌ QR-код не найден или нечитаем. Попробуйте отправить фото еще раз.")
+                        return
+                    
+    
+                    # Находим пользователя по Telegram ID
+                    async with state.proxy() as data:
+                        data['photo'] = telegram_id
+                    if not await self.db.user_exists(data["photo"]):
+                        raise
+                    await message.answer(
+                        f"Введите Количество минут, которое хотите {action}",
+                        reply_markup=ReplyKeyboardMarkup(
+                            keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                            resize_keyboard=True
+                            )
+                    )
+                    await states.next()
+                except Exception as e:
+                    print(f"Error: {e}")
+                    await message.answer("❌ Произошла ошибка при обработке QR-кода. Попробуйте еще раз.")
+
+    async def add_detect(self, message: types.Message, state: FSMContext):
+        await self.detect_user(message, state, "добавить", DetectQR)
+
+    async def num_minutes(self, message: types.Message, state: FSMContext):
+        try:
+            if message.text == "🔙 Вернуться в главное меню":
+                await state.finish()  # Сбрасываем состояние, если было
+                await message.answer("Панель администратора:",
+                                reply_markup=self.get_admin_keyboard()
+                                )
+            else:
+                async with state.proxy() as data:
+                    photo = data['photo']
+                minutes = int(message.text)
+                if minutes <= 0:
+                    raise ValueError("Количество минут должно быть положительным")
+                if await self.db.credit_minutes(int(photo), minutes, message.from_user.id):
+                    await message.answer(
+                        "Минуты добавлены",
+                        reply_markup=self.get_admin_keyboard()
+                    )
+                    await state.finish()
+                else:
+                    raise
+        except Exception as e:
+            print(f"Error: {e}")
+            await message.answer("Введите число", reply_markup=ReplyKeyboardMarkup(
+                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                    resize_keyboard=True
+                    )
+                )
+    async def minus_minutes_handler(self, message: types.Message):
+
+        await message.answer(
+                "Введите ID Telegram или отправьте QR-код пользователя",
+                reply_markup=ReplyKeyboardMarkup(
+                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                    resize_keyboard=True
+                    )
+            ) 
+        await MinDetectQR.waiting_for_id.set()
+    async def minus_detect(self, message: types.Message, state: FSMContext):
+        await self.detect_user(message, state, "списать", MinDetectQR)
+
+    async def minus_num_minutes(self, message: types.Message, state: FSMContext):
+        try:
+            if message.text == "🔙 Вернуться в главное меню":
+                await state.finish()  # Сбрасываем состояние, если было
+                await message.answer("Панель администратора",
+                                reply_markup=self.get_admin_keyboard()
+                                )
+            else:
+                async with state.proxy() as data:
+                    photo = data['photo']
+                minutes = int(message.text)
+                if minutes <= 0:
+                    raise ValueError("Количество минут должно быть положительным")
+                # Проверка остатка и списание выполняются одним UPDATE
+                if await self.db.debit_minutes(int(photo), minutes, message.from_user.id):
+                    await message.answer(
+                        "Минуты списаны",
+                        reply_markup=self.get_admin_keyboard()
+                    )
+                    await state.finish()
+                else: 
+                    await message.answer("Недостаточно минут")
+                    return
+        except Exception as e:
+            await message.answer("Введите число", reply_markup=ReplyKeyboardMarkup(
+                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                    resize_keyboard=True
+                    )
+                )
+    async def batch_add_handler(self, message: types.Message, state: FSMContext):
+        await self.start_batch(message, state, 'credit')
+
+    async def batch_minus_handler(self, message: types.Message, state: FSMContext):
+        await self.start_batch(message, state, 'debit')
+
+    async def start_batch(self, message: types.Message, state: FSMContext, operation: str):
+        """Начало групповой операции: администратор присылает фото с QR-кодами нескольких клиентов"""
+        if message.from_user.id not in self.admin_ids:
+            await message.answer("У вас нет прав администратора!")
+            return
+        await BatchQR.waiting_for_photo.set()
+        await state.update_data(operation=operation, clients=[])
+        await message.answer(
+            "Отправьте фото с QR-кодами клиентов. Можно несколько фото, а нечитаемый код — ввести ID текстом.\n"
+            "Когда все клиенты найдены, нажмите «➡️ Далее»",
+            reply_markup=ReplyKeyboardMarkup(
+                keyboard=[[KeyboardButton(text="➡️ Далее")], [KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                resize_keyboard=True
+                )
+        )
+
+    @staticmethod
+    def format_batch(rows, amounts=None, operation='credit'):
+        """Нумерованный список клиентов группы, при наличии amounts — с минутами"""
+        lines = []
+        for i, (user_id, fullname, _, _, minutes) in enumerate(rows):
+            line = f"{i + 1}. {fullname} ({user_id}), остаток {minutes} мин"
+            if amounts:
+                line += f" — {'+' if operation == 'credit' else '−'}{amounts[i]} мин"
+                if operation == 'debit' and minutes < amounts[i]:
+                    line += " ⚠️ недостаточно минут"
+            lines.append(line)
+        return "\n".join(lines)
+
+    async def batch_collect(self, message: types.Message, state: FSMContext):
+        """Сбор клиентов группы: фото с QR-кодами или ID текстом"""
+        if message.text == "🔙 Вернуться в главное меню":
+            await state.finish()
+            await message.answer("Панель администратора:",
+                            reply_markup=self.get_admin_keyboard()
+                            )
+            return
+        data = await state.get_data()
+        if message.text == "➡️ Далее":
+            if not data['clients']:
+                await message.answer("Сначала отправьте фото с QR-кодами или ID клиентов")
+                return
+            await message.answer(
+                "Введите количество минут: одно число для всех или по числу на каждого через пробел в порядке списка",
+                reply_markup=ReplyKeyboardMarkup(
+                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                    resize_keyboard=True
+                    )
+            )
+            await BatchQR.waiting_for_minutes.set()
+            return
+
+        if message.photo:
+            try:
+                results = await self.qr_scanner.scan_all(message.photo)
+            except QRServiceBusy:
+                await message.answer("⏳ Сканер QR-кодов занят. Повторите попытку через несколько секунд.")
+                return
+            except asyncio.TimeoutError:
+                await message.answer("⏳ Распознавание QR-кодов заняло слишком много времени. Попробуйте еще раз.")
+                return
+            except ValueError:
+                await message.answer("❌ Не удалось прочитать изображение. Попробуйте отправить фото еще раз.")
+                return
+            found = [result.data for result in results]
+        else:
+            found = message.text.replace(',', ' ').split()
+        ids = [int(value) for value in found if value.isdigit()]
+        if not ids:
+            await message.answer("❌ QR-коды не найдены. Отправьте другое фото или введите ID клиентов.")
+            return
+
+        clients = list(dict.fromkeys(data['clients'] + ids))
+        rows = await self.db.users_by_ids(clients)
+        known = {row[0] for row in rows}
+        unknown = [user_id for user_id in ids if user_id not in known]
+        clients = [row[0] for row in rows]
+        await state.update_data(clients=clients)
+        text = f"Клиенты группы:\n\n{self.format_batch(rows)}" if rows else "Клиенты пока не найдены"
+        if unknown:
+            text += f"\n\nНе зарегистрированы: {', '.join(map(str, unknown))}"
+        await message.answer(text + "\n\nОтправьте еще фото или нажмите «➡️ Далее»")
+
+    async def batch_minutes(self, message: types.Message, state: FSMContext):
+        """Минуты для группы: одно число на всех или по одному на каждого клиента"""
+        if message.text == "🔙 Вернуться в главное меню":
+            await state.finish()
+            await message.answer("Панель администратора:",
+                            reply_markup=self.get_admin_keyboard()
+                            )
+            return
+        data = await state.get_data()
+        clients = data['clients']
+        values = message.text.replace(',', ' ').split()
+        if not values or not all(value.isdigit() and int(value) > 0 for value in values) \
+                or len(values) not in (1, len(clients)):
+            await message.answer(f"Введите одно число для всех или по числу на каждого клиента ({len(clients)}) через пробел")
+            return
+        amounts = [int(value) for value in values] * (len(clients) if len(values) == 1 else 1)
+        await state.update_data(amounts=amounts)
+        rows = await self.db.users_by_ids(clients)
+        action = "Начислить" if data['operation'] == 'credit' else "Списать"
+        await message.answer(
+            f"{action} минуты:\n\n{self.format_batch(rows, amounts, data['operation'])}\n\n"
+            f"Всего: {sum(amounts)} мин. Подтвердите операцию",
+            reply_markup=ReplyKeyboardMarkup(
+                keyboard=[[KeyboardButton(text="✅ Подтвердить")], [KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                resize_keyboard=True
+                )
+        )
+        await BatchQR.waiting_for_confirm.set()
+
+    async def batch_confirm(self, message: types.Message, state: FSMContext):
+        """Применяет операцию ко всей группе одной транзакцией"""
+        if message.text == "🔙 Вернуться в главное меню":
+            await state.finish()
+            await message.answer("Операция отменена",
+                            reply_markup=self.get_admin_keyboard()
+                            )
+            return
+        if message.text != "✅ Подтвердить":
+            await message.answer("Нажмите «✅ Подтвердить» или вернитесь в главное меню")
+            return
+        data = await state.get_data()
+        amounts = list(zip(data['clients'], data['amounts']))
+        failed = await self.db.apply_minutes_batch(data['operation'], amounts, message.from_user.id)
+        if failed:
+            # Транзакция откатана целиком: ни одному клиенту минуты не изменены
+            await message.answer(
+                f"❌ Операция не выполнена ни для одного клиента: недостаточно минут или клиент не найден: {', '.join(map(str, failed))}\n\n"
+                "Введите количество минут заново",
+                reply_markup=ReplyKeyboardMarkup(
+                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                    resize_keyboard=True
+                    )
+            )
+            await BatchQR.waiting_for_minutes.set()
+            return
+        await state.finish()
+        action = "Начислено" if data['operation'] == 'credit' else "Списано"
+        await message.answer(
+            f"✅ {action} {sum(data['amounts'])} мин, клиентов: {len(amounts)}",
+            reply_markup=self.get_admin_keyboard()
+        )
+
+    async def spam_handler(self, message: types.Message):
+        
+        await message.answer(
+                "Введите сообщение для рассылки",
+                reply_markup=ReplyKeyboardMarkup(
+                    keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                    resize_keyboard=True
+                    )
+            ) 
+        await allSpam.waiting_for_spam.set()
+
+    async def spam(self, message: types.Message, state: FSMContext):
+        if message.text == "🔙 Вернуться в главное меню":
+            await state.finish()  # Сбрасываем состояние, если было
+            await message.answer("Рассылка отменена",
+                            reply_markup=self.get_admin_keyboard()
+                            )
+        else:
+            # Рассылка идет в фоне, прогресс приходит отдельным сообщением
+            await self.broadcaster.start(message.text, message.chat.id)
+            await message.answer("Рассылка запущена",
+                                reply_markup=self.get_admin_keyboard()
+                                )
+            await state.finish() 
+
+    def format_user_card(self, row):
+        """Карточка клиента для администратора"""
+        user_id, username, fullname, birthdate, phone, registration_date, minutes, total, bot_blocked = row
+        text = (
+            f"👤 Информация о пользователе\n\n"
+            f"ID: {user_id}\n"
+            f"Username: {'@' + username if username else '—'}\n"
+            f"ФИО: {fullname}\n"
+            f"Телефон: {phone}\n"
+            f"Дата рождения: {birthdate}\n"
+            f"Дата регистрации: {registration_date}\n"
+            f"Осталось минут: {minutes} минут\n"
+            f"Всего использовано минут: {total} минут"
+        )
+        if bot_blocked:
+            text += "\n\n⚠️ Пользователь заблокировал бота"
+        if user_id in self.blocklist:
+            text += "\n\n🔒 Заблокирован администратором"
+        return text
+
+    async def user_info_handler(self, message: types.Message):
+        """Начало поиска клиента"""
+        if message.from_user.id not in self.admin_ids:
+            await message.answer("У вас нет прав администратора!")
+            return
+        await message.answer(
+            "Введите ID Telegram, часть номера телефона, фамилию или @username клиента",
+            reply_markup=ReplyKeyboardMarkup(
+                keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                resize_keyboard=True
+                )
+        )
+        await message.answer(
+            "Или выберите клиента из подсказок:",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+                InlineKeyboardButton(text="🔎 Поиск с подсказками", switch_inline_query_current_chat="")
+            ]])
+        )
+        await UserInfo.waiting_for_query.set()
+
+    async def user_info_search(self, message: types.Message, state: FSMContext):
+        """Поиск клиента: карточка при одном совпадении, список при нескольких"""
+        if message.text == "🔙 Вернуться в главное меню":
+            await state.finish()
+            await message.answer("Панель администратора:",
+                            reply_markup=self.get_admin_keyboard()
+                            )
+            return
+        rows = await self.user_search.search(message.text)
+        if not rows:
+            await message.answer("Клиенты не найдены. Попробуйте другой запрос.")
+        elif len(rows) == 1:
+            await message.answer(self.format_user_card(await self.db.user_card(rows[0][0])))
+        else:
+            lines = [
+                f"{user_id} — {fullname} — {phone}" + (f" — @{username}" if username else "")
+                for user_id, fullname, username, phone, _ in rows
+            ]
+            await message.answer("Найдено несколько клиентов, введите ID нужного:\n\n" + "\n".join(lines))
+
+    async def inline_user_search(self, query: types.InlineQuery):
+        """Подсказки клиентов по мере ввода; выбранная подсказка отправляет ID клиента"""
+        if query.from_user.id not in self.admin_ids:
+            await query.answer([], cache_time=3600, is_personal=True)
+            return
+        rows = await self.user_search.search(query.query) if query.query.strip() else []
+        results = [
+            InlineQueryResultArticle(
+                id=str(user_id),
+                title=fullname or str(user_id),
+                description=f"{phone} · {minutes} мин" + (f" · @{username}" if username else ""),
+                input_message_content=InputTextMessageContent(message_text=str(user_id)),
+            )
+            for user_id, fullname, username, phone, minutes in rows
+        ]
+        await query.answer(results, cache_time=0, is_personal=True)
+
+
+    async def block_handler(self, message: types.Message):
+        """Начало блокировки пользователя"""
+        if message.from_user.id not in self.admin_ids:
+            await message.answer("У вас нет прав администратора!")
+            return
+        await message.answer(
+            "Введите ID Telegram пользователя, которого нужно заблокировать",
+            reply_markup=ReplyKeyboardMarkup(
+                keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                resize_keyboard=True
+                )
+        )
+        await BlockUser.waiting_for_id.set()
+
+    async def unblock_handler(self, message: types.Message):
+        """Начало разблокировки пользователя"""
+        if message.from_user.id not in self.admin_ids:
+            await message.answer("У вас нет прав администратора!")
+            return
+        await message.answer(
+            f"Заблокировано пользователей: {len(self.blocklist)}\n\n"
+            "Введите ID Telegram пользователя, которого нужно разблокировать",
+            reply_markup=ReplyKeyboardMarkup(
+                keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                resize_keyboard=True
+                )
+        )
+        await UnblockUser.waiting_for_id.set()
+
+    async def block_user(self, message: types.Message, state: FSMContext):
+        if message.text == "🔙 Вернуться в главное меню":
+            await state.finish()
+            await message.answer("Панель администратора:",
+                            reply_markup=self.get_admin_keyboard()
+                            )
+            return
+        if not message.text.strip().isdigit():
+            await message.answer("Неверный ID")
+            return
+        user_id = int(message.text.strip())
+        if user_id in self.admin_ids:
+            await message.answer("Администратора нельзя заблокировать")
+            return
+        await self.blocklist.block(user_id, message.from_user.id)
+        await state.finish()
+        await message.answer(f"🔒 Пользователь {user_id} заблокирован",
+                            reply_markup=self.get_admin_keyboard()
+                            )
+
+    async def unblock_user(self, message: types.Message, state: FSMContext):
+        if message.text == "🔙 Вернуться в главное меню":
+            await state.finish()
+            await message.answer("Панель администратора:",
+                            reply_markup=self.get_admin_keyboard()
+                            )
+            return
+        if not message.text.strip().isdigit():
+            await message.answer("Неверный ID")
+            return
+        user_id = int(message.text.strip())
+        if not await self.blocklist.unblock(user_id):
+            await message.answer("Этот пользователь не заблокирован")
+            return
+        await state.finish()
+        await message.answer(f"🔓 Пользователь {user_id} разблокирован",
+                            reply_markup=self.get_admin_keyboard()
+                            )
+
+    async def stats_handler(self, message: types.Message):
+        """Панель статистики: читает только сводные таблицы, без обхода users"""
+        if message.from_user.id not in self.admin_ids:
+            await message.answer("У вас нет прав администратора!")
+            return
+        days = int(os.getenv('STATS_DAYS', '7'))
+        today = datetime.now().date()
+        since = today - timedelta(days=days - 1)
+        totals, daily, admins = await self.db.stats_panel(since.isoformat())
+
+        today_row = next((row for row in daily if row[0] == today.isoformat()), (None, 0, 0, 0, 0, 0))
+        lines = [
+            "📊 Статистика\n",
+            f"Клиентов: {totals.get('clients', 0)}",
+            f"Остаток минут у клиентов: {totals.get('balance_minutes', 0)}",
+            f"Всего использовано минут: {totals.get('used_minutes', 0)}\n",
+            "Сегодня:",
+            f"Регистраций: {today_row[1]}",
+            f"Начислено: {today_row[2]} мин",
+            f"Списано: {today_row[3]} мин",
+            f"Клиентов с операциями: {today_row[5]}\n",
+            f"За {days} дн.:",
+            f"Регистраций: {sum(row[1] for row in daily)}",
+            f"Начислено: {sum(row[2] for row in daily)} мин",
+            f"Списано: {sum(row[3] for row in daily)} мин",
+            f"Операций: {sum(row[4] for row in daily)}",
+        ]
+        if daily:
+            lines.append("\nПо дням:")
+            for day, registrations, credited, debited, operations, active in daily:
+                lines.append(f"{day[8:]}.{day[5:7]}: {registrations} рег., +{credited} / −{debited} мин, {active} клиентов")
+        if admins:
+            lines.append(f"\nАдминистраторы за {days} дн.:")
+            for admin_id, credited, debited, operations in admins:
+                lines.append(f"{admin_id}: +{credited} / −{debited} мин, {operations} операций")
+        lines.append("\nДля выгрузки операций в CSV введите период в формате ДД.ММ.ГГГГ-ДД.ММ.ГГГГ")
+        await message.answer(
+            "\n".join(lines),
+            reply_markup=ReplyKeyboardMarkup(
+                keyboard=[[KeyboardButton(text="🔙 Вернуться в главное меню")]],
+                resize_keyboard=True
+                )
+        )
+        await StatsExport.waiting_for_range.set()
+
+    async def stats_export(self, message: types.Message, state: FSMContext):
+        """Выгрузка операций с минутами за период; файл пишется на диск, а не в память"""
+        if message.text == "🔙 Вернуться в главное меню":
+            await state.finish()
+            await message.answer("Панель администратора:",
+                            reply_markup=self.get_admin_keyboard()
+                            )
+            return
+        try:
+            parts = [part.strip() for part in message.text.split('-')]
+            if len(parts) > 2:
+                raise ValueError("Неверный период")
+            start = datetime.strptime(parts[0], '%d.%m.%Y')
+            end = datetime.strptime(parts[-1], '%d.%m.%Y')
+            if end < start:
+                raise ValueError("Конец периода раньше начала")
+        except ValueError:
+            await message.answer("Неверный формат. Введите период в формате ДД.ММ.ГГГГ-ДД.ММ.ГГГГ")
+            return
+
+        with tempfile.TemporaryFile() as file:
+            count = await self.db.export_ledger(int(start.timestamp()), int((end + timedelta(days=1)).timestamp()), file)
+            if not count:
+                await message.answer("За этот период операций нет")
+                return
+            file.seek(0)
+            await message.answer_document(
+                InputFile(file, filename=f"operations_{start:%Y-%m-%d}_{end:%Y-%m-%d}.csv"),
+                caption=f"Операций: {count}"
+            )
+
+
+async def main():
+    # Инициализация бота
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        raise ValueError("Не указан TELEGRAM_BOT_TOKEN в .env файле")
+    
+    solarium_bot = SolariumBot(token)
+    # Перенос дат старых записей в новые столбцы небольшими пачками, не задерживая запуск
+    backfill = asyncio.create_task(solarium_bot.db.backfill_user_dates())
+    # OpenCV, zbar и Pillow загружаются при первом QR-коде или заранее в фоне
+    prewarm = asyncio.create_task(solarium_bot.prewarm()) if os.getenv('IMAGING_PREWARM', '1') != '0' else None
+    
+    try:
+        # Продолжение рассылок, прерванных перезапуском
+        await solarium_bot.broadcaster.resume()
+        # Сброс file_id QR-кодов устаревшего формата
+        await solarium_bot.qr_cache.purge_stale()
+        # Ежедневные поздравления и напоминания о минутах
+        solarium_bot.scheduler.start()
+        # Индекс телефонов для поиска клиентов
+        await solarium_bot.user_search.load()
+        # Список блокировки до приема первых обновлений
+        await solarium_bot.blocklist.load()
+        # Метрики Prometheus на METRICS_PORT, если он задан
+        await start_metrics_server()
+        # Запуск бота: long polling по умолчанию или webhook при BOT_MODE=webhook
+        if os.getenv('BOT_MODE', 'polling') == 'webhook':
+            server = await start_webhook(solarium_bot.dp)
+            try:
+                await asyncio.Event().wait()
+            finally:
+                await server.stop()
+        else:
+            await solarium_bot.dp.start_polling()
+    finally:
+        # Закрытие соединения с базой данных при завершении работы
+        backfill.cancel()
+        if prewarm is not None:
+            prewarm.cancel()
+        await solarium_bot.close_db()
+
+if __name__ == '__main__':
+    asyncio.run(main())
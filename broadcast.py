@@ -0,0 +1,174 @@
+import asyncio
+import os
+import time
+
+import aiohttp
+from aiogram.utils.exceptions import (BotBlocked, ChatNotFound, NetworkError, RetryAfter, TelegramAPIError,
+                                      UserDeactivated)
+
+# Сбои сети и таймауты: отправку стоит повторить, а не останавливать рассылку
+TRANSIENT_ERRORS = (NetworkError, asyncio.TimeoutError, aiohttp.ClientError)
+
+
+class RateLimiter:
+    """Общий token bucket на все отправки плюс минимальный интервал для каждого чата"""
+
+    def __init__(self, rate: float, per_chat_interval: float = 1.0):
+        self.rate = rate
+        self.capacity = rate
+        self.tokens = rate
+        self.per_chat_interval = per_chat_interval
+        self.updated = time.monotonic()
+        self.last_sent = {}
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, chat_id: int):
+        """Ждет, пока отправка в чат станет допустимой"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+            self.tokens -= 1
+
+        wait = self.last_sent.get(chat_id, 0) + self.per_chat_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self.last_sent[chat_id] = time.monotonic()
+        if len(self.last_sent) > 10000:
+            # Старые отметки больше не ограничивают отправку
+            horizon = time.monotonic() - self.per_chat_interval
+            self.last_sent = {k: v for k, v in self.last_sent.items() if v > horizon}
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов после RetryAfter от Telegram"""
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+        self.updated = time.monotonic()
+
+
+class Broadcaster:
+    """Рассылка сообщений всем пользователям с ограничением скорости и продолжением после перезапуска"""
+
+    def __init__(self, bot, db):
+        self.bot = bot
+        self.db = db
+        self.limiter = RateLimiter(float(os.getenv('BROADCAST_RATE', '30')))
+        self.concurrency = int(os.getenv('BROADCAST_CONCURRENCY', '20'))
+        self.page_size = int(os.getenv('BROADCAST_PAGE_SIZE', '100'))
+        self.report_interval = float(os.getenv('BROADCAST_REPORT_INTERVAL', '5'))
+        self.retries = int(os.getenv('BROADCAST_RETRIES', '3'))
+        self.tasks = {}
+
+    async def start(self, text: str, admin_chat_id: int) -> int:
+        """Создает задание рассылки и запускает его в фоне"""
+        job_id = await self.db.create_broadcast(text, admin_chat_id)
+        self._spawn(job_id, text, admin_chat_id, 0, 0, 0, 0)
+        return job_id
+
+    async def resume(self):
+        """Продолжает рассылки, прерванные перезапуском бота"""
+        for job in await self.db.running_broadcasts():
+            self._spawn(*job)
+
+    def _spawn(self, *job):
+        self.tasks[job[0]] = asyncio.create_task(self._run(*job))
+
+    async def send(self, chat_id: int, text: str) -> str:
+        """Отправка одному получателю через общий ограничитель; возвращает sent, blocked или failed"""
+        attempt = 0
+        while True:
+            await self.limiter.acquire(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return 'sent'
+            except RetryAfter as e:
+                self.limiter.pause(e.timeout)
+                await asyncio.sleep(e.timeout)
+            except (BotBlocked, UserDeactivated, ChatNotFound):
+                await self.db.mark_bot_blocked(chat_id)
+                return 'blocked'
+            except TRANSIENT_ERRORS as e:
+                attempt += 1
+                if attempt > self.retries:
+                    print(f"Error: {e!r}")
+                    return 'failed'
+                await asyncio.sleep(2 ** (attempt - 1))
+            except TelegramAPIError as e:
+                print(f"Error: {e}")
+                return 'failed'
+
+    async def _run(self, job_id, text, admin_chat_id, last_user_id, sent, failed, blocked):
+        started = time.monotonic()
+        sent_at_start = sent
+        last_report = 0
+        report = None
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(chat_id):
+            async with semaphore:
+                return await self.send(chat_id, text)
+
+        try:
+            while True:
+                page = await self.db.recipients_page(last_user_id, self.page_size)
+                if not page:
+                    break
+                for result in await asyncio.gather(*(send(chat_id) for chat_id in page)):
+                    if result == 'sent':
+                        sent += 1
+                    elif result == 'blocked':
+                        blocked += 1
+                    else:
+                        failed += 1
+                # Контрольная точка после каждой страницы: при перезапуске
+                # повторно отправляется не больше одной страницы
+                last_user_id = page[-1]
+                await self.db.save_broadcast_progress(job_id, last_user_id, sent, failed, blocked)
+
+                if time.monotonic() - last_report >= self.report_interval:
+                    last_report = time.monotonic()
+                    report = await self._report(admin_chat_id, report, sent, failed, blocked,
+                                                (sent - sent_at_start) / (last_report - started))
+
+            await self.db.finish_broadcast(job_id)
+            await self.bot.send_message(
+                admin_chat_id,
+                f"✅ Рассылка завершена\n\n"
+                f"Отправлено: {sent}\n"
+                f"Заблокировали бота: {blocked}\n"
+                f"Ошибок: {failed}"
+            )
+        except Exception as e:
+            print(f"Error: {e}")
+            # Задание остается незавершенным и продолжится с контрольной точки после перезапуска
+            try:
+                await self.bot.send_message(
+                    admin_chat_id,
+                    f"⚠️ Рассылка прервана из-за ошибки: {e}\n\n"
+                    f"Отправлено: {sent}\n"
+                    f"Она продолжится с места остановки после перезапуска бота."
+                )
+            except Exception as e:
+                print(f"Error: {e}")
+        finally:
+            self.tasks.pop(job_id, None)
+
+    async def _report(self, admin_chat_id, report, sent, failed, blocked, speed):
+        """Создает или обновляет сообщение администратору с прогрессом рассылки"""
+        text = (
+            f"📢 Рассылка идет\n\n"
+            f"Отправлено: {sent}\n"
+            f"Заблокировали бота: {blocked}\n"
+            f"Ошибок: {failed}\n"
+            f"Скорость: {speed:.1f} сообщ./с"
+        )
+        try:
+            if report is None:
+                return await self.bot.send_message(admin_chat_id, text)
+            await report.edit_text(text)
+        except TelegramAPIError as e:
+            print(f"Error: {e}")
+        return report
@@ -1,53 +1,213 @@
-import sqlite3
-import os
-
-def clear_database():
-    """Очистка базы данных (удаление всех записей из таблицы users)"""
-    try:
-        conn = sqlite3.connect('solarium_bot.db')
-        cursor = conn.cursor()
-        
-        # Проверяем существование таблицы users
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        if not cursor.fetchone():
-            print("Таблица users не существует в базе данных.")
-            return
-        
-        # Удаляем все записи из таблицы users
-        cursor.execute('DELETE FROM users')
-        conn.commit()
-        print("Все данные из таблицы users успешно удалены.")
-        
-    except sqlite3.Error as e:
-        print(f"Ошибка при очистке базы данных: {e}")
-    finally:
-        if conn:
-            conn.close()
-
-def delete_database_file():
-    """Полное удаление файла базы данных"""
-    try:
-        if os.path.exists('solarium_bot.db'):
-            os.remove('solarium_bot.db')
-            print("Файл базы данных solarium_bot.db успешно удален.")
-        else:
-            print("Файл базы данных solarium_bot.db не существует.")
-    except Exception as e:
-        print(f"Ошибка при удалении файла базы данных: {e}")
-
-if __name__ == '__main__':
-    print("Выберите действие:")
-    print("1 - Очистить таблицу users (удалить все записи)")
-    print("2 - Полностью удалить файл базы данных")
-    print("3 - Отмена")
-    
-    choice = input("Ваш выбор (1/2/3): ").strip()
-    
-    if choice == '1':
-        clear_database()
-    elif choice == '2':
-        delete_database_file()
-    elif choice == '3':
-        print("Отмена операции.")
-    else:
-        print("Неверный выбор.")
\ No newline at end of file
+"""
+Обслуживание базы бота без остановки: резервная копия, архивация, сжатие, проверка.
+
+Все операции рассчитаны на работу рядом с запущенным ботом: запись идет
+короткими транзакциями небольшими пачками с паузами, поэтому начисления
+и списания на стойке не ждут блокировку дольше одной пачки.
+
+    python clear_db.py backup                 # копия в backups/, проверка копии
+    python clear_db.py archive --months 12    # неактивные клиенты -> users_archive
+    python clear_db.py vacuum                 # вернуть свободные страницы файлу
+    python clear_db.py check
+"""
+import argparse
+from datetime import datetime, timedelta
+import os
+import sqlite3
+import sys
+import time
+
+from migrations import migrate
+
+DB_PATH = 'solarium_bot.db'
+BACKUP_DIR = 'backups'
+
+# Клиенты без операций и регистрации после cutoff; остаток минут не архивируем — он принадлежит клиенту
+SQL_ARCHIVE_CANDIDATES = '''
+SELECT user_id FROM users u
+WHERE user_id > ? AND registration_ts IS NOT NULL AND registration_ts < ? AND coalesce(number_minutes, 0) <= 0
+  AND NOT EXISTS (SELECT 1 FROM minutes_ledger l WHERE l.user_id = u.user_id AND l.created_at >= ?)
+ORDER BY user_id LIMIT ?
+'''
+SQL_ARCHIVE_COPY = '''
+INSERT OR REPLACE INTO users_archive (
+    user_id, username, fullname, birthdate, phone, registration_date, number_minutes, total_minutes,
+    bot_blocked, registration_ts, birth_iso, birth_md, archived_at
+)
+SELECT user_id, username, fullname, birthdate, phone, registration_date, number_minutes, total_minutes,
+       bot_blocked, registration_ts, birth_iso, birth_md, ?
+FROM users WHERE user_id IN ({})
+'''
+
+
+def connect(path: str) -> sqlite3.Connection:
+    # isolation_level=None: транзакции открываем явно и держим их как можно короче
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+
+def integrity_check(conn, quick: bool = False) -> bool:
+    """Печатает результат проверки; True, если база цела"""
+    rows = [row[0] for row in conn.execute('PRAGMA quick_check' if quick else 'PRAGMA integrity_check')]
+    if rows == ['ok']:
+        print("Проверка целостности: ok")
+        return True
+    print("Проверка целостности: найдены ошибки")
+    for row in rows[:20]:
+        print(f"  {row}")
+    return False
+
+
+def backup(args) -> int:
+    """Горячая копия через online backup API и проверка копии"""
+    os.makedirs(args.dir, exist_ok=True)
+    destination = args.output or os.path.join(
+        args.dir, f"solarium_bot-{datetime.now():%Y%m%d-%H%M%S}.db")
+    source = connect(args.db)
+    target = sqlite3.connect(destination)
+    started = time.monotonic()
+    try:
+        wal = source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        if wal:
+            # В WAL чтение не блокирует писателей, а копия одним шагом видит один снимок;
+            # по частям копия начиналась бы заново после каждой записи бота
+            source.backup(target)
+        else:
+            source.backup(target, pages=args.pages, sleep=args.pause,
+                          progress=lambda status, remaining, total: print(f"\rСкопировано {total - remaining}/{total} страниц", end=''))
+            print()
+        target.execute('PRAGMA journal_mode=DELETE')
+        print(f"Резервная копия: {destination} ({os.path.getsize(destination) / 2 ** 20:.1f} МБ, "
+              f"{time.monotonic() - started:.1f} с)")
+        ok = integrity_check(target, quick=True)
+    finally:
+        target.close()
+        source.close()
+
+    if args.keep and not args.output:
+        # Старые копии сверх --keep удаляются, начиная с самых ранних
+        copies = sorted(name for name in os.listdir(args.dir) if name.startswith('solarium_bot-') and name.endswith('.db'))
+        for name in copies[:-args.keep]:
+            os.remove(os.path.join(args.dir, name))
+            print(f"Удалена старая копия: {name}")
+    return 0 if ok else 1
+
+
+def archive(args) -> int:
+    """Переносит неактивных клиентов в users_archive пачками"""
+    conn = connect(args.db)
+    try:
+        migrate(conn)
+        cutoff = int((datetime.now() - timedelta(days=30 * args.months)).timestamp())
+        after = 0
+        moved = 0
+        while True:
+            ids = [row[0] for row in conn.execute(SQL_ARCHIVE_CANDIDATES, (after, cutoff, cutoff, args.batch))]
+            if not ids:
+                break
+            after = ids[-1]
+            if args.dry_run:
+                moved += len(ids)
+                continue
+            placeholders = ','.join('?' * len(ids))
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(SQL_ARCHIVE_COPY.format(placeholders), [int(time.time()), *ids])
+                # Триггеры users обновят статистику и поисковый индекс
+                conn.execute(f'DELETE FROM users WHERE user_id IN ({placeholders})', ids)
+                conn.execute(f'DELETE FROM qr_file_ids WHERE user_id IN ({placeholders})', ids)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            moved += len(ids)
+            print(f"\rПеренесено в архив: {moved}", end='')
+            time.sleep(args.pause)
+        if args.dry_run:
+            print(f"Будет перенесено в архив: {moved}")
+        else:
+            print(f"\rПеренесено в архив: {moved}")
+        return 0
+    finally:
+        conn.close()
+
+
+def vacuum(args) -> int:
+    """Возвращает свободные страницы файлу по частям"""
+    conn = connect(args.db)
+    try:
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if mode != 2:
+            if not args.enable:
+                print("В базе не включен auto_vacuum=INCREMENTAL. Включите один раз через "
+                      "--enable в нерабочее время: будет выполнен полный VACUUM, бот на это время встанет.")
+                return 1
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('VACUUM')
+            print("auto_vacuum=INCREMENTAL включен, база сжата")
+            return 0
+
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        freed = 0
+        while True:
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                break
+            step = min(free, args.pages)
+            # incremental_vacuum возвращает строки по одной на страницу; читаем их, чтобы шаг выполнился
+            conn.execute(f'PRAGMA incremental_vacuum({step})').fetchall()
+            freed += step
+            time.sleep(args.pause)
+        # PASSIVE не ждет читателей и не мешает боту
+        conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        print(f"Освобождено {freed} страниц ({freed * page_size / 2 ** 20:.1f} МБ)")
+        return 0
+    finally:
+        conn.close()
+
+
+def check(args) -> int:
+    conn = connect(args.db)
+    try:
+        return 0 if integrity_check(conn, args.quick) else 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Обслуживание базы бота солярия')
+    parser.add_argument('--db', default=DB_PATH, help='файл базы данных')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_backup = commands.add_parser('backup', help='горячая резервная копия')
+    parser_backup.add_argument('--dir', default=BACKUP_DIR, help='каталог копий')
+    parser_backup.add_argument('--output', help='точный путь копии вместо каталога')
+    parser_backup.add_argument('--keep', type=int, default=7, help='сколько последних копий хранить')
+    parser_backup.add_argument('--pages', type=int, default=256, help='страниц за шаг (не для WAL)')
+    parser_backup.add_argument('--pause', type=float, default=0.05, help='пауза между шагами, с')
+    parser_backup.set_defaults(func=backup)
+
+    parser_archive = commands.add_parser('archive', help='перенос неактивных клиентов в архив')
+    parser_archive.add_argument('--months', type=int, required=True, help='нет операций дольше, месяцев')
+    parser_archive.add_argument('--batch', type=int, default=200, help='клиентов за транзакцию')
+    parser_archive.add_argument('--pause', type=float, default=0.1, help='пауза между пачками, с')
+    parser_archive.add_argument('--dry-run', action='store_true', help='только посчитать')
+    parser_archive.set_defaults(func=archive)
+
+    parser_vacuum = commands.add_parser('vacuum', help='инкрементальное сжатие файла')
+    parser_vacuum.add_argument('--pages', type=int, default=500, help='страниц за шаг')
+    parser_vacuum.add_argument('--pause', type=float, default=0.05, help='пауза между шагами, с')
+    parser_vacuum.add_argument('--enable', action='store_true', help='один раз включить auto_vacuum полным VACUUM')
+    parser_vacuum.set_defaults(func=vacuum)
+
+    parser_check = commands.add_parser('check', help='проверка целостности')
+    parser_check.add_argument('--quick', action='store_true', help='быстрая проверка без индексов')
+    parser_check.set_defaults(func=check)
+
+    args = parser.parse_args()
+    try:
+        sys.exit(args.func(args))
+    except sqlite3.Error as e:
+        print(f"Ошибка базы данных: {e}")
+        sys.exit(1)
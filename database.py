@@ -0,0 +1,554 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from datetime import datetime
+import io
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import SQL_LATENCY
+from migrations import migrate, parse_birthdate, parse_registration_date
+from user_cache import MISSING, UserCache
+
+DB_PATH = 'solarium_bot.db'
+
+# Запросы держим константами: sqlite3 кэширует скомпилированные выражения
+# для каждого соединения, и повторный вызов с тем же текстом не парсит SQL заново
+SQL_ADD_USER = '''
+INSERT INTO users (user_id, username, fullname, birthdate, phone, registration_date, number_minutes, total_minutes,
+                   registration_ts, birth_iso, birth_md)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_PROFILE = 'SELECT fullname, birthdate, phone, number_minutes, total_minutes FROM users WHERE user_id = ?'
+SQL_CREDIT = 'UPDATE users SET number_minutes = number_minutes + ? WHERE user_id = ?'
+SQL_DEBIT = '''
+UPDATE users SET number_minutes = number_minutes - ?, total_minutes = total_minutes + ?
+WHERE user_id = ? AND number_minutes >= ?
+'''
+SQL_LEDGER_INSERT = '''
+INSERT INTO minutes_ledger (user_id, operation, amount, admin_id, created_at)
+VALUES (?, ?, ?, ?, ?)
+'''
+SQL_RECIPIENTS_PAGE = '''
+SELECT user_id FROM users WHERE user_id > ? AND bot_blocked = 0
+ORDER BY user_id LIMIT ?
+'''
+SQL_MARK_BOT_BLOCKED = 'UPDATE users SET bot_blocked = 1 WHERE user_id = ?'
+SQL_BROADCAST_CREATE = '''
+INSERT INTO broadcasts (text, admin_chat_id, status, created_at) VALUES (?, ?, 'running', ?)
+'''
+SQL_BROADCASTS_RUNNING = '''
+SELECT id, text, admin_chat_id, last_user_id, sent, failed, blocked FROM broadcasts WHERE status = 'running'
+'''
+SQL_BROADCAST_PROGRESS = '''
+UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ? WHERE id = ?
+'''
+SQL_QR_FILE_ID = 'SELECT file_id FROM qr_file_ids WHERE user_id = ? AND version = ?'
+SQL_QR_FILE_ID_SAVE = 'INSERT OR REPLACE INTO qr_file_ids (user_id, version, file_id) VALUES (?, ?, ?)'
+SQL_QR_FILE_ID_DELETE = 'DELETE FROM qr_file_ids WHERE user_id = ?'
+SQL_QR_FILE_ID_PURGE = 'DELETE FROM qr_file_ids WHERE version != ?'
+SQL_FSM_LOAD = 'SELECT state, data, bucket FROM fsm_states WHERE chat_id = ? AND user_id = ? AND updated_at >= ?'
+SQL_FSM_SAVE = '''
+INSERT OR REPLACE INTO fsm_states (chat_id, user_id, state, data, bucket, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+'''
+SQL_FSM_DELETE = 'DELETE FROM fsm_states WHERE chat_id = ? AND user_id = ?'
+SQL_FSM_EXPIRE = 'DELETE FROM fsm_states WHERE updated_at < ?'
+SQL_FSM_COUNTS = 'SELECT state, COUNT(*) FROM fsm_states WHERE updated_at >= ? GROUP BY state'
+SQL_BROADCAST_FINISH = "UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ?"
+SQL_SEARCH_USERS = '''
+SELECT u.user_id, u.fullname, u.username, u.phone, u.number_minutes
+FROM users_fts JOIN users u ON u.user_id = users_fts.rowid
+WHERE users_fts MATCH ? ORDER BY rank LIMIT ?
+'''
+SQL_USERS_BY_IDS = 'SELECT user_id, fullname, username, phone, number_minutes FROM users WHERE user_id IN ({})'
+SQL_USER_CARD = '''
+SELECT user_id, username, fullname, birthdate, phone, registration_date, number_minutes, total_minutes, bot_blocked
+FROM users WHERE user_id = ?
+'''
+SQL_USER_PHONES = 'SELECT user_id, phone FROM users WHERE phone IS NOT NULL'
+SQL_STATS_TOTALS = 'SELECT key, value FROM stats_totals'
+SQL_STATS_DAILY = '''
+SELECT day, registrations, credited, debited, operations, active_clients FROM stats_daily
+WHERE day >= ? ORDER BY day DESC
+'''
+SQL_STATS_ADMINS = '''
+SELECT admin_id, SUM(credited), SUM(debited), SUM(operations) FROM stats_admin_daily
+WHERE day >= ? GROUP BY admin_id ORDER BY SUM(operations) DESC
+'''
+SQL_EXPORT_LEDGER = '''
+SELECT datetime(l.created_at, 'unixepoch', 'localtime'), iif(l.operation = 'credit', 'Начисление', 'Списание'), l.amount, l.user_id, u.fullname, u.phone, l.admin_id
+FROM minutes_ledger l LEFT JOIN users u ON u.user_id = l.user_id
+WHERE l.created_at >= ? AND l.created_at < ? ORDER BY l.created_at
+'''
+SQL_BIRTHDAYS = 'SELECT user_id, fullname FROM users WHERE birth_md IN (?, ?) AND bot_blocked = 0'
+# Клиенты, чей остаток опустился ниже порога из-за списаний после since
+# Остаток на момент since восстанавливается по всем операциям после него: без начислений
+# клиент, которому добавили и тут же списали минуты, выглядел бы пересекшим порог
+SQL_LOW_BALANCE = '''
+SELECT u.user_id, u.number_minutes FROM minutes_ledger l JOIN users u ON u.user_id = l.user_id
+WHERE l.created_at >= ? AND u.number_minutes < ? AND u.bot_blocked = 0
+GROUP BY u.user_id
+HAVING SUM(l.operation = 'debit') > 0
+   AND u.number_minutes + SUM(CASE l.operation WHEN 'debit' THEN l.amount ELSE -l.amount END) >= ?
+'''
+SQL_JOB_RUN = 'SELECT status, started_at FROM job_runs WHERE job = ? AND run_key = ?'
+SQL_JOB_RUN_LAST = "SELECT MAX(started_at) FROM job_runs WHERE job = ? AND status = 'done'"
+SQL_JOB_RUN_START = "INSERT OR IGNORE INTO job_runs (job, run_key, status, started_at) VALUES (?, ?, 'running', ?)"
+SQL_JOB_RUN_FINISH = "UPDATE job_runs SET status = 'done', finished_at = ?, sent = ? WHERE job = ? AND run_key = ?"
+SQL_NOTIFICATION_CLAIM = 'INSERT OR IGNORE INTO notifications_sent (job, run_key, user_id, sent_at) VALUES (?, ?, ?, ?)'
+SQL_BLOCKED_IDS = 'SELECT user_id FROM blocked_users'
+SQL_BLOCK_USER = 'INSERT OR REPLACE INTO blocked_users (user_id, admin_id, reason, blocked_at) VALUES (?, ?, ?, ?)'
+SQL_UNBLOCK_USER = 'DELETE FROM blocked_users WHERE user_id = ?'
+SQL_BACKFILL_PAGE = '''
+SELECT user_id, birthdate, registration_date FROM users
+WHERE user_id > ? AND registration_ts IS NULL ORDER BY user_id LIMIT ?
+'''
+SQL_BACKFILL_UPDATE = 'UPDATE users SET registration_ts = ?, birth_iso = ?, birth_md = ? WHERE user_id = ?'
+
+
+class Database:
+    """Асинхронный доступ к SQLite: пул читающих соединений и один писатель"""
+
+    def __init__(self, path: str = DB_PATH, readers: int = None):
+        self.path = path
+        self.readers = readers or int(os.getenv('DB_READERS', '4'))
+        # Окно группового коммита операций с минутами, в секундах
+        self.commit_delay = float(os.getenv('DB_COMMIT_DELAY', '0.005'))
+        self._ledger_batch = []
+        self._ledger_task = None
+        # Профили пользователей в памяти процесса; обращения к базе только при промахе
+        self.user_cache = UserCache(
+            max_items=int(os.getenv('USER_CACHE_SIZE', '10000')),
+            ttl=float(os.getenv('USER_CACHE_TTL', '300')),
+            negative_ttl=float(os.getenv('USER_CACHE_NEGATIVE_TTL', '30')),
+        )
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.read_executor = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix='db-read')
+        # Один поток на запись: SQLite все равно допускает только одного писателя
+        self.write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+        self.init_schema()
+
+    def connect(self) -> sqlite3.Connection:
+        """Открывает соединение с настроенными PRAGMA"""
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        # Действует только для новой базы; существующую переводит clear_db.py vacuum --enable
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA cache_size=-8000')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    def init_schema(self):
+        """Приводит схему к последней версии"""
+        conn = self.connect()
+        try:
+            applied = migrate(conn)
+            if applied:
+                print(f"Применены миграции базы: {', '.join(map(str, applied))}")
+        finally:
+            conn.close()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Соединение текущего потока пула"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    async def _read(self, name, func, *args):
+        loop = asyncio.get_running_loop()
+        with SQL_LATENCY.time(name):
+            return await loop.run_in_executor(self.read_executor, lambda: func(self._conn(), *args))
+
+    async def _write(self, name, func, *args):
+        loop = asyncio.get_running_loop()
+        with SQL_LATENCY.time(name):
+            return await loop.run_in_executor(self.write_executor, lambda: func(self._conn(), *args))
+
+    async def user_exists(self, user_id) -> bool:
+        """Проверяет, существует ли пользователь в базе данных"""
+        return await self.get_profile(user_id) is not None
+
+    async def add_user(self, user_id: int, username: str, fullname: str, birthdate: str, phone: str):
+        """Добавляет пользователя в базу данных"""
+        now = datetime.now()
+        registration_date = now.strftime('%d-%m-%Y %H:%M:%S')
+        birth_iso, birth_md = parse_birthdate(birthdate)
+        def query(conn):
+            with conn:
+                conn.execute(SQL_ADD_USER, (user_id, username, fullname, birthdate, phone, registration_date, 0, 0,
+                                            int(now.timestamp()), birth_iso, birth_md))
+        try:
+            await self._write('add_user', query)
+        finally:
+            self.user_cache.invalidate(user_id)
+
+    async def get_profile(self, user_id):
+        """ФИО, дата рождения, телефон, остаток и использованные минуты"""
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            # Администратор ввел не число: такого пользователя быть не может
+            return None
+
+        profile = self.user_cache.get(user_id)
+        if profile is MISSING:
+            return None
+        if profile is not None:
+            return profile
+
+        generation = self.user_cache.generation(user_id)
+
+        def query(conn):
+            return conn.execute(SQL_PROFILE, (user_id,)).fetchone()
+        profile = await self._read('get_profile', query)
+        self.user_cache.put(user_id, profile, generation)
+        return profile
+
+    async def credit_minutes(self, user_id: int, amount: int, admin_id: int) -> bool:
+        """Начисляет минуты; False, если пользователя нет"""
+        return await self._ledger_op('credit', user_id, amount, admin_id)
+
+    async def debit_minutes(self, user_id: int, amount: int, admin_id: int) -> bool:
+        """Списывает минуты; False, если пользователя нет или минут недостаточно"""
+        return await self._ledger_op('debit', user_id, amount, admin_id)
+
+    async def _ledger_op(self, operation, user_id, amount, admin_id):
+        """Ставит операцию в очередь группового коммита и ждет ее результата"""
+        future = asyncio.get_running_loop().create_future()
+        self._ledger_batch.append((operation, user_id, amount, admin_id, future))
+        if self._ledger_task is None:
+            self._ledger_task = asyncio.create_task(self._flush_ledger())
+        return await future
+
+    async def _flush_ledger(self):
+        """Применяет накопленные операции одной транзакцией"""
+        try:
+            while self._ledger_batch:
+                # Даем соседним нажатиям кнопок попасть в ту же транзакцию
+                await asyncio.sleep(self.commit_delay)
+                batch, self._ledger_batch = self._ledger_batch, []
+                try:
+                    results = await self._write('ledger_batch', self._apply_ledger, [op[:4] for op in batch])
+                except Exception as e:
+                    for *_, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for (operation, user_id, *_, future), result in zip(batch, results):
+                        if result:
+                            self.user_cache.invalidate(user_id)
+                        if not future.done():
+                            future.set_result(result)
+        finally:
+            self._ledger_task = None
+
+    @staticmethod
+    def _apply_ledger(conn, ops):
+        results = []
+        now = int(time.time())
+        with conn:
+            for operation, user_id, amount, admin_id in ops:
+                if operation == 'credit':
+                    cursor = conn.execute(SQL_CREDIT, (amount, user_id))
+                else:
+                    cursor = conn.execute(SQL_DEBIT, (amount, amount, user_id, amount))
+                applied = cursor.rowcount == 1
+                if applied:
+                    conn.execute(SQL_LEDGER_INSERT, (user_id, operation, amount, admin_id, now))
+                results.append(applied)
+        return results
+
+    async def apply_minutes_batch(self, operation: str, amounts, admin_id: int):
+        """Начисляет ('credit') или списывает ('debit') минуты группе клиентов одной транзакцией
+
+        amounts — пары (user_id, минуты). Операция выполняется для всех или ни для кого:
+        возвращает ID клиентов, для которых она невозможна, и при непустом списке ничего не меняет.
+        """
+        amounts = [(int(user_id), amount) for user_id, amount in amounts]
+        def query(conn):
+            failed = []
+            now = int(time.time())
+            with conn:
+                for user_id, amount in amounts:
+                    if operation == 'credit':
+                        cursor = conn.execute(SQL_CREDIT, (amount, user_id))
+                    else:
+                        cursor = conn.execute(SQL_DEBIT, (amount, amount, user_id, amount))
+                    if cursor.rowcount == 1:
+                        conn.execute(SQL_LEDGER_INSERT, (user_id, operation, amount, admin_id, now))
+                    else:
+                        failed.append(user_id)
+                if failed:
+                    conn.rollback()
+            return failed
+        failed = await self._write('apply_minutes_batch', query)
+        if not failed:
+            for user_id, _ in amounts:
+                self.user_cache.invalidate(user_id)
+        return failed
+
+    async def recipients_page(self, after_user_id: int, limit: int):
+        """Следующая страница получателей рассылки по возрастанию user_id"""
+        def query(conn):
+            return [row[0] for row in conn.execute(SQL_RECIPIENTS_PAGE, (after_user_id, limit))]
+        return await self._read('recipients_page', query)
+
+    async def mark_bot_blocked(self, user_id: int):
+        """Отмечает пользователя, заблокировавшего бота"""
+        def query(conn):
+            with conn:
+                conn.execute(SQL_MARK_BOT_BLOCKED, (user_id,))
+        await self._write('mark_bot_blocked', query)
+
+    async def create_broadcast(self, text: str, admin_chat_id: int) -> int:
+        """Создает задание рассылки и возвращает его id"""
+        def query(conn):
+            with conn:
+                return conn.execute(SQL_BROADCAST_CREATE, (text, admin_chat_id, int(time.time()))).lastrowid
+        return await self._write('create_broadcast', query)
+
+    async def running_broadcasts(self):
+        """Незавершенные задания рассылки"""
+        def query(conn):
+            return conn.execute(SQL_BROADCASTS_RUNNING).fetchall()
+        return await self._read('running_broadcasts', query)
+
+    async def save_broadcast_progress(self, job_id: int, last_user_id: int, sent: int, failed: int, blocked: int):
+        """Сохраняет контрольную точку рассылки"""
+        def query(conn):
+            with conn:
+                conn.execute(SQL_BROADCAST_PROGRESS, (last_user_id, sent, failed, blocked, job_id))
+        await self._write('save_broadcast_progress', query)
+
+    async def finish_broadcast(self, job_id: int):
+        """Помечает рассылку завершенной"""
+        def query(conn):
+            with conn:
+                conn.execute(SQL_BROADCAST_FINISH, (int(time.time()), job_id))
+        await self._write('finish_broadcast', query)
+
+    async def get_qr_file_id(self, user_id: int, version: int):
+        """file_id QR-кода пользователя для указанной версии формата"""
+        def query(conn):
+            row = conn.execute(SQL_QR_FILE_ID, (user_id, version)).fetchone()
+            return row[0] if row else None
+        return await self._read('get_qr_file_id', query)
+
+    async def save_qr_file_id(self, user_id: int, version: int, file_id: str):
+        """Сохраняет file_id QR-кода"""
+        def query(conn):
+            with conn:
+                conn.execute(SQL_QR_FILE_ID_SAVE, (user_id, version, file_id))
+        await self._write('save_qr_file_id', query)
+
+    async def delete_qr_file_id(self, user_id: int):
+        """Удаляет file_id QR-кода пользователя"""
+        def query(conn):
+            with conn:
+                conn.execute(SQL_QR_FILE_ID_DELETE, (user_id,))
+        await self._write('delete_qr_file_id', query)
+
+    async def purge_qr_file_ids(self, version: int):
+        """Удаляет file_id всех версий формата, кроме текущей"""
+        def query(conn):
+            with conn:
+                conn.execute(SQL_QR_FILE_ID_PURGE, (version,))
+        await self._write('purge_qr_file_ids', query)
+
+    async def fsm_load(self, chat_id: int, user_id: int, newer_than: int):
+        """Запись FSM (state, data, bucket), обновленная не раньше newer_than"""
+        def query(conn):
+            return conn.execute(SQL_FSM_LOAD, (chat_id, user_id, newer_than)).fetchone()
+        return await self._read('fsm_load', query)
+
+    async def fsm_save_many(self, records):
+        """Сохраняет пачку записей FSM одной транзакцией; state=data=bucket=None удаляет запись"""
+        def query(conn):
+            with conn:
+                for chat_id, user_id, state, data, bucket, updated_at in records:
+                    if state is None and data is None and bucket is None:
+                        conn.execute(SQL_FSM_DELETE, (chat_id, user_id))
+                    else:
+                        conn.execute(SQL_FSM_SAVE, (chat_id, user_id, state, data, bucket, updated_at))
+        await self._write('fsm_save_many', query)
+
+    async def fsm_expire(self, older_than: int) -> int:
+        """Удаляет брошенные диалоги; возвращает число удаленных записей"""
+        def query(conn):
+            with conn:
+                return conn.execute(SQL_FSM_EXPIRE, (older_than,)).rowcount
+        return await self._write('fsm_expire', query)
+
+    async def fsm_state_counts(self, newer_than: int):
+        """Число активных диалогов в каждом состоянии FSM"""
+        def query(conn):
+            return dict(conn.execute(SQL_FSM_COUNTS, (newer_than,)).fetchall())
+        return await self._read('fsm_state_counts', query)
+
+    async def search_users(self, match: str, limit: int):
+        """Клиенты, найденные запросом FTS5 по ФИО и username"""
+        def query(conn):
+            return conn.execute(SQL_SEARCH_USERS, (match, limit)).fetchall()
+        return await self._read('search_users', query)
+
+    async def users_by_ids(self, user_ids):
+        """Краткие карточки клиентов в порядке user_ids; отсутствующие пропускаются"""
+        if not user_ids:
+            return []
+        def query(conn):
+            sql = SQL_USERS_BY_IDS.format(','.join('?' * len(user_ids)))
+            return {row[0]: row for row in conn.execute(sql, user_ids)}
+        rows = await self._read('users_by_ids', query)
+        return [rows[user_id] for user_id in user_ids if user_id in rows]
+
+    async def user_card(self, user_id: int):
+        """Все поля клиента для карточки администратора"""
+        def query(conn):
+            return conn.execute(SQL_USER_CARD, (user_id,)).fetchone()
+        return await self._read('user_card', query)
+
+    async def user_phones(self):
+        """Пары (user_id, phone) для индекса телефонов"""
+        def query(conn):
+            return conn.execute(SQL_USER_PHONES).fetchall()
+        return await self._read('user_phones', query)
+
+    async def stats_panel(self, since_day: str):
+        """Итоги по базе, строки stats_daily и итоги администраторов начиная с since_day ('ГГГГ-ММ-ДД')"""
+        def query(conn):
+            return (
+                dict(conn.execute(SQL_STATS_TOTALS).fetchall()),
+                conn.execute(SQL_STATS_DAILY, (since_day,)).fetchall(),
+                conn.execute(SQL_STATS_ADMINS, (since_day,)).fetchall(),
+            )
+        return await self._read('stats_panel', query)
+
+    async def export_ledger(self, start_ts: int, end_ts: int, file) -> int:
+        """Пишет операции с минутами за период в CSV-файл порциями; возвращает число строк"""
+        def query(conn):
+            # Файл открыт в двоичном режиме; обертку отсоединяем, чтобы не закрыть его
+            text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+            writer = csv.writer(text, delimiter=';')
+            writer.writerow(['Время', 'Операция', 'Минуты', 'ID клиента', 'ФИО', 'Телефон', 'ID администратора'])
+            cursor = conn.execute(SQL_EXPORT_LEDGER, (start_ts, end_ts))
+            count = 0
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                count += len(rows)
+            text.flush()
+            text.detach()
+            return count
+        return await self._read('export_ledger', query)
+
+    async def birthdays(self, month_days):
+        """(user_id, fullname) клиентов с днем рождения в указанные дни 'ММ-ДД'"""
+        first, second = (list(month_days) * 2)[:2]
+        def query(conn):
+            return conn.execute(SQL_BIRTHDAYS, (first, second)).fetchall()
+        return await self._read('birthdays', query)
+
+    async def low_balance_clients(self, since: int, threshold: int):
+        """(user_id, number_minutes) клиентов, опустившихся ниже порога после since"""
+        def query(conn):
+            return conn.execute(SQL_LOW_BALANCE, (since, threshold, threshold)).fetchall()
+        return await self._read('low_balance_clients', query)
+
+    async def job_run(self, job: str, run_key: str):
+        """(status, started_at) запуска задачи или None"""
+        def query(conn):
+            return conn.execute(SQL_JOB_RUN, (job, run_key)).fetchone()
+        return await self._read('job_run', query)
+
+    async def last_job_run(self, job: str):
+        """Время начала последнего завершенного запуска задачи или None"""
+        def query(conn):
+            return conn.execute(SQL_JOB_RUN_LAST, (job,)).fetchone()[0]
+        return await self._read('last_job_run', query)
+
+    async def start_job_run(self, job: str, run_key: str):
+        """Отмечает начало запуска; повторный вызов после перезапуска ничего не меняет"""
+        def query(conn):
+            with conn:
+                conn.execute(SQL_JOB_RUN_START, (job, run_key, int(time.time())))
+        await self._write('start_job_run', query)
+
+    async def finish_job_run(self, job: str, run_key: str, sent: int):
+        def query(conn):
+            with conn:
+                conn.execute(SQL_JOB_RUN_FINISH, (int(time.time()), sent, job, run_key))
+        await self._write('finish_job_run', query)
+
+    async def claim_notification(self, job: str, run_key: str, user_id: int) -> bool:
+        """True, если уведомление этому клиенту в этом запуске еще не отправлялось"""
+        def query(conn):
+            with conn:
+                return conn.execute(SQL_NOTIFICATION_CLAIM, (job, run_key, user_id, int(time.time()))).rowcount == 1
+        return await self._write('claim_notification', query)
+
+    async def blocked_user_ids(self):
+        """ID всех заблокированных администратором пользователей"""
+        def query(conn):
+            return [row[0] for row in conn.execute(SQL_BLOCKED_IDS)]
+        return await self._read('blocked_user_ids', query)
+
+    async def block_user(self, user_id: int, admin_id: int, reason: str = None):
+        """Заносит пользователя в список блокировки"""
+        def query(conn):
+            with conn:
+                conn.execute(SQL_BLOCK_USER, (user_id, admin_id, reason, int(time.time())))
+        await self._write('block_user', query)
+
+    async def unblock_user(self, user_id: int) -> bool:
+        """Убирает пользователя из списка блокировки; False, если его там не было"""
+        def query(conn):
+            with conn:
+                return conn.execute(SQL_UNBLOCK_USER, (user_id,)).rowcount == 1
+        return await self._write('unblock_user', query)
+
+    async def backfill_user_dates(self, batch_size: int = None, pause: float = None) -> int:
+        """Заполняет registration_ts, birth_iso и birth_md у старых записей; возвращает число строк"""
+        batch_size = batch_size or int(os.getenv('DB_BACKFILL_BATCH', '500'))
+        # Пауза между пачками оставляет писателя свободным для запросов бота
+        pause = float(os.getenv('DB_BACKFILL_PAUSE', '0.05')) if pause is None else pause
+        after = 0
+        total = 0
+        while True:
+            def page(conn):
+                return conn.execute(SQL_BACKFILL_PAGE, (after, batch_size)).fetchall()
+            rows = await self._read('backfill_page', page)
+            if not rows:
+                break
+            # Строки с неразборчивой датой остаются NULL; курсор по user_id не даст зациклиться
+            updates = [
+                (parse_registration_date(registration_date), *parse_birthdate(birthdate), user_id)
+                for user_id, birthdate, registration_date in rows
+            ]
+            def update(conn):
+                with conn:
+                    conn.executemany(SQL_BACKFILL_UPDATE, updates)
+            await self._write('backfill_update', update)
+            total += len(rows)
+            after = rows[-1][0]
+            await asyncio.sleep(pause)
+        return total
+
+    def close(self):
+        """Остановка пулов и закрытие всех соединений"""
+        self.read_executor.shutdown(wait=True)
+        self.write_executor.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
@@ -0,0 +1,248 @@
+"""
+Локальная замена Telegram Bot API для проверки бота без сети.
+
+Бот подключается к серверу через TELEGRAM_API_URL. Обновления подаются методом
+push_message и доставляются через getUpdates или на webhook, если он установлен.
+Ответы бота копятся по чатам и читаются через wait_reply.
+
+Проверка webhook-режима от начала до конца:
+    python fake_bot_api.py --check
+"""
+import argparse
+import asyncio
+from collections import Counter, defaultdict
+import itertools
+import os
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+BOT_ID = 1000000
+
+
+class FakeBotAPI:
+    """Сервер, реализующий используемые ботом методы Bot API"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8081):
+        self.host = host
+        self.port = port
+        self.updates = asyncio.Queue()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+        self.files = {}
+        self.replies = defaultdict(asyncio.Queue)
+        self.calls = Counter()
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.session = None
+        self.runner = None
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_method)
+        app.router.add_get('/file/bot{token}/{path:.+}', self.handle_file)
+        self.app = app
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self):
+        self.session = aiohttp.ClientSession()
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self.session is not None:
+            await self.session.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    # Управление со стороны теста
+
+    def add_file(self, data: bytes, width: int = 0, height: int = 0) -> dict:
+        """Регистрирует файл и возвращает описание PhotoSize"""
+        n = next(self.file_ids)
+        file_id = f'file{n}'
+        self.files[file_id] = data
+        return {
+            'file_id': file_id,
+            'file_unique_id': f'unique{n}',
+            'width': width,
+            'height': height,
+            'file_size': len(data),
+        }
+
+    async def push_message(self, user_id: int, text: str = None, photo: list = None, username: str = None):
+        """Отправляет боту сообщение от пользователя"""
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': username or f'user{user_id}'},
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        if photo is not None:
+            message['photo'] = photo
+        await self.push_update({'message': message})
+
+    async def push_update(self, update: dict):
+        update = {'update_id': next(self.update_ids), **update}
+        if self.webhook_url:
+            headers = {}
+            if self.webhook_secret:
+                headers['X-Telegram-Bot-Api-Secret-Token'] = self.webhook_secret
+            async with self.session.post(self.webhook_url, json=update, headers=headers) as response:
+                response.raise_for_status()
+        else:
+            await self.updates.put(update)
+
+    async def wait_reply(self, chat_id: int, timeout: float = 10) -> dict:
+        """Следующее сообщение, отправленное ботом в чат"""
+        return await asyncio.wait_for(self.replies[chat_id].get(), timeout)
+
+    # Обработка запросов бота
+
+    async def handle_file(self, request: web.Request):
+        data = self.files.get(request.match_info['path'])
+        if data is None:
+            return web.Response(status=404)
+        return web.Response(body=data)
+
+    async def handle_method(self, request: web.Request):
+        method = request.match_info['method'].lower()
+        params = dict(await request.post())
+        if request.query:
+            params.update(request.query)
+        self.calls[method] += 1
+        handler = getattr(self, f'api_{method}', None)
+        if handler is None:
+            return web.json_response({'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'})
+        return web.json_response({'ok': True, 'result': await handler(params)})
+
+    def _message(self, params: dict, **content) -> dict:
+        chat_id = int(params['chat_id'])
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Solarium'},
+            **content,
+        }
+        self.replies[chat_id].put_nowait(message)
+        return message
+
+    async def api_getme(self, params):
+        return {'id': BOT_ID, 'is_bot': True, 'first_name': 'Solarium', 'username': 'solarium_test_bot'}
+
+    async def api_setwebhook(self, params):
+        self.webhook_url = params.get('url') or None
+        self.webhook_secret = params.get('secret_token')
+        return True
+
+    async def api_deletewebhook(self, params):
+        self.webhook_url = None
+        return True
+
+    async def api_getwebhookinfo(self, params):
+        return {'url': self.webhook_url or '', 'has_custom_certificate': False, 'pending_update_count': self.updates.qsize()}
+
+    async def api_getupdates(self, params):
+        timeout = float(params.get('timeout') or 0)
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self.updates.get(), timeout or 0.01))
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        return updates
+
+    async def api_sendmessage(self, params):
+        return self._message(params, text=params.get('text', ''))
+
+    async def api_sendphoto(self, params):
+        photo = params.get('photo')
+        if isinstance(photo, web.FileField):
+            size = self.add_file(photo.file.read(), 490, 490)
+        else:
+            size = {'file_id': photo, 'file_unique_id': f'u-{photo}', 'width': 490, 'height': 490}
+        return self._message(params, photo=[size], caption=params.get('caption'))
+
+    async def api_senddocument(self, params):
+        document = params.get('document')
+        data = document.file.read() if isinstance(document, web.FileField) else b''
+        size = self.add_file(data)
+        return self._message(params, document={'file_id': size['file_id'], 'file_unique_id': size['file_unique_id']})
+
+    async def api_editmessagetext(self, params):
+        return self._message(params, text=params.get('text', ''))
+
+    async def api_getfile(self, params):
+        file_id = params['file_id']
+        return {
+            'file_id': file_id,
+            'file_unique_id': f'u-{file_id}',
+            'file_size': len(self.files.get(file_id, b'')),
+            'file_path': file_id,
+        }
+
+    async def api_answerinlinequery(self, params):
+        return True
+
+
+async def check_webhook():
+    """Поднимает фейковый API и бота в режиме webhook, проверяет ответ на /start"""
+    api = FakeBotAPI(port=int(os.getenv('FAKE_API_PORT', '8081')))
+    await api.start()
+    webhook_port = int(os.getenv('WEBHOOK_PORT', '8082'))
+    os.environ.update({
+        'TELEGRAM_API_URL': api.url,
+        'WEBHOOK_URL': f'http://127.0.0.1:{webhook_port}',
+        'WEBHOOK_HOST': '127.0.0.1',
+        'WEBHOOK_PORT': str(webhook_port),
+    })
+
+    from bot import SolariumBot
+    from webhook import start_webhook
+
+    solarium_bot = SolariumBot('123456:fake-token')
+    server = await start_webhook(solarium_bot.dp)
+    try:
+        async with api.session.get(f'http://127.0.0.1:{webhook_port}/health') as response:
+            print('health:', await response.json())
+        started = time.perf_counter()
+        await api.push_message(42, '/start')
+        reply = await api.wait_reply(42)
+        print(f"reply in {(time.perf_counter() - started) * 1000:.1f} ms: {reply['text']!r}")
+    finally:
+        await server.stop()
+        await solarium_bot.close_db()
+        await (await solarium_bot.bot.get_session()).close()
+        await api.stop()
+
+
+async def serve(host: str, port: int):
+    api = FakeBotAPI(host, port)
+    await api.start()
+    print(f'Fake Bot API: {api.url}')
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальный фейковый Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--check', action='store_true', help='проверить webhook-режим бота во временном каталоге')
+    args = parser.parse_args()
+
+    if args.check:
+        os.chdir(tempfile.mkdtemp(prefix='solarium-check-'))
+        asyncio.run(check_webhook())
+    else:
+        asyncio.run(serve(args.host, args.port))
@@ -0,0 +1,178 @@
+import asyncio
+import copy
+import json
+import os
+import time
+import typing
+
+from aiogram.dispatcher.storage import BaseStorage
+
+
+def _dump(value: dict):
+    """Компактная сериализация: пустой словарь хранится как NULL"""
+    if not value:
+        return None
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _load(value) -> dict:
+    return json.loads(value) if value else {}
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в SQLite.
+
+    Изменения копятся в памяти и записываются пачкой раз в FSM_FLUSH_INTERVAL секунд,
+    поэтому другие процессы бота видят новое состояние с такой задержкой.
+    Диалоги без изменений дольше FSM_TTL секунд считаются брошенными и удаляются.
+    """
+
+    def __init__(self, db, flush_interval: float = None, ttl: float = None):
+        self.db = db
+        self.flush_interval = flush_interval or float(os.getenv('FSM_FLUSH_INTERVAL', '0.05'))
+        self.ttl = ttl or float(os.getenv('FSM_TTL', str(24 * 60 * 60)))
+        # Незаписанные изменения: (chat, user) -> {'state', 'data', 'bucket'}
+        self.pending = {}
+        # Изменения, которые прямо сейчас записываются в базу
+        self.flushing = {}
+        # Записи идут по одной: иначе вторая подменила бы self.flushing до фиксации первой
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._last_expire = 0
+
+    def _key(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    async def _record(self, key) -> dict:
+        """Актуальная запись: сначала незаписанные изменения, затем база"""
+        record = self.pending.get(key) or self.flushing.get(key)
+        if record is not None:
+            return record
+        row = await self.db.fsm_load(*key, int(time.time() - self.ttl))
+        if row is None:
+            return {'state': None, 'data': {}, 'bucket': {}}
+        return {'state': row[0], 'data': _load(row[1]), 'bucket': _load(row[2])}
+
+    async def _update(self, key, **fields):
+        record = dict(await self._record(key))
+        record.update(fields)
+        self.pending[key] = record
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self, delay: float = None):
+        # Задача считается активной до конца записи: изменения, пришедшие во время
+        # записи, подхватит повторный запуск ниже, а не параллельный flush
+        try:
+            await asyncio.sleep(self.flush_interval if delay is None else delay)
+            await self.flush()
+            delay = None
+        except asyncio.CancelledError:
+            self._flush_task = None
+            raise
+        except Exception as e:
+            # Изменения вернулись в self.pending; повторяем запись с паузой, чтобы не забить лог
+            print(f"Error: {e}")
+            delay = max(self.flush_interval, 1.0)
+        self._flush_task = None
+        if self.pending:
+            self._flush_task = asyncio.create_task(self._flush_later(delay))
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        async with self._flush_lock:
+            pending, self.pending = self.pending, {}
+            self.flushing = pending
+            if pending:
+                now = int(time.time())
+                records = [
+                    (chat, user, record['state'], _dump(record['data']), _dump(record['bucket']), now)
+                    for (chat, user), record in pending.items()
+                ]
+                try:
+                    await self.db.fsm_save_many(records)
+                except BaseException:
+                    # Не теряем изменения (в том числе при отмене): более новые записи из self.pending важнее
+                    self.pending = {**pending, **self.pending}
+                    raise
+                finally:
+                    self.flushing = {}
+
+            if time.monotonic() - self._last_expire > 60:
+                self._last_expire = time.monotonic()
+                await self.db.fsm_expire(int(time.time() - self.ttl))
+
+    async def state_counts(self) -> dict:
+        """Число незавершенных диалогов по состояниям"""
+        return await self.db.fsm_state_counts(int(time.time() - self.ttl))
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        record = await self._record(self._key(chat, user))
+        return record['state'] or self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._record(self._key(chat, user))
+        return copy.deepcopy(record['data'])
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        await self._update(self._key(chat, user), state=self.resolve_state(state))
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        await self._update(self._key(chat, user), data=copy.deepcopy(data or {}))
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        key = self._key(chat, user)
+        record = await self._record(key)
+        merged = {**record['data'], **(data or {}), **kwargs}
+        await self._update(key, data=merged)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._record(self._key(chat, user))
+        return copy.deepcopy(record['bucket'])
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        await self._update(self._key(chat, user), bucket=copy.deepcopy(bucket or {}))
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        key = self._key(chat, user)
+        record = await self._record(key)
+        merged = {**record['bucket'], **(bucket or {}), **kwargs}
+        await self._update(key, bucket=merged)
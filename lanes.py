@@ -0,0 +1,104 @@
+"""
+Обработка обновлений по полосам: параллельно для разных пользователей, по порядку для одного.
+
+Каждый пользователь закреплен за одной из UPDATE_LANES полос по своему id.
+Полоса — очередь и один обработчик, поэтому сообщения одного чата
+обрабатываются строго друг за другом (количество минут не обгонит ID в
+DetectQR), а медленное распознавание QR у одного администратора задерживает
+только его полосу. При переполнении очереди полосы обновление отбрасывается
+и учитывается в метриках.
+"""
+import asyncio
+import os
+import time
+
+from aiogram import Bot, Dispatcher, types
+
+from metrics import Gauge, UPDATE_QUEUE_WAIT, UPDATES_SHED, register_gauge
+
+
+def update_owner(update: types.Update) -> int:
+    """id пользователя, от которого пришло обновление; порядок нужен только внутри него"""
+    for event in (update.message, update.edited_message, update.callback_query, update.inline_query,
+                  update.chosen_inline_result, update.my_chat_member, update.chat_member):
+        if event is not None and event.from_user is not None:
+            return event.from_user.id
+    for event in (update.channel_post, update.edited_channel_post):
+        if event is not None:
+            return event.chat.id
+    return update.update_id
+
+
+class LaneDispatcher(Dispatcher):
+    """Dispatcher, раскладывающий обновления по полосам вместо обработки всех сразу"""
+
+    def __init__(self, *args, lanes: int = None, lane_queue: int = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lane_count = lanes or int(os.getenv('UPDATE_LANES', '16'))
+        self.lane_queue = lane_queue or int(os.getenv('UPDATE_LANE_QUEUE', '100'))
+        self.lanes = []
+        self.workers = []
+        # Проверка доступа (access.AccessControl) до постановки в очередь; None — пропускать все
+        self.access = None
+        register_gauge(Gauge('solarium_update_queue_depth', 'Обновления в очередях полос', ['lane'],
+                             collect=self._queue_depths))
+
+    @property
+    def pending(self) -> int:
+        return sum(lane.qsize() for lane in self.lanes)
+
+    async def _queue_depths(self):
+        return {(str(i),): lane.qsize() for i, lane in enumerate(self.lanes)}
+
+    def _start_lanes(self):
+        self.lanes = [asyncio.Queue(self.lane_queue) for _ in range(self.lane_count)]
+        self.workers = [asyncio.create_task(self._work(lane)) for lane in self.lanes]
+
+    async def _work(self, lane: asyncio.Queue):
+        # Контекст aiogram нужен обработчикам, вызывающим Bot.get_current()
+        Bot.set_current(self.bot)
+        Dispatcher.set_current(self)
+        while True:
+            update, queued = await lane.get()
+            UPDATE_QUEUE_WAIT.observe(time.perf_counter() - queued)
+            try:
+                await self.updates_handler.notify(update)
+            except Exception as e:
+                print(f"Error: {e}")
+            finally:
+                lane.task_done()
+
+    def submit(self, update: types.Update) -> bool:
+        """Ставит обновление в полосу пользователя; False, если полоса переполнена
+
+        Обновления, отклоненные проверкой доступа, в полосу не попадают и считаются принятыми.
+        """
+        if self.access is not None and not self.access.admit(update):
+            return True
+        if not self.lanes:
+            self._start_lanes()
+        lane = self.lanes[update_owner(update) % self.lane_count]
+        try:
+            lane.put_nowait((update, time.perf_counter()))
+        except asyncio.QueueFull:
+            UPDATES_SHED.inc()
+            return False
+        return True
+
+    async def process_updates(self, updates, fast: bool = True):
+        """Вызывается long polling: только раскладывает обновления, не дожидаясь обработки"""
+        for update in updates:
+            self.submit(update)
+        return []
+
+    async def drain(self, timeout: float = 30):
+        """Дожидается обработки принятых обновлений и останавливает полосы"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(lane.join() for lane in self.lanes)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.lanes = []
+        self.workers = []
@@ -0,0 +1,215 @@
+"""
+Нагрузочный тест бота против локального фейкового Bot API.
+
+Бот запускается отдельным процессом (bot.py) во временном каталоге с чистой базой
+и подключается к fake_bot_api.FakeBotAPI. Симулированные клиенты проходят
+/start -> регистрацию -> профиль -> QR-код, администраторы начисляют минуты по
+фото QR-кода и списывают их по ID. Уровень нагрузки удваивается, пока p99
+не превысит порог или пропускная способность не перестанет расти.
+
+    python load_test.py --start 8 --max 256 --admins 2 --output load.json
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_qr import make_photo, percentile
+from fake_bot_api import FakeBotAPI
+
+ADMIN_BASE_ID = 1
+USER_BASE_ID = 10 ** 6
+
+
+class LoadTest:
+    def __init__(self, api: FakeBotAPI, think_time: float):
+        self.api = api
+        # Пауза человека между ответом бота и следующим сообщением
+        self.think_time = think_time
+        self.latencies = defaultdict(list)
+        # Ошибки по шагам: нет ответа или ответ не тот, которого ждет сценарий
+        self.errors = defaultdict(int)
+        self.registered = []
+
+    async def step(self, name: str, chat_id: int, text: str = None, photo: list = None, expect: str = None):
+        """Отправляет сообщение и ждет один ответ бота; expect — фрагмент текста или подписи ответа"""
+        started = time.perf_counter()
+        await self.api.push_message(chat_id, text=text, photo=photo)
+        try:
+            reply = await self.api.wait_reply(chat_id, timeout=30)
+        except asyncio.TimeoutError:
+            self.errors[name] += 1
+            return None
+        self.latencies[name].append(time.perf_counter() - started)
+        # Быстрый, но неверный ответ (например, «QR-код не распознан») — тоже ошибка
+        if expect is not None and expect not in (reply.get('text') or reply.get('caption') or ''):
+            self.errors[name] += 1
+        await asyncio.sleep(self.think_time)
+        return reply
+
+    async def client(self, user_id: int):
+        """Новый клиент: регистрация, профиль и QR-код"""
+        await self.step('start', user_id, '/start', expect='Добро пожаловать')
+        await self.step('registration', user_id, '📝 Регистрация', expect='Введите ваше ФИО')
+        await self.step('fullname', user_id, 'Иванова Мария Петровна', expect='дату рождения')
+        await self.step('birthdate', user_id, '15.06.1995', expect='номер телефона')
+        await self.step('phone', user_id, f'+7{user_id % 10 ** 10:010d}', expect='Регистрация завершена')
+        self.registered.append(user_id)
+        await self.step('profile', user_id, '👤 Профиль', expect='ФИО: Иванова Мария Петровна')
+        reply = await self.step('qr', user_id, '📱 QR-код', expect='QR-код')
+        if reply is not None and not reply.get('photo'):
+            self.errors['qr'] += 1
+
+    async def admin(self, admin_id: int, checkins: int, rng: random.Random):
+        """Станция администратора: начисление по фото QR-кода и списание по ID"""
+        done = 0
+        while done < checkins:
+            if not self.registered:
+                await asyncio.sleep(0.05)
+                continue
+            done += 1
+            user_id = rng.choice(self.registered)
+            jpeg = make_photo(user_id, 1, 'clean', rng)
+            photo = [self.api.add_file(jpeg, 1154, 866)]
+
+            await self.step('admin_add_menu', admin_id, '➕ Добавить минуты', expect='Введите ID Telegram')
+            await self.step('admin_add_photo', admin_id, photo=photo, expect='хотите добавить')
+            await self.step('admin_add_minutes', admin_id, '10', expect='Минуты добавлены')
+
+            await self.step('admin_minus_menu', admin_id, '➖ Списать минуты', expect='Введите ID Telegram')
+            await self.step('admin_minus_id', admin_id, str(user_id), expect='хотите списать')
+            await self.step('admin_minus_minutes', admin_id, '5', expect='Минуты списаны')
+
+
+def summarize(latencies, errors, elapsed):
+    steps = sum(len(values) for values in latencies.values())
+    everything = [value for values in latencies.values() for value in values]
+
+    def ms(values, q):
+        return round(percentile(values, q) * 1000, 2)
+
+    return {
+        'steps': steps,
+        'errors': sum(errors.values()),
+        'errors_by_step': dict(sorted(errors.items())),
+        'elapsed_s': round(elapsed, 2),
+        'throughput_per_s': round(steps / elapsed, 1),
+        'p50_ms': ms(everything, 50),
+        'p95_ms': ms(everything, 95),
+        'p99_ms': ms(everything, 99),
+        'by_step': {
+            name: {'count': len(values), 'p50_ms': ms(values, 50), 'p99_ms': ms(values, 99)}
+            for name, values in sorted(latencies.items())
+        },
+    }
+
+
+async def run_level(api: FakeBotAPI, users: int, admins: int, checkins: int, id_offset: int, seed: int,
+                    think_time: float):
+    test = LoadTest(api, think_time)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(test.client(USER_BASE_ID + id_offset + i) for i in range(users)),
+        *(test.admin(ADMIN_BASE_ID + i, checkins, rng) for i in range(admins)),
+    )
+    return summarize(test.latencies, test.errors, time.perf_counter() - started)
+
+
+def start_bot(api: FakeBotAPI, mode: str, admins: int, webhook_port: int):
+    """Запускает bot.py отдельным процессом с чистой базой"""
+    workdir = tempfile.mkdtemp(prefix='solarium-load-')
+    env = {
+        **os.environ,
+        'TELEGRAM_BOT_TOKEN': '123456:load-test',
+        'TELEGRAM_API_URL': api.url,
+        'ADMIN_IDS': ','.join(str(ADMIN_BASE_ID + i) for i in range(admins)),
+        'BOT_MODE': mode,
+        'WEBHOOK_URL': f'http://127.0.0.1:{webhook_port}',
+        'WEBHOOK_HOST': '127.0.0.1',
+        'WEBHOOK_PORT': str(webhook_port),
+    }
+    bot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+    log = open(os.path.join(workdir, 'bot.log'), 'wb')
+    return subprocess.Popen([sys.executable, bot_path], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(api: FakeBotAPI, mode: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (mode == 'webhook' and api.webhook_url) or (mode == 'polling' and api.calls['getupdates']):
+            return
+        await asyncio.sleep(0.1)
+    raise RuntimeError('Бот не запустился')
+
+
+async def main(args):
+    api = FakeBotAPI(port=args.api_port)
+    await api.start()
+    process = start_bot(api, args.mode, args.admins, args.webhook_port)
+    levels = []
+    try:
+        await wait_ready(api, args.mode)
+        # Прогрев: запуск процессов распознавания и кэшей не должен попадать в замеры
+        await run_level(api, 1, args.admins, 1, 0, args.seed, args.think_ms / 1000)
+        users = args.start
+        offset = 1
+        while users <= args.max:
+            report = await run_level(api, users, args.admins, args.checkins, offset, args.seed,
+                                   args.think_ms / 1000)
+            report['users'] = users
+            levels.append(report)
+            print(f"users={users} throughput={report['throughput_per_s']}/s "
+                  f"p99={report['p99_ms']}ms errors={report['errors']}", file=sys.stderr)
+            offset += users
+            previous = levels[-2] if len(levels) > 1 else None
+            if report['p99_ms'] > args.p99_limit or report['errors']:
+                break
+            if previous and report['throughput_per_s'] < previous['throughput_per_s'] * 1.05:
+                break
+            users *= 2
+    finally:
+        # SIGINT, чтобы бот штатно закрыл базу и пул процессов распознавания
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=30)
+        await api.stop()
+
+    # Насыщение — последний уровень, где p99 и ошибки еще в норме
+    healthy = [level for level in levels if level['p99_ms'] <= args.p99_limit and not level['errors']]
+    result = {
+        'mode': args.mode,
+        'admins': args.admins,
+        'p99_limit_ms': args.p99_limit,
+        'saturation_users': healthy[-1]['users'] if healthy else None,
+        'peak_throughput_per_s': max((level['throughput_per_s'] for level in levels), default=None),
+        'levels': levels,
+    }
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота солярия')
+    parser.add_argument('--mode', choices=['webhook', 'polling'], default='webhook')
+    parser.add_argument('--start', type=int, default=8, help='клиентов на первом уровне')
+    parser.add_argument('--max', type=int, default=512, help='максимум клиентов на уровне')
+    parser.add_argument('--admins', type=int, default=2, help='станций администратора')
+    parser.add_argument('--checkins', type=int, default=5, help='начислений и списаний на станцию за уровень')
+    parser.add_argument('--think-ms', type=float, default=100, help='пауза клиента между шагами в мс')
+    parser.add_argument('--p99-limit', type=float, default=500, help='порог p99 в мс')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--webhook-port', type=int, default=8082)
+    parser.add_argument('--output')
+    asyncio.run(main(parser.parse_args()))
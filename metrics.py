@@ -0,0 +1,157 @@
+"""
+Метрики в формате Prometheus и HTTP-эндпоинт /metrics.
+
+Запись в гистограмму — поиск корзины и пара сложений, текст формата
+собирается только при запросе /metrics. Эндпоинт включается переменной
+METRICS_PORT и по умолчанию слушает только localhost.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import os
+import time
+
+from aiogram import Bot
+from aiohttp import web
+
+# Границы корзин в секундах: от быстрых SQL-запросов до распознавания 12 Мп фото
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in self.values.items():
+            yield f'{self.name}{_labels(self.label_names, labels)} {value}'
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [счетчики корзин..., +Inf], сумма
+        self.series = {}
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = _labels(self.label_names + ('le',), labels + (bound,))
+                yield f'{self.name}_bucket{le} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}'
+
+
+class Gauge:
+    """Значение вычисляется асинхронной функцией в момент запроса /metrics"""
+
+    def __init__(self, name: str, help_text: str, labels=(), collect=None):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.collect = collect
+
+    async def render_async(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        if self.collect is not None:
+            for labels, value in (await self.collect()).items():
+                lines.append(f'{self.name}{_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+HANDLER_LATENCY = Histogram('solarium_handler_seconds', 'Время обработчика сообщения', ['route'])
+HANDLER_ERRORS = Counter('solarium_handler_errors_total', 'Необработанные исключения в обработчиках', ['route'])
+SQL_LATENCY = Histogram('solarium_sql_seconds', 'Время SQL-операции, включая ожидание в пуле', ['query'])
+QR_STAGE_LATENCY = Histogram('solarium_qr_stage_seconds', 'Время стадий распознавания QR-кода', ['stage'])
+QR_RESULTS = Counter('solarium_qr_results_total', 'Итоги распознавания QR-кодов', ['result'])
+BOT_API_LATENCY = Histogram('solarium_bot_api_seconds', 'Время запросов к Bot API', ['method'])
+BOT_API_ERRORS = Counter('solarium_bot_api_errors_total', 'Ошибки запросов к Bot API', ['method'])
+UPDATES_SHED = Counter('solarium_updates_shed_total', 'Обновления, отброшенные при переполнении полосы')
+UPDATE_QUEUE_WAIT = Histogram('solarium_update_queue_wait_seconds', 'Ожидание обновления в очереди полосы')
+UPDATES_REJECTED = Counter('solarium_updates_rejected_total', 'Обновления, отклоненные до обработчиков', ['reason'])
+
+METRICS = [
+    HANDLER_LATENCY, HANDLER_ERRORS, SQL_LATENCY, QR_STAGE_LATENCY, QR_RESULTS,
+    BOT_API_LATENCY, BOT_API_ERRORS, UPDATES_SHED, UPDATE_QUEUE_WAIT, UPDATES_REJECTED,
+]
+GAUGES = []
+
+
+def register_gauge(gauge: Gauge):
+    GAUGES.append(gauge)
+
+
+async def render() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for gauge in GAUGES:
+        lines.extend(await gauge.render_async())
+    return '\n'.join(lines) + '\n'
+
+
+class InstrumentedBot(Bot):
+    """Bot, измеряющий каждый исходящий запрос к Bot API"""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception:
+            BOT_API_ERRORS.inc(method)
+            raise
+        finally:
+            BOT_API_LATENCY.observe(time.perf_counter() - started, method)
+
+
+async def handle_metrics(request: web.Request):
+    return web.Response(text=await render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server():
+    """Запускает /metrics, если задан METRICS_PORT; возвращает runner или None"""
+    port = os.getenv('METRICS_PORT')
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, os.getenv('METRICS_HOST', '127.0.0.1'), int(port)).start()
+    return runner
@@ -0,0 +1,370 @@
+"""
+Версионные миграции схемы базы.
+
+Номер последней примененной миграции хранится в PRAGMA user_version. Каждая
+миграция выполняется в своей транзакции вместе с повышением номера, поэтому
+прерванный запуск просто повторит ее. Миграции только добавляют таблицы,
+столбцы и индексы; перенос данных в новые столбцы идет в фоне
+(Database.backfill_user_dates), чтобы запуск бота не ждал обхода всей таблицы.
+"""
+from datetime import datetime
+
+
+def parse_registration_date(text):
+    """Unix-время из registration_date ('%d-%m-%Y %H:%M:%S', местное время) или None"""
+    try:
+        return int(datetime.strptime(text, '%d-%m-%Y %H:%M:%S').timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_birthdate(text):
+    """(ISO-дата, 'ММ-ДД') из birthdate ('%d-%m-%Y') или (None, None)"""
+    try:
+        iso = datetime.strptime(text, '%d-%m-%Y').date().isoformat()
+    except (TypeError, ValueError):
+        return None, None
+    return iso, iso[5:]
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def migration_1(conn):
+    """Базовая схема: таблицы, созданные до появления миграций"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        fullname TEXT,
+        birthdate TEXT,
+        phone TEXT,
+        registration_date TEXT,
+        number_minutes INT,
+        total_minutes INT
+    )
+    ''')
+    # Журнал начислений и списаний; баланс в users — материализованный итог журнала
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS minutes_ledger (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        operation TEXT NOT NULL CHECK (operation IN ('credit', 'debit')),
+        amount INTEGER NOT NULL CHECK (amount > 0),
+        admin_id INTEGER,
+        created_at INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_minutes_ledger_user ON minutes_ledger (user_id)')
+    # Пользователи, заблокировавшие бота, исключаются из рассылок
+    if 'bot_blocked' not in _columns(conn, 'users'):
+        conn.execute('ALTER TABLE users ADD COLUMN bot_blocked INTEGER NOT NULL DEFAULT 0')
+    # Задания рассылки и их прогресс для продолжения после перезапуска
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL,
+        admin_chat_id INTEGER,
+        status TEXT NOT NULL,
+        last_user_id INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        created_at INTEGER NOT NULL,
+        finished_at INTEGER
+    )
+    ''')
+    # file_id загруженных в Telegram QR-кодов для повторной отправки без загрузки
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS qr_file_ids (
+        user_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL,
+        file_id TEXT NOT NULL
+    )
+    ''')
+    # Состояния FSM aiogram; data и bucket — компактный JSON, NULL вместо пустых
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        state TEXT,
+        data TEXT,
+        bucket TEXT,
+        updated_at INTEGER NOT NULL,
+        PRIMARY KEY (chat_id, user_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)')
+
+
+def migration_2(conn):
+    """Даты в сортируемом виде и индексы для поиска и аналитики"""
+    columns = _columns(conn, 'users')
+    # Unix-время регистрации, ISO-дата рождения и 'ММ-ДД' для поиска именинников
+    for name, definition in (('registration_ts', 'INTEGER'), ('birth_iso', 'TEXT'), ('birth_md', 'TEXT')):
+        if name not in columns:
+            conn.execute(f'ALTER TABLE users ADD COLUMN {name} {definition}')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phone)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_registration_ts ON users (registration_ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_birth_md ON users (birth_md)')
+
+
+def migration_3(conn):
+    """Полнотекстовый поиск клиентов по ФИО и username"""
+    # Внешнее содержимое: в индексе только токены, сами строки читаются из users
+    conn.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        fullname, username,
+        content='users', content_rowid='user_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts (rowid, fullname, username) VALUES (new.user_id, new.fullname, new.username);
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, fullname, username)
+        VALUES ('delete', old.user_id, old.fullname, old.username);
+    END
+    ''')
+    # Начисления и списания меняют только минуты и не трогают индекс
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF fullname, username ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, fullname, username)
+        VALUES ('delete', old.user_id, old.fullname, old.username);
+        INSERT INTO users_fts (rowid, fullname, username) VALUES (new.user_id, new.fullname, new.username);
+    END
+    ''')
+    conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+
+def migration_4(conn):
+    """Сводные таблицы статистики, которые поддерживают триггеры"""
+    # Итоги по всей базе: клиенты, остаток и использованные минуты
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_totals (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT PRIMARY KEY,
+        registrations INTEGER NOT NULL DEFAULT 0,
+        credited INTEGER NOT NULL DEFAULT 0,
+        debited INTEGER NOT NULL DEFAULT 0,
+        operations INTEGER NOT NULL DEFAULT 0,
+        active_clients INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_admin_daily (
+        day TEXT NOT NULL,
+        admin_id INTEGER NOT NULL,
+        credited INTEGER NOT NULL DEFAULT 0,
+        debited INTEGER NOT NULL DEFAULT 0,
+        operations INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, admin_id)
+    ) WITHOUT ROWID
+    ''')
+    # Клиенты, у которых в этот день были операции: для подсчета уникальных за день
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_client_days (
+        day TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (day, user_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_minutes_ledger_created ON minutes_ledger (created_at)')
+
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users BEGIN
+        UPDATE stats_totals SET value = value + 1 WHERE key = 'clients';
+        UPDATE stats_totals SET value = value + coalesce(new.number_minutes, 0) WHERE key = 'balance_minutes';
+        UPDATE stats_totals SET value = value + coalesce(new.total_minutes, 0) WHERE key = 'used_minutes';
+        INSERT INTO stats_daily (day, registrations) VALUES (date('now', 'localtime'), 1)
+        ON CONFLICT (day) DO UPDATE SET registrations = registrations + 1;
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users BEGIN
+        UPDATE stats_totals SET value = value - 1 WHERE key = 'clients';
+        UPDATE stats_totals SET value = value - coalesce(old.number_minutes, 0) WHERE key = 'balance_minutes';
+        UPDATE stats_totals SET value = value - coalesce(old.total_minutes, 0) WHERE key = 'used_minutes';
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_users_minutes AFTER UPDATE OF number_minutes, total_minutes ON users BEGIN
+        UPDATE stats_totals SET value = value + coalesce(new.number_minutes, 0) - coalesce(old.number_minutes, 0)
+        WHERE key = 'balance_minutes';
+        UPDATE stats_totals SET value = value + coalesce(new.total_minutes, 0) - coalesce(old.total_minutes, 0)
+        WHERE key = 'used_minutes';
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_ledger_insert AFTER INSERT ON minutes_ledger BEGIN
+        INSERT INTO stats_daily (day, credited, debited, operations)
+        VALUES (date(new.created_at, 'unixepoch', 'localtime'),
+                iif(new.operation = 'credit', new.amount, 0), iif(new.operation = 'debit', new.amount, 0), 1)
+        ON CONFLICT (day) DO UPDATE SET
+            credited = credited + excluded.credited,
+            debited = debited + excluded.debited,
+            operations = operations + 1;
+        INSERT INTO stats_admin_daily (day, admin_id, credited, debited, operations)
+        VALUES (date(new.created_at, 'unixepoch', 'localtime'), coalesce(new.admin_id, 0),
+                iif(new.operation = 'credit', new.amount, 0), iif(new.operation = 'debit', new.amount, 0), 1)
+        ON CONFLICT (day, admin_id) DO UPDATE SET
+            credited = credited + excluded.credited,
+            debited = debited + excluded.debited,
+            operations = operations + 1;
+        UPDATE stats_daily SET active_clients = active_clients + 1
+        WHERE day = date(new.created_at, 'unixepoch', 'localtime') AND NOT EXISTS (
+            SELECT 1 FROM stats_client_days
+            WHERE day = date(new.created_at, 'unixepoch', 'localtime') AND user_id = new.user_id
+        );
+        INSERT OR IGNORE INTO stats_client_days (day, user_id)
+        VALUES (date(new.created_at, 'unixepoch', 'localtime'), new.user_id);
+    END
+    ''')
+
+    # Начальные значения из уже накопленных данных
+    conn.execute('''
+    INSERT OR REPLACE INTO stats_totals (key, value)
+    SELECT 'clients', COUNT(*) FROM users
+    UNION ALL SELECT 'balance_minutes', coalesce(SUM(number_minutes), 0) FROM users
+    UNION ALL SELECT 'used_minutes', coalesce(SUM(total_minutes), 0) FROM users
+    ''')
+    # registration_date хранится как 'ДД-ММ-ГГГГ ЧЧ:ММ:СС'
+    conn.execute('''
+    INSERT OR REPLACE INTO stats_daily (day, registrations)
+    SELECT substr(registration_date, 7, 4) || '-' || substr(registration_date, 4, 2) || '-'
+           || substr(registration_date, 1, 2) AS day, COUNT(*)
+    FROM users WHERE registration_date IS NOT NULL GROUP BY day
+    ''')
+    conn.execute('''
+    INSERT OR IGNORE INTO stats_client_days (day, user_id)
+    SELECT DISTINCT date(created_at, 'unixepoch', 'localtime'), user_id FROM minutes_ledger
+    ''')
+    conn.execute('''
+    INSERT INTO stats_daily (day, credited, debited, operations, active_clients)
+    SELECT day, SUM(credited), SUM(debited), SUM(operations),
+           (SELECT COUNT(*) FROM stats_client_days c WHERE c.day = a.day)
+    FROM (
+        SELECT date(created_at, 'unixepoch', 'localtime') AS day,
+               iif(operation = 'credit', amount, 0) AS credited,
+               iif(operation = 'debit', amount, 0) AS debited,
+               1 AS operations
+        FROM minutes_ledger
+    ) AS a
+    WHERE true GROUP BY day
+    ON CONFLICT (day) DO UPDATE SET
+        credited = excluded.credited,
+        debited = excluded.debited,
+        operations = excluded.operations,
+        active_clients = excluded.active_clients
+    ''')
+    conn.execute('''
+    INSERT OR REPLACE INTO stats_admin_daily (day, admin_id, credited, debited, operations)
+    SELECT date(created_at, 'unixepoch', 'localtime') AS day, coalesce(admin_id, 0),
+           SUM(iif(operation = 'credit', amount, 0)), SUM(iif(operation = 'debit', amount, 0)), COUNT(*)
+    FROM minutes_ledger GROUP BY day, coalesce(admin_id, 0)
+    ''')
+
+
+def migration_5(conn):
+    """Запуски плановых задач и отправленные уведомления"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS job_runs (
+        job TEXT NOT NULL,
+        run_key TEXT NOT NULL,
+        status TEXT NOT NULL,
+        started_at INTEGER NOT NULL,
+        finished_at INTEGER,
+        sent INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (job, run_key)
+    ) WITHOUT ROWID
+    ''')
+    # Запись о получателе делается до отправки: после перезапуска сообщение не уйдет повторно
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS notifications_sent (
+        job TEXT NOT NULL,
+        run_key TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        sent_at INTEGER NOT NULL,
+        PRIMARY KEY (job, run_key, user_id)
+    ) WITHOUT ROWID
+    ''')
+
+
+def migration_6(conn):
+    """Архив давно неактивных клиентов"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users_archive (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        fullname TEXT,
+        birthdate TEXT,
+        phone TEXT,
+        registration_date TEXT,
+        number_minutes INT,
+        total_minutes INT,
+        bot_blocked INTEGER NOT NULL DEFAULT 0,
+        registration_ts INTEGER,
+        birth_iso TEXT,
+        birth_md TEXT,
+        archived_at INTEGER NOT NULL
+    )
+    ''')
+
+
+def migration_7(conn):
+    """Клиенты, заблокированные администратором"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS blocked_users (
+        user_id INTEGER PRIMARY KEY,
+        admin_id INTEGER NOT NULL,
+        reason TEXT,
+        blocked_at INTEGER NOT NULL
+    )
+    ''')
+
+
+# (версия, функция) по возрастанию; примененные миграции не меняются, только добавляются новые
+MIGRATIONS = [
+    (1, migration_1),
+    (2, migration_2),
+    (3, migration_3),
+    (4, migration_4),
+    (5, migration_5),
+    (6, migration_6),
+    (7, migration_7),
+]
+
+
+def schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Применяет недостающие миграции; возвращает номера примененных"""
+    applied = []
+    for version, func in MIGRATIONS:
+        if schema_version(conn) >= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Другой процесс мог применить миграцию, пока мы ждали блокировку
+            if schema_version(conn) < version:
+                func(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+                applied.append(version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return applied
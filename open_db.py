@@ -1,41 +1,152 @@
-import sqlite3
-from tabulate import tabulate
-
-def print_all_users():
-    """Выводит всех пользователей из базы данных в терминал"""
-    try:
-        conn = sqlite3.connect('solarium_bot.db')
-        cursor = conn.cursor()
-        
-        # Проверяем существование таблицы users
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        if not cursor.fetchone():
-            print("Таблица users не существует в базе данных.")
-            return
-        
-        # Получаем все записи из таблицы users
-        cursor.execute('SELECT * FROM users')
-        users = cursor.fetchall()
-        
-        # Получаем названия столбцов
-        cursor.execute('PRAGMA table_info(users)')
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if not users:
-            print("В базе данных нет записей.")
-            return
-            
-        # Выводим данные в виде красивой таблицы
-        print("\nСодержимое базы данных:")
-        print(tabulate(users, headers=columns, tablefmt="grid"))
-        
-        print(f"\nВсего записей: {len(users)}")
-        
-    except sqlite3.Error as e:
-        print(f"Ошибка при чтении базы данных: {e}")
-    finally:
-        if conn:
-            conn.close()
-
-if __name__ == '__main__':
-    print_all_users()
\ No newline at end of file
+"""
+Просмотр и выгрузка клиентов из базы бота.
+
+База открывается только на чтение, а строки читаются страницами по user_id
+(keyset-пагинация): каждая страница — короткая читающая транзакция, поэтому
+инструмент можно запускать рядом с работающим ботом, не мешая его записи,
+а память не зависит от размера базы.
+
+    python open_db.py                                   # таблица в терминал
+    python open_db.py --format csv --output users.csv
+    python open_db.py --format jsonl --registered-from 01.01.2025 --max-balance 10
+"""
+import argparse
+import csv
+from datetime import datetime, timedelta
+import json
+import sqlite3
+import sys
+
+from tabulate import tabulate
+
+DB_PATH = 'solarium_bot.db'
+
+COLUMNS = (
+    'user_id', 'username', 'fullname', 'birthdate', 'phone', 'registration_date',
+    'number_minutes', 'total_minutes', 'bot_blocked',
+)
+
+
+def connect_readonly(path: str) -> sqlite3.Connection:
+    """Соединение только на чтение; в режиме WAL читатель не блокирует бота"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    conn.execute('PRAGMA query_only=1')
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+
+def build_filters(args):
+    """Условия WHERE и параметры из аргументов командной строки"""
+    conditions = []
+    params = []
+    # registration_ts заполняется миграцией в фоне; строки без него в период не попадают
+    if args.registered_from:
+        conditions.append('registration_ts >= ?')
+        params.append(int(datetime.strptime(args.registered_from, '%d.%m.%Y').timestamp()))
+    if args.registered_to:
+        conditions.append('registration_ts < ?')
+        params.append(int((datetime.strptime(args.registered_to, '%d.%m.%Y') + timedelta(days=1)).timestamp()))
+    if args.min_balance is not None:
+        conditions.append('number_minutes >= ?')
+        params.append(args.min_balance)
+    if args.max_balance is not None:
+        conditions.append('number_minutes <= ?')
+        params.append(args.max_balance)
+    return conditions, params
+
+
+def iter_pages(conn, columns, conditions, params, page_size: int, after: int = 0, limit: int = None):
+    """Страницы строк по возрастанию user_id"""
+    key = columns.index('user_id')
+    where = ' AND '.join(['user_id > ?'] + conditions)
+    sql = f"SELECT {', '.join(columns)} FROM users WHERE {where} ORDER BY user_id LIMIT ?"
+    left = limit
+    while left is None or left > 0:
+        size = page_size if left is None else min(page_size, left)
+        rows = conn.execute(sql, [after, *params, size]).fetchall()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][key]
+        if left is not None:
+            left -= len(rows)
+
+
+def write_pages(pages, columns, fmt: str, out) -> int:
+    """Пишет страницы в out в выбранном формате; возвращает число строк"""
+    count = 0
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+    for rows in pages:
+        if fmt == 'csv':
+            writer.writerows(rows)
+        elif fmt == 'jsonl':
+            for row in rows:
+                out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+        else:
+            # Таблица печатается постранично, у каждой страницы свой заголовок
+            out.write(tabulate(rows, headers=columns, tablefmt="grid") + '\n')
+        count += len(rows)
+    return count
+
+
+def main(args):
+    columns = args.columns.split(',') if args.columns else list(COLUMNS)
+    unknown = [column for column in columns if column not in COLUMNS]
+    if unknown:
+        print(f"Неизвестные столбцы: {', '.join(unknown)}")
+        return 1
+    # user_id — ключ пагинации
+    if 'user_id' not in columns:
+        columns.insert(0, 'user_id')
+
+    try:
+        conditions, params = build_filters(args)
+    except ValueError:
+        print("Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+        return 1
+
+    conn = None
+    try:
+        conn = connect_readonly(args.db)
+        if not conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'").fetchone():
+            print("Таблица users не существует в базе данных.")
+            return 1
+
+        pages = iter_pages(conn, columns, conditions, params, args.page_size, args.after, args.limit)
+        if args.output:
+            encoding = 'utf-8-sig' if args.format == 'csv' else 'utf-8'
+            with open(args.output, 'w', encoding=encoding, newline='') as out:
+                count = write_pages(pages, columns, args.format, out)
+        else:
+            count = write_pages(pages, columns, args.format, sys.stdout)
+
+        if not count:
+            print("В базе данных нет записей.", file=sys.stderr)
+        else:
+            print(f"\nВсего записей: {count}", file=sys.stderr)
+        return 0
+    except sqlite3.Error as e:
+        print(f"Ошибка при чтении базы данных: {e}")
+        return 1
+    finally:
+        if conn:
+            conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Просмотр и выгрузка клиентов солярия')
+    parser.add_argument('--db', default=DB_PATH, help='файл базы данных')
+    parser.add_argument('--format', choices=['table', 'csv', 'jsonl'], default='table')
+    parser.add_argument('--output', help='файл для выгрузки (по умолчанию stdout)')
+    parser.add_argument('--columns', help=f"столбцы через запятую из: {', '.join(COLUMNS)}")
+    parser.add_argument('--registered-from', help='дата регистрации от, ДД.ММ.ГГГГ')
+    parser.add_argument('--registered-to', help='дата регистрации до, ДД.ММ.ГГГГ включительно')
+    parser.add_argument('--min-balance', type=int, help='остаток минут не меньше')
+    parser.add_argument('--max-balance', type=int, help='остаток минут не больше')
+    parser.add_argument('--after', type=int, default=0, help='начать после этого user_id')
+    parser.add_argument('--limit', type=int, help='не больше стольких строк')
+    parser.add_argument('--page-size', type=int, default=500, help='строк на страницу')
+    sys.exit(main(parser.parse_args()))
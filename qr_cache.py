@@ -0,0 +1,103 @@
+import asyncio
+from collections import OrderedDict
+from io import BytesIO
+import os
+import shutil
+
+# Версия формата содержимого QR-кода. Увеличьте при изменении payload:
+# устаревшие PNG и file_id Telegram будут сброшены при запуске
+QR_PAYLOAD_VERSION = 1
+
+QR_CACHE_DIR = 'qr_cache'
+
+
+def qr_payload(user_id: int) -> str:
+    """Содержимое QR-кода пользователя"""
+    return str(user_id)
+
+
+def render_qr_png(payload: str) -> bytes:
+    """Рисует QR-код и возвращает PNG"""
+    # qrcode тянет за собой Pillow; загружаем их при первой отрисовке, а не при запуске бота
+    import qrcode
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    bio = BytesIO()
+    img.save(bio, 'PNG')
+    return bio.getvalue()
+
+
+class QRCache:
+    """Кэш QR-кодов: file_id Telegram, PNG в памяти (LRU) и на диске"""
+
+    def __init__(self, db, directory: str = QR_CACHE_DIR, max_items: int = None):
+        self.db = db
+        self.max_items = max_items or int(os.getenv('QR_CACHE_SIZE', '256'))
+        self.directory = os.path.join(directory, f'v{QR_PAYLOAD_VERSION}')
+        self.memory = OrderedDict()
+        os.makedirs(self.directory, exist_ok=True)
+        # Каталоги прежних версий формата больше не нужны
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if path != self.directory and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _path(self, user_id: int) -> str:
+        return os.path.join(self.directory, f'{user_id}.png')
+
+    async def get_file_id(self, user_id: int):
+        """file_id уже загруженного в Telegram QR-кода или None"""
+        return await self.db.get_qr_file_id(user_id, QR_PAYLOAD_VERSION)
+
+    async def save_file_id(self, user_id: int, file_id: str):
+        """Запоминает file_id после первой загрузки"""
+        await self.db.save_qr_file_id(user_id, QR_PAYLOAD_VERSION, file_id)
+
+    async def get_png(self, user_id: int) -> bytes:
+        """PNG QR-кода: из памяти, с диска или новая отрисовка"""
+        png = self.memory.get(user_id)
+        if png is not None:
+            self.memory.move_to_end(user_id)
+            return png
+
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(None, self._load_or_render, user_id)
+        self.memory[user_id] = png
+        if len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+        return png
+
+    def _load_or_render(self, user_id: int) -> bytes:
+        path = self._path(user_id)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        png = render_qr_png(qr_payload(user_id))
+        # Запись через временный файл, чтобы не оставить обрезанный PNG
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(png)
+        os.replace(tmp_path, path)
+        return png
+
+    async def prewarm(self):
+        """Загружает qrcode и Pillow в фоне пробной отрисовкой"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, render_qr_png, qr_payload(0))
+
+    async def invalidate(self, user_id: int):
+        """Сбрасывает все уровни кэша для пользователя"""
+        self.memory.pop(user_id, None)
+        try:
+            os.remove(self._path(user_id))
+        except FileNotFoundError:
+            pass
+        await self.db.delete_qr_file_id(user_id)
+
+    async def purge_stale(self):
+        """Удаляет file_id, сохраненные для прежних версий формата"""
+        await self.db.purge_qr_file_ids(QR_PAYLOAD_VERSION)
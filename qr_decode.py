@@ -0,0 +1,271 @@
+"""
+Распознавание QR-кода на фото: каскад стадий OpenCV и pyzbar.
+
+Модуль тяжелый — при импорте загружаются OpenCV, numpy и zbar, — поэтому
+бот импортирует его только в воркерах пула распознавания (см. qr_service).
+"""
+from collections import namedtuple
+import time
+
+import cv2
+import numpy as np
+from pyzbar.pyzbar import decode, ZBarSymbol
+
+
+# Самая длинная сторона грубого уровня пирамиды для первой, быстрой попытки
+PYRAMID_BASE_SIDE = 1000
+
+# Стадии каскада в порядке возрастания стоимости
+STAGES = ('pyramid', 'white_square', 'adaptive', 'opencv')
+
+# Сколько белых квадратов проверяется в пакетном режиме
+MAX_SQUARES = 12
+# Границы компактности 16·S/P² для «квадрата» в пакетном режиме: на корпусе bench_qr
+# квадраты, принятые find_white_square, укладываются в 0.77–1.01 (нижние — с бликом)
+SQUARE_COMPACTNESS = (0.75, 1.05)
+
+QRResult = namedtuple('QRResult', ['data', 'stage'])
+
+
+def _contour_metrics(contours):
+    """Площадь, периметр, ширина и высота всех контуров одним проходом numpy"""
+    lengths = np.fromiter(map(len, contours), dtype=np.int64, count=len(contours))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    # Следующая точка контура; у последней — первая точка того же контура
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+    x, y = points[:, 0], points[:, 1]
+    next_x, next_y = x[following], y[following]
+    # Формула шнурков для площади и сумма длин сторон для периметра
+    area = np.abs(np.add.reduceat(x * next_y - next_x * y, starts)) / 2
+    perimeter = np.add.reduceat(np.hypot(next_x - x, next_y - y), starts)
+    width = np.maximum.reduceat(x, starts) - np.minimum.reduceat(x, starts) + 1
+    height = np.maximum.reduceat(y, starts) - np.minimum.reduceat(y, starts) + 1
+    return area, perimeter, width, height
+
+
+def _warp_square(image, contour):
+    """Вырезает повернутый квадрат и выпрямляет его перспективным преобразованием"""
+    # Получаем повернутый прямоугольник
+    rect = cv2.minAreaRect(contour)
+    box = cv2.boxPoints(rect)
+    box = box.astype(np.int32)
+
+    # Вычисляем ширину и высоту ROI
+    width = int(rect[1][0])
+    height = int(rect[1][1])
+
+    # Точки для перспективного преобразования
+    src_pts = box.astype("float32")
+    dst_pts = np.array([[0, height-1],
+                    [0, 0],
+                    [width-1, 0],
+                    [width-1, height-1]], dtype="float32")
+
+    # Перспективное преобразование
+    M = cv2.getPerspectiveTransform(src_pts, dst_pts)
+    return cv2.warpPerspective(image, M, (width, height))
+
+
+def _white_mask(image):
+    """Маска белых областей снимка"""
+    # Преобразуем в HSV для лучшего выделения белого
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    # Диапазон белого цвета в HSV
+    lower_white = np.array([0, 0, 200])
+    upper_white = np.array([180, 30, 255])
+    mask = cv2.inRange(hsv, lower_white, upper_white)
+
+    # Морфологические операции
+    kernel = np.ones((5,5), np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    return cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+
+def find_white_square(image):
+    """Находит белый квадрат на изображении и возвращает его ROI"""
+    # Находим контуры
+    contours, _ = cv2.findContours(_white_mask(image), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Ищем квадратные контуры
+    squares = []
+    for cnt in contours:
+        # Аппроксимируем контур
+        epsilon = 0.1 * cv2.arcLength(cnt, True)
+        approx = cv2.approxPolyDP(cnt, epsilon, True)
+
+        # Ищем четырехугольники
+        if len(approx) == 4:
+            # Проверяем на квадратность
+            area = cv2.contourArea(approx)
+            x,y,w,h = cv2.boundingRect(approx)
+            aspect_ratio = float(w)/h
+
+            if 0.8 < aspect_ratio < 1.2 and area > 1000:  # Фильтр по размеру и форме
+                squares.append(approx)
+
+    # Если нашли квадраты, берем самый большой
+    if squares:
+        largest_square = max(squares, key=cv2.contourArea)
+        return _warp_square(image, largest_square)
+
+    return None
+
+
+def find_white_squares(image, limit: int = MAX_SQUARES):
+    """ROI белых квадратов на изображении, от большего к меньшему, для пакетного режима"""
+    contours, _ = cv2.findContours(_white_mask(image), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return []
+
+    # Грубый отбор всех контуров сразу: на снимке группы их тысячи, почти все — модули QR-кодов.
+    # Компактность 16·S/P² равна 1 у квадрата при любом повороте и дальше от 1 у других фигур
+    area, perimeter, width, height = _contour_metrics(contours)
+    aspect_ratio = width / height
+    compactness = 16 * area / np.maximum(perimeter, 1) ** 2
+    low, high = SQUARE_COMPACTNESS
+    candidates = np.flatnonzero((area > 1000) & (aspect_ratio > 0.8) & (aspect_ratio < 1.2)
+                                & (compactness > low) & (compactness < high))
+
+    # Проверка на четырехугольник, как в find_white_square, — только для прошедших отбор
+    squares = []
+    for i in candidates[np.argsort(-area[candidates], kind='stable')]:
+        approx = cv2.approxPolyDP(contours[i], 0.1 * perimeter[i], True)
+        if len(approx) == 4:
+            squares.append(_warp_square(image, approx))
+            if len(squares) == limit:
+                break
+    return squares
+
+
+def _binarize_roi(roi):
+    """Улучшаем изображение: полутона и бинаризация Оцу"""
+    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return thresh
+
+
+def decode_qr_from_roi(roi):
+    """Декодирует QR-код из выделенной области"""
+    found = _zbar_all(_binarize_roi(roi))
+    return found[0] if found else None
+
+
+def _zbar_all(gray):
+    """Запускает pyzbar на полутоновом изображении; содержимое всех найденных QR-кодов"""
+    return [symbol.data.decode('ascii') for symbol in decode(gray, symbols=[ZBarSymbol.QRCODE])]
+
+
+def _pyramid(gray):
+    """Уровни пирамиды от самого грубого к более крупным, без исходного разрешения"""
+    levels = []
+    level = gray
+    while max(level.shape[:2]) > PYRAMID_BASE_SIDE:
+        level = cv2.pyrDown(level)
+        levels.append(level)
+    return reversed(levels)
+
+
+def stage_pyramid(image, gray, multiple=False):
+    """Стадия 1: pyzbar на уменьшенных копиях снимка"""
+    found = []
+    for level in _pyramid(gray):
+        found += _zbar_all(level)
+        # Ради нескольких кодов проходим все уровни: на грубом читаются не все
+        if found and not multiple:
+            return found
+    if max(gray.shape[:2]) <= PYRAMID_BASE_SIDE:
+        # Снимок и так небольшой, пробуем его целиком
+        found += _zbar_all(gray)
+    return found
+
+
+def stage_white_square(image, gray, multiple=False):
+    """Стадия 2: поиск белых квадратов и бинаризация Оцу"""
+    found = []
+    rois = find_white_squares(image) if multiple else [find_white_square(image)]
+    for roi in rois:
+        if roi is not None:
+            found += _zbar_all(_binarize_roi(roi))
+    return found
+
+
+def stage_adaptive(image, gray, multiple=False):
+    """Стадия 3: адаптивная бинаризация в полном разрешении"""
+    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY, 51, 10)
+    return _zbar_all(thresh)
+
+
+def stage_opencv(image, gray, multiple=False):
+    """Стадия 4: встроенный детектор OpenCV"""
+    detector = cv2.QRCodeDetector()
+    if multiple:
+        ok, found, _, _ = detector.detectAndDecodeMulti(gray)
+        return [data for data in found if data] if ok else []
+    data, _, _ = detector.detectAndDecode(gray)
+    return [data] if data else []
+
+
+STAGE_FUNCS = {
+    'pyramid': stage_pyramid,
+    'white_square': stage_white_square,
+    'adaptive': stage_adaptive,
+    'opencv': stage_opencv,
+}
+
+
+def decode_image(image, timings: dict = None):
+    """Каскад распознавания: останавливается на первой успешной стадии
+
+    Если передан timings, в него записывается время каждой выполненной стадии в секундах.
+    """
+    started = time.perf_counter()
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    for stage in STAGES:
+        found = STAGE_FUNCS[stage](image, gray)
+        if timings is not None:
+            now = time.perf_counter()
+            timings[stage] = now - started
+            started = now
+        if found:
+            return QRResult(found[0], stage)
+    return None
+
+
+def decode_image_all(image, timings: dict = None):
+    """Все различные QR-коды на снимке: выполняются все стадии, результаты объединяются"""
+    started = time.perf_counter()
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    results = {}
+    for stage in STAGES:
+        for data in STAGE_FUNCS[stage](image, gray, multiple=True):
+            results.setdefault(data, QRResult(data, stage))
+        if timings is not None:
+            now = time.perf_counter()
+            timings[stage] = now - started
+            started = now
+    return list(results.values())
+
+
+def _imdecode(data, timings: dict = None):
+    started = time.perf_counter()
+    img_array = np.frombuffer(data, dtype=np.uint8)
+    image = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+    if timings is not None:
+        timings['imdecode'] = time.perf_counter() - started
+    if image is None:
+        raise ValueError("Не удалось прочитать изображение")
+    return image
+
+
+def decode_photo(data, timings: dict = None):
+    """Полный цикл распознавания фото; data — bytes или memoryview, не копируется"""
+    return decode_image(_imdecode(data, timings), timings)
+
+
+def decode_photo_all(data, timings: dict = None):
+    """Все QR-коды на фото, например у группы клиентов"""
+    return decode_image_all(_imdecode(data, timings), timings)
@@ -0,0 +1,105 @@
+import asyncio
+import os
+
+from aiogram import Bot
+
+from metrics import QR_RESULTS, QR_STAGE_LATENCY
+from qr_service import DownloadBuffer, QRDecodeService
+from user_cache import MISSING, UserCache
+
+
+class QRScanner:
+    """Распознавание QR-кода с фото из сообщения: кэш по file_unique_id и общий скан для повторов"""
+
+    def __init__(self, bot: Bot, service: QRDecodeService):
+        self.bot = bot
+        self.service = service
+        # Наименьшая сторона фото, с которой начинается распознавание
+        self.min_photo_side = int(os.getenv('QR_MIN_PHOTO_SIDE', '800'))
+        # Пересланное заново фото сохраняет file_unique_id, повторно его не скачиваем
+        self.cache = UserCache(
+            max_items=int(os.getenv('QR_SCAN_CACHE_SIZE', '1024')),
+            ttl=float(os.getenv('QR_SCAN_CACHE_TTL', '3600')),
+            negative_ttl=float(os.getenv('QR_SCAN_CACHE_NEGATIVE_TTL', '300')),
+        )
+        self.in_flight = {}
+        self.buffers = []
+
+    def photo_candidates(self, sizes):
+        """Размеры фото по возрастанию, начиная с наименьшего, на котором QR-код еще читается"""
+        sizes = sorted(sizes, key=lambda size: size.width * size.height)
+        for i, size in enumerate(sizes):
+            if min(size.width, size.height) >= self.min_photo_side:
+                return sizes[i:]
+        return sizes[-1:]
+
+    async def scan(self, sizes):
+        """QRResult или None; исключения QRDecodeService.decode передаются вызывающему"""
+        key = max(sizes, key=lambda size: size.width * size.height).file_unique_id
+        cached = self.cache.get(key)
+        if cached is not None:
+            QR_RESULTS.inc('cached')
+            return None if cached is MISSING else cached
+
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._scan(key, sizes))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            QR_RESULTS.inc('shared')
+        # shield: отмена одного ожидающего не прерывает скан для остальных
+        return await asyncio.shield(task)
+
+    async def scan_all(self, sizes):
+        """Все QR-коды с фото группы клиентов; фото берется в наибольшем размере"""
+        size = max(sizes, key=lambda size: size.width * size.height)
+        # Ключ отличается от scan: там в кэше один результат, здесь список
+        key = ('all', size.file_unique_id)
+        cached = self.cache.get(key)
+        if cached is not None:
+            QR_RESULTS.inc('cached')
+            return [] if cached is MISSING else cached
+
+        buffer = self.buffers.pop() if self.buffers else DownloadBuffer()
+        try:
+            with QR_STAGE_LATENCY.time('download'):
+                file = await self.bot.get_file(size.file_id)
+                buffer.reserve(size.file_size or file.file_size or 0)
+                await self.bot.download_file(file.file_path, destination=buffer, seek=False)
+            results = await self.service.decode_all(bytes(buffer.view()))
+        finally:
+            buffer.reset()
+            self.buffers.append(buffer)
+        self.cache.put(key, results or None)
+        return results
+
+    async def _scan(self, key, sizes):
+        result = await self._scan_sizes(sizes)
+        self.cache.put(key, result)
+        return result
+
+    async def _scan_sizes(self, sizes):
+        """Переходит к большему размеру фото, только если меньший не прочитался"""
+        result = None
+        error = None
+        for size in self.photo_candidates(sizes):
+            buffer = self.buffers.pop() if self.buffers else DownloadBuffer()
+            try:
+                with QR_STAGE_LATENCY.time('download'):
+                    file = await self.bot.get_file(size.file_id)
+                    buffer.reserve(size.file_size or file.file_size or 0)
+                    await self.bot.download_file(file.file_path, destination=buffer, seek=False)
+                # Единственная копия — передача в процесс-воркер
+                result = await self.service.decode(bytes(buffer.view()))
+                error = None
+            except ValueError as e:
+                error = e
+            finally:
+                buffer.reset()
+                self.buffers.append(buffer)
+            if result:
+                return result
+        if error is not None:
+            raise error
+        return None
@@ -0,0 +1,182 @@
+"""
+Пул процессов распознавания QR-кодов.
+
+Основной процесс бота не импортирует OpenCV, numpy и zbar: их загружает
+qr_decode в воркере при первом фото или при фоновом прогреве (prewarm).
+"""
+import asyncio
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import io
+import multiprocessing
+import os
+
+from metrics import QR_RESULTS, QR_STAGE_LATENCY
+
+# Воркеры возвращают простые кортежи (data, stage): распаковка qr_decode.QRResult
+# импортировала бы qr_decode, а с ним OpenCV и numpy, в основной процесс
+QRResult = namedtuple('QRResult', ['data', 'stage'])
+
+
+class DownloadBuffer(io.RawIOBase):
+    """Переиспользуемый буфер, в который фото скачивается напрямую из ответа сервера"""
+
+    def __init__(self):
+        super().__init__()
+        self.data = bytearray()
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def reserve(self, size: int):
+        """Заранее увеличивает буфер под ожидаемый размер файла"""
+        if size > len(self.data):
+            self.data.extend(bytes(size - len(self.data)))
+
+    def write(self, chunk):
+        end = self.size + len(chunk)
+        self.reserve(end)
+        self.data[self.size:end] = chunk
+        self.size = end
+        return len(chunk)
+
+    def view(self) -> memoryview:
+        """Содержимое буфера без копирования"""
+        return memoryview(self.data)[:self.size]
+
+    def reset(self):
+        self.size = 0
+
+
+class QRServiceBusy(Exception):
+    """Очередь распознавания заполнена, нужно повторить попытку позже"""
+
+
+def decode_photo_timed(data: bytes):
+    """decode_photo для пула процессов: возвращает результат и время стадий"""
+    from qr_decode import decode_photo
+    timings = {}
+    result = decode_photo(data, timings)
+    return (tuple(result) if result else None), timings
+
+
+def decode_photo_all_timed(data: bytes):
+    """decode_photo_all для пула процессов: все QR-коды на фото и время стадий"""
+    from qr_decode import decode_photo_all
+    timings = {}
+    return [tuple(result) for result in decode_photo_all(data, timings)], timings
+
+
+def warm_up() -> int:
+    """Загружает библиотеки распознавания в воркере; возвращает pid воркера"""
+    import qr_decode
+    return os.getpid()
+
+
+class QRDecodeService:
+    """Распознавание QR-кодов в пуле процессов, чтобы не блокировать event loop"""
+
+    def __init__(self, workers: int = None, max_queue: int = None, timeout: float = None):
+        self.workers = workers or int(os.getenv('QR_WORKERS', '2'))
+        self.max_queue = max_queue or int(os.getenv('QR_MAX_QUEUE', '8'))
+        self.timeout = timeout or float(os.getenv('QR_TIMEOUT', '10'))
+        self.executor = self._new_executor()
+        # Задачи, отправленные в пул и еще не завершенные воркером
+        self.pending = 0
+        # Сколько раз каждая стадия каскада оказалась успешной
+        self.stage_wins = Counter()
+
+    def _new_executor(self):
+        # spawn, а не fork: к моменту первого фото в боте уже работают потоки базы,
+        # и форк процесса с занятыми блокировками может зависнуть
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _restart(self, executor):
+        """Заменяет пул, в котором погиб воркер (например, OOM killer или segfault в OpenCV)"""
+        if executor is not self.executor:
+            # Пул уже пересоздан другой задачей, упавшей вместе с этой
+            return
+        QR_RESULTS.inc('broken')
+        print("Error: пул распознавания QR-кодов сломан, создаю новый")
+        executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self._new_executor()
+        # Задачи старого пула уже завершились с ошибкой
+        self.pending = 0
+
+    def _job_done(self, executor):
+        # Задачи старого пула не трогают счетчик нового: его обнулил _restart
+        if executor is self.executor:
+            self.pending -= 1
+
+    async def _submit(self, func, data: bytes):
+        """Выполняет func(data) в воркере с ограничением очереди и таймаутом; учитывает время стадий"""
+        if self.pending >= self.max_queue:
+            QR_RESULTS.inc('busy')
+            raise QRServiceBusy()
+
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            future = executor.submit(func, data)
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise QRServiceBusy()
+        self.pending += 1
+        # Счетчик уменьшается, когда воркер действительно освободится, а не по таймауту
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._job_done, executor))
+        try:
+            result, timings = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except BrokenProcessPool:
+            # Фото могло и убить воркер, поэтому повторять его в новом пуле не стоит
+            self._restart(executor)
+            raise QRServiceBusy()
+        except asyncio.TimeoutError:
+            QR_RESULTS.inc('timeout')
+            raise
+        except ValueError:
+            QR_RESULTS.inc('unreadable')
+            raise
+
+        for stage, seconds in timings.items():
+            QR_STAGE_LATENCY.observe(seconds, stage)
+        return result
+
+    async def decode(self, data: bytes):
+        """Возвращает QRResult с содержимым QR-кода и выигравшей стадией или None"""
+        result = await self._submit(decode_photo_timed, data)
+        result = QRResult(*result) if result else None
+        if result:
+            self.stage_wins[result.stage] += 1
+            QR_RESULTS.inc('decoded')
+        else:
+            QR_RESULTS.inc('not_found')
+        return result
+
+    async def decode_all(self, data: bytes):
+        """Список QRResult всех различных QR-кодов на фото; пустой, если кодов нет"""
+        results = [QRResult(*result) for result in await self._submit(decode_photo_all_timed, data)]
+        for result in results:
+            self.stage_wins[result.stage] += 1
+        if results:
+            QR_RESULTS.inc('decoded', amount=len(results))
+        else:
+            QR_RESULTS.inc('not_found')
+        return results
+
+    async def prewarm(self) -> int:
+        """Запускает воркеры и загружает в них библиотеки; возвращает число прогретых воркеров"""
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        # Воркеры создаются по мере надобности: одновременные задачи поднимут их все
+        try:
+            pids = await asyncio.gather(*(loop.run_in_executor(executor, warm_up) for _ in range(self.workers)))
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+        return len(set(pids))
+
+    def close(self):
+        """Остановка пула процессов"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
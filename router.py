@@ -0,0 +1,94 @@
+from collections import Counter, namedtuple
+import inspect
+import time
+
+from aiogram import types
+from aiogram.dispatcher import FSMContext
+from aiogram.types import ContentType
+
+from metrics import HANDLER_ERRORS, HANDLER_LATENCY
+
+# throttle: (число запросов, за секунд) для ограничения частоты или None
+Route = namedtuple('Route', ['key', 'handler', 'content_types', 'with_state', 'throttle'])
+
+
+class TextRouter:
+    """Маршрутизация сообщений одним обработчиком по таблице: текст кнопки или состояние FSM"""
+
+    def __init__(self):
+        # Маршруты без состояния: текст кнопки или команда -> обработчик
+        self.text_routes = {}
+        # Маршруты внутри сценариев: имя состояния -> обработчик
+        self.state_routes = {}
+        self.counters = Counter()
+
+    @staticmethod
+    def _route(key, handler, content_types, throttle=None):
+        with_state = 'state' in inspect.signature(handler).parameters
+        return Route(key, handler, frozenset(content_types), with_state, throttle)
+
+    @staticmethod
+    def text_key(text: str) -> str:
+        """Ключ маршрута для текста: /start@bot payload -> /start"""
+        if text.startswith('/'):
+            text = text.split(maxsplit=1)[0].split('@', 1)[0]
+        return text
+
+    def text(self, text: str, handler, throttle=None):
+        """Обработчик кнопки или команды вне сценариев"""
+        self.text_routes[text] = self._route(text, handler, [ContentType.TEXT], throttle)
+
+    def state(self, state, handler, content_types=(ContentType.TEXT,)):
+        """Обработчик шага сценария"""
+        self.state_routes[state.state] = self._route(state.state, handler, content_types)
+
+    @property
+    def routes(self):
+        """Таблица маршрутов для просмотра: ключ -> имя обработчика"""
+        return {
+            key: route.handler.__name__
+            for key, route in {**self.text_routes, **self.state_routes}.items()
+        }
+
+    def resolve(self, message: types.Message, current_state):
+        """Находит маршрут для сообщения или возвращает None"""
+        if current_state is None:
+            text = message.text
+            if not text:
+                return None
+            route = self.text_routes.get(self.text_key(text))
+        else:
+            route = self.state_routes.get(current_state)
+        if route is None or message.content_type not in route.content_types:
+            return None
+        return route
+
+    def throttled_route(self, message: types.Message):
+        """Маршрут кнопки или команды со своим ограничением частоты; состояние FSM не читается"""
+        if not message.text:
+            return None
+        route = self.text_routes.get(self.text_key(message.text))
+        if route is None or route.throttle is None:
+            return None
+        return route
+
+    async def dispatch(self, message: types.Message, state: FSMContext):
+        """Единственный зарегистрированный обработчик сообщений"""
+        route = self.resolve(message, await state.get_state())
+        if route is None:
+            return
+        self.counters[route.key] += 1
+        started = time.perf_counter()
+        try:
+            if route.with_state:
+                return await route.handler(message, state=state)
+            return await route.handler(message)
+        except Exception:
+            HANDLER_ERRORS.inc(route.handler.__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, route.handler.__name__)
+
+    def register(self, dp):
+        """Регистрирует маршрутизатор в диспетчере aiogram"""
+        dp.register_message_handler(self.dispatch, state='*', content_types=ContentType.ANY)
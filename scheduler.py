@@ -0,0 +1,134 @@
+"""
+Плановые задачи бота: поздравления с днем рождения и напоминания о заканчивающихся минутах.
+
+Каждая задача запускается раз в день в заданное время плюс случайный сдвиг,
+чтобы рассылка не совпадала с часами пиковой нагрузки. Запуск за день
+записывается в job_runs, а каждый получатель — в notifications_sent до
+отправки, поэтому перезапуск бота не приводит к повторным сообщениям.
+Сообщения уходят через ограничитель скорости рассыльщика.
+"""
+import asyncio
+from datetime import datetime, timedelta
+import os
+import random
+import time
+
+from broadcast import Broadcaster
+from database import Database
+
+
+def parse_time_of_day(text: str):
+    hours, minutes = text.split(':')
+    return timedelta(hours=int(hours), minutes=int(minutes))
+
+
+def birthday_month_days(day):
+    """Дни рождения 'ММ-ДД', которые празднуются в day; 29 февраля — 28-го в невисокосный год"""
+    month_days = [day.strftime('%m-%d')]
+    if month_days[0] == '02-28' and (day + timedelta(days=1)).month == 3:
+        month_days.append('02-29')
+    return month_days
+
+
+class DailyJob:
+    """Задача, выполняемая раз в день не раньше at и не позже at + jitter"""
+
+    def __init__(self, name: str, at: timedelta, jitter: float, run):
+        self.name = name
+        self.at = at
+        self.jitter = jitter
+        self.run = run
+
+
+class Scheduler:
+    """Запуск ежедневных задач с идемпотентностью через таблицу job_runs"""
+
+    def __init__(self, db: Database, broadcaster: Broadcaster):
+        self.db = db
+        self.broadcaster = broadcaster
+        self.concurrency = int(os.getenv('SCHEDULER_CONCURRENCY', '5'))
+        self.low_balance_threshold = int(os.getenv('LOW_BALANCE_THRESHOLD', '10'))
+        jitter = float(os.getenv('SCHEDULER_JITTER', '1800'))
+        self.jobs = [
+            DailyJob('birthdays', parse_time_of_day(os.getenv('BIRTHDAYS_AT', '10:00')), jitter, self.birthdays),
+            DailyJob('low_balance', parse_time_of_day(os.getenv('LOW_BALANCE_AT', '10:30')), jitter, self.low_balance),
+        ]
+        self.tasks = []
+
+    def start(self):
+        """Запускает цикл каждой задачи в фоне"""
+        if os.getenv('SCHEDULER_ENABLED', '1') == '0':
+            return
+        self.tasks = [asyncio.create_task(self._loop(job)) for job in self.jobs]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _loop(self, job: DailyJob):
+        while True:
+            now = datetime.now()
+            day = now.date()
+            run = await self.db.job_run(job.name, day.isoformat())
+            if run is not None and run[0] == 'done':
+                # Сегодня уже выполнено: ждем завтрашнего окна
+                day += timedelta(days=1)
+            due = datetime.combine(day, datetime.min.time()) + job.at + timedelta(seconds=random.uniform(0, job.jitter))
+            # Прерванный запуск продолжаем сразу, пропущенное окно — со сдвигом от текущего момента
+            if run is not None and run[0] == 'running':
+                due = now
+            elif due < now:
+                due = now + timedelta(seconds=random.uniform(0, min(job.jitter, 300)))
+            await asyncio.sleep((due - datetime.now()).total_seconds())
+            try:
+                await self.execute(job, day)
+            except Exception as e:
+                print(f"Error: {e}")
+                await asyncio.sleep(60)
+
+    async def execute(self, job: DailyJob, day):
+        """Выполняет задачу за день day, если она еще не завершена"""
+        run_key = day.isoformat()
+        run = await self.db.job_run(job.name, run_key)
+        if run is not None and run[0] == 'done':
+            return 0
+        await self.db.start_job_run(job.name, run_key)
+        sent = await job.run(run_key, day)
+        await self.db.finish_job_run(job.name, run_key, sent)
+        print(f"Задача {job.name} за {run_key}: отправлено {sent}")
+        return sent
+
+    async def notify(self, job: str, run_key: str, messages) -> int:
+        """Отправляет пары (user_id, текст), пропуская уже получивших; возвращает число отправленных"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(user_id, text):
+            async with semaphore:
+                if not await self.db.claim_notification(job, run_key, user_id):
+                    return False
+                return await self.broadcaster.send(user_id, text) == 'sent'
+
+        return sum(await asyncio.gather(*(send(user_id, text) for user_id, text in messages)))
+
+    async def birthdays(self, run_key: str, day) -> int:
+        """Поздравления клиентов, у которых сегодня день рождения (индекс по birth_md)"""
+        messages = []
+        for user_id, fullname in await self.db.birthdays(birthday_month_days(day)):
+            # ФИО записано как «Фамилия Имя Отчество»
+            words = (fullname or '').split()
+            name = words[1] if len(words) > 1 else ''
+            greeting = f"🎉 С днем рождения, {name}!" if name else "🎉 С днем рождения!"
+            messages.append((user_id, f"{greeting}\n\nЖелаем солнечного настроения и ждем вас в солярии!"))
+        return await self.notify('birthdays', run_key, messages)
+
+    async def low_balance(self, run_key: str, day) -> int:
+        """Напоминания клиентам, чей остаток опустился ниже порога с прошлого запуска"""
+        since = await self.db.last_job_run('low_balance') or int(time.time()) - 24 * 3600
+        messages = [
+            (user_id, f"⏳ У вас осталось {minutes} мин.\n\n"
+                      f"Пополните абонемент у администратора, чтобы не прерывать курс загара.")
+            for user_id, minutes in await self.db.low_balance_clients(since, self.low_balance_threshold)
+        ]
+        return await self.notify('low_balance', run_key, messages)
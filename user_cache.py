@@ -0,0 +1,71 @@
+from collections import OrderedDict
+import time
+
+# Отметка «пользователя нет в базе» для отрицательного кэширования
+MISSING = object()
+
+
+class UserCache:
+    """LRU-кэш профилей пользователей с TTL, отрицательными записями и статистикой"""
+
+    def __init__(self, max_items: int = 10000, ttl: float = 300, negative_ttl: float = 30):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.items = OrderedDict()
+        # Счетчики инвалидаций: чтение, начатое до invalidate, не должно попасть в кэш
+        self.generations = {}
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int):
+        """Профиль, MISSING или None, если в кэше ничего нет"""
+        entry = self.items.get(user_id)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self.items[user_id]
+            self.misses += 1
+            return None
+        self.items.move_to_end(user_id)
+        self.hits += 1
+        return entry[0]
+
+    def generation(self, user_id: int):
+        """Метка версии записи; берется до чтения из базы и передается в put"""
+        return self.epoch, self.generations.get(user_id, 0)
+
+    def put(self, user_id: int, profile, generation=None):
+        """Сохраняет профиль; None означает, что пользователя нет
+
+        Если с момента generation запись инвалидировали, прочитанный профиль устарел и не сохраняется.
+        """
+        if generation is not None and generation != self.generation(user_id):
+            return
+        if profile is None:
+            value, ttl = MISSING, self.negative_ttl
+        else:
+            value, ttl = profile, self.ttl
+        self.items[user_id] = (value, time.monotonic() + ttl)
+        self.items.move_to_end(user_id)
+        if len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """Удаляет запись после изменения пользователя"""
+        self.items.pop(user_id, None)
+        self.generations[user_id] = self.generations.get(user_id, 0) + 1
+        if len(self.generations) > self.max_items:
+            # Сброс счетчиков меняет эпоху, так что старые метки все равно не совпадут
+            self.generations.clear()
+            self.epoch += 1
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,129 @@
+"""
+Поиск клиентов для администратора: по ID, части телефона, ФИО и username.
+
+ФИО и username ищутся через FTS5-таблицу users_fts, которую триггеры держат
+в согласии с users. Телефоны — через индекс в памяти: отсортированные массивы
+10-значных номеров и номеров, записанных задом наперед, так что начало и
+конец номера находятся двоичным поиском. На 300 тысяч клиентов индекс
+занимает около 10 МБ.
+"""
+from array import array
+from bisect import bisect_left
+import os
+import re
+
+from database import Database
+
+NATIONAL_DIGITS = 10
+# Слова запроса так же, как их режет токенизатор unicode61: «_» — разделитель
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def national_number(phone):
+    """10 цифр номера без кода страны или None"""
+    digits = ''.join(c for c in phone or '' if c.isdigit())
+    if len(digits) == NATIONAL_DIGITS + 1 and digits[0] in '78':
+        digits = digits[1:]
+    return digits if len(digits) == NATIONAL_DIGITS else None
+
+
+def fts_query(text: str):
+    """Префиксный запрос FTS5: все слова должны встретиться в ФИО или username"""
+    return ' '.join(f'"{word}"*' for word in WORD_RE.findall(text.lower()))
+
+
+class PhoneIndex:
+    """Поиск по началу и концу номера телефона двоичным поиском"""
+
+    def __init__(self):
+        self.numbers = array('q')
+        self.number_ids = array('q')
+        self.reversed = array('q')
+        self.reversed_ids = array('q')
+
+    def load(self, rows):
+        """Строит индекс по парам (user_id, phone)"""
+        forward = []
+        backward = []
+        for user_id, phone in rows:
+            number = national_number(phone)
+            if number:
+                forward.append((int(number), user_id))
+                backward.append((int(number[::-1]), user_id))
+        forward.sort()
+        backward.sort()
+        self.numbers = array('q', (key for key, _ in forward))
+        self.number_ids = array('q', (user_id for _, user_id in forward))
+        self.reversed = array('q', (key for key, _ in backward))
+        self.reversed_ids = array('q', (user_id for _, user_id in backward))
+
+    def add(self, user_id: int, phone: str):
+        number = national_number(phone)
+        if not number:
+            return
+        for keys, ids, key in ((self.numbers, self.number_ids, int(number)),
+                               (self.reversed, self.reversed_ids, int(number[::-1]))):
+            i = bisect_left(keys, key)
+            keys.insert(i, key)
+            ids.insert(i, user_id)
+
+    @staticmethod
+    def _range(keys, ids, prefix: str, limit: int):
+        # Все номера, начинающиеся с prefix, лежат в одном отрезке массива
+        scale = 10 ** (NATIONAL_DIGITS - len(prefix))
+        low = int(prefix) * scale
+        start = bisect_left(keys, low)
+        end = bisect_left(keys, low + scale, start)
+        return list(ids[start:min(end, start + limit)])
+
+    def search(self, digits: str, limit: int):
+        """ID клиентов, чей номер начинается или заканчивается на digits"""
+        prefixes = [digits]
+        # «8952…» и «+7952…» — тот же номер, что и «952…»
+        if digits[0] in '78':
+            prefixes.append(digits[1:])
+        found = []
+        for prefix in prefixes:
+            if 0 < len(prefix) <= NATIONAL_DIGITS:
+                found += self._range(self.numbers, self.number_ids, prefix, limit)
+        if len(digits) <= NATIONAL_DIGITS:
+            found += self._range(self.reversed, self.reversed_ids, digits[::-1], limit)
+        return list(dict.fromkeys(found))[:limit]
+
+    def __len__(self):
+        return len(self.numbers)
+
+
+class UserSearch:
+    """Поиск клиента по ID, телефону, ФИО или @username"""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.limit = int(os.getenv('USER_SEARCH_LIMIT', '10'))
+        # Короткий запрос из цифр совпадет с половиной базы, ищем от трех цифр
+        self.min_digits = int(os.getenv('USER_SEARCH_MIN_DIGITS', '3'))
+        self.phones = PhoneIndex()
+
+    async def load(self):
+        """Строит индекс телефонов; вызывается при запуске бота"""
+        self.phones.load(await self.db.user_phones())
+
+    def add(self, user_id: int, phone: str):
+        """Добавляет телефон нового клиента в индекс"""
+        self.phones.add(user_id, phone)
+
+    async def search(self, text: str, limit: int = None):
+        """Строки (user_id, fullname, username, phone, number_minutes), лучшие совпадения первыми"""
+        limit = limit or self.limit
+        text = text.strip()
+        digits = ''.join(c for c in text if c.isdigit())
+        if digits and not any(c.isalpha() for c in text):
+            if len(digits) < self.min_digits:
+                return []
+            # Сначала точное совпадение с ID Telegram, затем телефоны
+            ids = [int(digits)] + self.phones.search(digits, limit)
+            return (await self.db.users_by_ids(list(dict.fromkeys(ids))))[:limit]
+        query = fts_query(text.lstrip('@'))
+        if not query:
+            return []
+        return await self.db.search_users(query, limit)
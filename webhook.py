@@ -0,0 +1,68 @@
+import json
+import os
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+from lanes import LaneDispatcher
+
+
+class WebhookServer:
+    """aiohttp-сервер для приема обновлений Telegram через webhook"""
+
+    def __init__(self, dp: LaneDispatcher):
+        self.dp = dp
+        self.path = os.getenv('WEBHOOK_PATH', '/webhook')
+        self.secret = os.getenv('WEBHOOK_SECRET')
+        self.host = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+        self.port = int(os.getenv('WEBHOOK_PORT', '8080'))
+        self.keepalive = float(os.getenv('WEBHOOK_KEEPALIVE', '75'))
+        # Обновления Telegram занимают килобайты; большие тела отклоняются сразу
+        max_body = int(os.getenv('WEBHOOK_MAX_BODY', str(256 * 1024)))
+        self.runner = None
+        self.app = web.Application(client_max_size=max_body)
+        self.app.router.add_post(self.path, self.handle_update)
+        self.app.router.add_get('/health', self.handle_health)
+
+    async def handle_update(self, request: web.Request):
+        """Подтверждает обновление сразу, обработка идет в фоне"""
+        if self.secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret:
+            return web.Response(status=403)
+        try:
+            update = types.Update(**await request.json(loads=json.loads))
+        except (ValueError, TypeError):
+            return web.Response(status=400)
+
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        # Отброшенное при перегрузке обновление тоже подтверждаем: повтор от Telegram
+        # пришел бы в ту же переполненную очередь
+        self.dp.submit(update)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request):
+        """Проверка живости для балансировщика"""
+        return web.json_response({'status': 'ok', 'in_flight': self.dp.pending})
+
+    async def start(self):
+        """Запускает HTTP-сервер"""
+        self.runner = web.AppRunner(self.app, keepalive_timeout=self.keepalive, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def stop(self):
+        """Останавливает сервер и дожидается обработки принятых обновлений"""
+        if self.runner is not None:
+            await self.runner.cleanup()
+        await self.dp.drain()
+
+
+async def start_webhook(dp: LaneDispatcher):
+    """Поднимает сервер и регистрирует webhook в Telegram"""
+    url = os.getenv('WEBHOOK_URL')
+    if not url:
+        raise ValueError("Не указан WEBHOOK_URL в .env файле")
+    server = WebhookServer(dp)
+    await server.start()
+    await dp.bot.set_webhook(url.rstrip('/') + server.path, secret_token=server.secret)
+    return server